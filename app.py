@@ -1,3 +1,4 @@
+import multiprocessing
 from pathlib import Path
 
 # Carrega variáveis do .env (opcional)
@@ -14,4 +15,6 @@ except Exception:
 from auditoria.gui import App
 
 if __name__ == "__main__":
+    # Necessário no executável do PyInstaller quando o parse paralelo (workers) está ligado
+    multiprocessing.freeze_support()
     App().mainloop()
@@ -1,14 +1,13 @@
+import multiprocessing
 import sys
 import os
-import zipfile
-import tempfile
 from pathlib import Path
 
 # Adiciona a pasta atual ao caminho do Python
 sys.path.append(str(Path(__file__).parent))
 
 try:
-    from auditoria.audit import auditar_pasta_pai, AuditConfig
+    from auditoria.audit import auditar_pasta_pai, AuditConfig, listar_empresas_zip
 except ImportError:
     print("❌ Erro crítico: Não foi possível importar o sistema 'auditoria'.")
     input("Pressione ENTER para sair...")
@@ -62,51 +61,53 @@ def main():
         print("Cancelado.")
         return
 
+    # Bases grandes: Parquet/CSV completos para o BI e Excel só com as divergências
+    bi = input("Gerar também Parquet/CSV para BI (Excel só com divergências)? (S/N): ").upper()
+    config = AuditConfig()
+    if bi == 'S':
+        config.formatos_saida = ("xlsx", "parquet", "csv")
+        config.xlsx_so_divergentes = True
+
     # 4. Executa a Auditoria
     # Define o nome do relatório final na raiz
     arquivo_saida = base_dir / f"Relatorio_Final_{mes_input}.xlsx"
 
-    with tempfile.TemporaryDirectory() as tmp_dir:
-        pasta_temp = Path(tmp_dir)
-        print("\n⏳ Extraindo e processando... Aguarde.")
-        
-        try:
-            with zipfile.ZipFile(arquivo_zip, "r") as z:
-                z.extractall(pasta_temp)
-            
-            # Pega as pastas extraídas
-            empresas = [p for p in pasta_temp.iterdir() if p.is_dir()]
-            if not empresas: empresas = [pasta_temp]
-
-            caminho_final = auditar_pasta_pai(
-                pasta_pai=pasta_temp,
-                empresas=empresas,
-                excel_path=str(arquivo_excel),
-                saida=str(arquivo_saida),
-                mes_filtro=mes_input,  # Filtra o Excel pelo mês digitado
-                config=AuditConfig()
-            )
-
-            print("\n" + "="*60)
-            print(f"✅ SUCESSO! Relatório gerado.")
-            print(f"📄 Resultado: {caminho_final}")
-            print("="*60)
-
-            # Abre automaticamente no Windows (CORRIGIDO PARA EVITAR ERRO)
-            if os.name == 'nt':
-                # Pega apenas a primeira linha (o caminho real) e ignora o texto de avisos
-                arquivo_limpo = caminho_final.split('\n')[0].strip()
+    print("\n⏳ Processando direto do ZIP (sem extrair)... Aguarde.")
+
+    try:
+        # As pastas de 1º nível do ZIP são as empresas
+        empresas = listar_empresas_zip(arquivo_zip)
+
+        caminho_final = auditar_pasta_pai(
+            pasta_pai=arquivo_zip,
+            empresas=empresas,
+            excel_path=str(arquivo_excel),
+            saida=str(arquivo_saida),
+            mes_filtro=mes_input,  # Filtra o Excel pelo mês digitado
+            config=config
+        )
+
+        print("\n" + "="*60)
+        print(f"✅ SUCESSO! Relatório gerado.")
+        print(f"📄 Resultado: {caminho_final}")
+        print("="*60)
+
+        # Abre automaticamente no Windows (CORRIGIDO PARA EVITAR ERRO)
+        if os.name == 'nt':
+            # Pega apenas a primeira linha (o caminho real) e ignora o texto de avisos
+            arquivo_limpo = caminho_final.split('\n')[0].strip()
                 
-                if os.path.exists(arquivo_limpo):
-                    os.startfile(arquivo_limpo)
-                else:
-                    print(f"⚠️ Arquivo gerado, mas não encontrado para abertura automática: {arquivo_limpo}")
+            if os.path.exists(arquivo_limpo):
+                os.startfile(arquivo_limpo)
+            else:
+                print(f"⚠️ Arquivo gerado, mas não encontrado para abertura automática: {arquivo_limpo}")
                 
-        except Exception as e:
-            print(f"\n❌ Erro fatal: {e}")
-            import traceback
-            traceback.print_exc()
-            input("\nPressione ENTER para ver o erro...")
+    except Exception as e:
+        print(f"\n❌ Erro fatal: {e}")
+        import traceback
+        traceback.print_exc()
+        input("\nPressione ENTER para ver o erro...")
 
 if __name__ == "__main__":
+    multiprocessing.freeze_support()
     main()
\ No newline at end of file
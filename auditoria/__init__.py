@@ -1 +1 @@
-__all__ = ["gui", "audit", "excel_loader", "xml_parser", "report", "utils"]
+__all__ = ["gui", "audit", "excel_loader", "xml_parser", "xml_batch", "conciliacao", "report", "utils"]
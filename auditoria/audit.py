@@ -1,14 +1,26 @@
 import os
+import posixpath
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass
 from pathlib import Path
-from typing import Dict, List, Optional, Tuple
+from typing import Dict, List, Optional, Sequence, Tuple, Union
 
 import pandas as pd
 
-from .excel_loader import carregar_excel
-from .report import gerar_relatorio, gerar_relatorio_avisos
-from .utils import safe_float
-from .xml_parser import parse_xml_file
+from .conciliacao import conciliar, conciliar_sql
+from .excel_loader import (
+    VERSAO_EXCEL_LOADER,
+    carregar_abas,
+    carregar_excel,
+    impressoes_digitais_abas,
+    layouts_novos,
+    listar_abas_alvo,
+    registrar_layouts,
+)
+from .report import gerar_relatorio, gerar_relatorio_avisos, resolver_saida
+from .xml_batch import impressoes_digitais, parse_xmls_em_lotes
+from .xml_parser import VERSAO_PARSER
 
 # <--- DB: Importa a classe de banco de dados
 from .database import AuditDB 
@@ -18,6 +30,33 @@ class AuditConfig:
     tolerancia_cte: float = 50.0
     tolerancia_nfe: float = 5.0
     tolerancia_volume: float = 1.0
+    # Processos para o parse dos XMLs: 1 = serial (padrão), 0 = autodetecta núcleos
+    workers: int = 1
+    # Parser iterparse com memória constante (NF-e com centenas de itens)
+    xml_streaming: bool = False
+    # Leitura do Excel em modo read-only, por blocos (bases muito grandes)
+    excel_streaming: bool = False
+    # Processos para ler as abas do Excel: 1 = serial (padrão), 0 = autodetecta núcleos
+    excel_workers: int = 1
+    # Cache persistente dos resultados de parse (só relê XMLs novos/alterados)
+    cache_parse: bool = True
+    cache_max_entradas: int = 1_000_000
+    # Cache das abas do Excel já normalizadas (só relê abas alteradas); False = sempre relê
+    cache_excel: bool = True
+    cache_excel_max_abas: int = 500
+    db_path: str = "auditoria.db"
+    # Histórico no AuditDB: quantos runs manter (0 = todos; o último de cada mês nunca sai)
+    historico_max_runs: int = 0
+    # Compacta o AuditDB quando a retenção já apagou esta fração das linhas de fatos (0 = nunca)
+    historico_compactar_fracao: float = 0.25
+    # XMLs gravados no AuditDB em lotes deste tamanho, durante o parse
+    db_lote_xml: int = 5000
+    # Motor da conciliação: "pandas" (padrão) ou "duckdb" (SQL sobre raw_excel/raw_xmls do run)
+    backend_conciliacao: str = "pandas"
+    # Formatos do relatório principal ("xlsx", "parquet", "csv"); ex.: ("parquet",) para BI
+    formatos_saida: Tuple[str, ...] = ("xlsx",)
+    # Excel estilizado só com as linhas divergentes (Parquet/CSV continuam completos)
+    xlsx_so_divergentes: bool = False
 
 def coletar_xmls_por_empresas(pasta_pai: Path, empresas: List[Path]) -> List[Tuple[str, str]]:
     out: List[Tuple[str, str]] = []
@@ -32,25 +71,141 @@ def coletar_xmls_por_empresas(pasta_pai: Path, empresas: List[Path]) -> List[Tup
     out.sort(key=lambda t: (t[0].lower(), os.path.basename(t[1]).lower()))
     return out
 
-def auditar_pasta_pai(
-    pasta_pai: Path,
-    empresas: List[Path],
-    excel_path: str,
-    saida: Optional[str] = None,
+# ============================================================
+# Fonte ZIP: auditoria direto do arquivo compactado, sem extrair
+# ============================================================
+def eh_zip(caminho) -> bool:
+    p = Path(caminho)
+    return p.suffix.lower() == ".zip" and p.is_file()
+
+def _empresa_do_membro(nome: str) -> Optional[str]:
+    partes = nome.split("/", 1)
+    if len(partes) < 2 or partes[0] in ("", "__MACOSX"):
+        return None
+    return partes[0]
+
+def listar_empresas_zip(zip_path) -> List[str]:
+    """Pastas de primeiro nível do ZIP (cada uma é uma empresa)."""
+    with zipfile.ZipFile(zip_path) as z:
+        nomes = {_empresa_do_membro(n) for n in z.namelist()}
+    nomes.discard(None)
+    return sorted(nomes, key=str.lower)
+
+def coletar_xmls_do_zip(zip_path, empresas: Optional[Sequence[Union[str, Path]]] = None) -> List[Tuple[str, str]]:
+    """
+    Mesmo contrato de coletar_xmls_por_empresas, mas devolvendo (empresa, membro do ZIP).
+    Sem pastas no ZIP, os XMLs da raiz ficam numa empresa com o nome do arquivo.
+    """
+    filtro = {Path(e).name for e in empresas} if empresas else None
+    out: List[Tuple[str, str]] = []
+    with zipfile.ZipFile(zip_path) as z:
+        membros = [i.filename for i in z.infolist() if not i.is_dir() and i.filename.lower().endswith(".xml")]
+
+    tem_pastas = any(_empresa_do_membro(m) for m in membros)
+    for m in membros:
+        empresa = _empresa_do_membro(m) if tem_pastas else Path(zip_path).stem
+        if empresa is None:
+            continue
+        if filtro is not None and empresa not in filtro:
+            continue
+        out.append((empresa, m))
+    out.sort(key=lambda t: (t[0].lower(), posixpath.basename(t[1]).lower()))
+    return out
+
+def carregar_excel_com_cache(db: AuditDB, excel_path: str, config: AuditConfig, mes_filtro: Optional[str] = None) -> pd.DataFrame:
+    """
+    carregar_excel reaproveitando do AuditDB as abas cujo XML (e textos usados) não mudou
+    desde a última leitura; só as abas novas/alteradas são lidas e normalizadas de novo.
+    Os layouts de cabeçalho já resolvidos também vêm do banco (e os novos vão para ele).
+    """
+    registrar_layouts(db.buscar_layouts_excel(VERSAO_EXCEL_LOADER))
+    try:
+        return _carregar_abas_com_cache(db, excel_path, config, mes_filtro)
+    finally:
+        db.salvar_layouts_excel(layouts_novos(), VERSAO_EXCEL_LOADER)
+
+def _carregar_abas_com_cache(db: AuditDB, excel_path: str, config: AuditConfig, mes_filtro: Optional[str]) -> pd.DataFrame:
+    digitais = impressoes_digitais_abas(excel_path, mes_filtro) if config.cache_excel else {}
+    if not digitais:
+        return carregar_excel(
+            excel_path, mes_filtro=mes_filtro, streaming=config.excel_streaming, workers=config.excel_workers
+        )
+
+    chave = os.path.abspath(excel_path)
+    em_cache = db.buscar_cache_excel(chave, digitais, VERSAO_EXCEL_LOADER)
+    print(f"[Cache] {len(em_cache)} de {len(digitais)} aba(s) do Excel reaproveitadas do cache.")
+
+    pendentes = [aba for aba in digitais if aba not in em_cache]
+    novas = carregar_abas(excel_path, pendentes, streaming=config.excel_streaming, workers=config.excel_workers)
+    if novas:
+        db.salvar_cache_excel(chave, {aba: (*digitais[aba], df) for aba, df in novas.items()}, VERSAO_EXCEL_LOADER)
+        db.podar_cache_excel(config.cache_excel_max_abas)
+
+    dados = [em_cache[aba] if aba in em_cache else novas[aba] for aba in digitais]
+    dados = [df for df in dados if not df.empty]
+    return pd.concat(dados, ignore_index=True) if dados else pd.DataFrame()
+
+def gerar_arquivos(
+    relatorio: List[Dict],
+    saida: Optional[str],
+    df_duplicadas: pd.DataFrame,
+    notas_sem_xml: List[Dict],
+    xmls_duplicados: List[Dict],
     config: Optional[AuditConfig] = None,
-    mes_filtro: Optional[str] = None,
-) -> str:
+) -> Tuple[str, str]:
+    """
+    Gera o Relatório Principal (XLSX + PDF) e o de Avisos (Duplicatas e Sem XML)
+    ao mesmo tempo, esperando os dois; o PDF (Gemini) termina em segundo plano.
+    Falha no AVISOS (ex.: arquivo aberto) ou no PDF só vira aviso no console;
+    falha no principal é propagada.
+    Retorna (caminho_resultado, caminho_avisos), com "" para o que não foi gerado.
+    """
     if config is None:
         config = AuditConfig()
 
-    # <--- DB: Inicializa o banco de dados
-    print("Inicializando banco de dados DuckDB...")
-    db = AuditDB()
-    db.inicializar()
+    # O caminho é fixado antes: o nome do AVISOS deriva do resultado
+    saida = resolver_saida(saida) if relatorio else saida
+    tem_avisos = not df_duplicadas.empty or bool(notas_sem_xml) or bool(xmls_duplicados)
+
+    with ThreadPoolExecutor(max_workers=2) as ex:
+        fut_resultado = ex.submit(
+            gerar_relatorio, relatorio, saida=saida,
+            formatos=config.formatos_saida, xlsx_so_divergentes=config.xlsx_so_divergentes,
+            esperar_pdf=False,
+        )
+        fut_avisos = (
+            ex.submit(gerar_relatorio_avisos, df_duplicadas, notas_sem_xml, saida or "", xmls_duplicados)
+            if tem_avisos else None
+        )
+
+    caminho_avisos = ""
+    if fut_avisos is not None:
+        try:
+            caminho_avisos = fut_avisos.result()
+        except Exception as e:
+            print(f"⚠️ AVISO: relatório de AVISOS não gerado: {e}")
+    return fut_resultado.result(), caminho_avisos
 
-    # 1. Carrega Excel Bruto
-    df_base = carregar_excel(excel_path)
+def _auditar_run(
+    db: AuditDB,
+    pasta_pai: Path,
+    empresas: Sequence[Union[str, Path]],
+    excel_path: str,
+    config: AuditConfig,
+    mes_filtro: Optional[str],
+) -> Tuple[List[Dict], pd.DataFrame, List[Dict], List[Dict]]:
+    """
+    Carga do Excel, parse dos XMLs e conciliação dentro do run aberto em `db`.
+    Devolve (relatorio, df_duplicadas, notas_sem_xml, xmls_duplicados).
+    """
+    # No motor duckdb o agrupamento dos XMLs é feito pelo SQL, não em dicts do Python
+    agrupar_em_python = config.backend_conciliacao == "pandas"
+
+    # 1. Carrega Excel Bruto (só as abas do mês pedido)
+    df_base = carregar_excel_com_cache(db, excel_path, config, mes_filtro)
     if df_base.empty:
+        if mes_filtro and str(mes_filtro).strip() and listar_abas_alvo(excel_path):
+            raise RuntimeError(f"Atenção: Não existem notas para o mês '{mes_filtro}' no Excel.")
         raise RuntimeError("Não foi possível carregar os dados do Excel.")
 
     # 2. Aplica Filtro de Mês
@@ -92,33 +247,80 @@ def auditar_pasta_pai(
     if "Empresa" in df_base.columns:
         agg_dict["Empresa"] = "first"
 
-    df_agrupado = df_base.groupby("NF_Clean", as_index=False).agg(agg_dict)
+    df_agrupado = df_base.groupby("NF_Clean", as_index=False).agg(agg_dict) if agrupar_em_python else None
 
     # ============================================================
     # 4. Leitura e Soma dos XMLs
     # ============================================================
-    xmls_arquivos = coletar_xmls_por_empresas(pasta_pai, empresas)
+    # `pasta_pai` pode ser um .zip: as pastas de 1º nível viram empresas e os XMLs
+    # são lidos direto do arquivo compactado (inclusive pelos workers)
+    zip_path = str(pasta_pai) if eh_zip(pasta_pai) else None
+    if zip_path:
+        xmls_arquivos = coletar_xmls_do_zip(zip_path, empresas)
+    else:
+        xmls_arquivos = coletar_xmls_por_empresas(pasta_pai, empresas)
     xmls_agrupados: Dict[str, Dict] = {} 
+    # Índice de documentos já somados: chave de acesso (ou hash do conteúdo) -> arquivo mantido
+    docs_vistos: Dict[str, str] = {}
+    xmls_duplicados: List[Dict] = []
     
-    # <--- DB: Lista para armazenar todos os dados brutos dos XMLs para o banco
-    lista_dados_xml_brutos = []
-
-    for empresa_nome, xml_path in xmls_arquivos:
-        try:
-            info = parse_xml_file(xml_path)
-        except:
+    # <--- DB: Lote dos dados brutos dos XMLs, gravado no banco a cada `db_lote_xml` documentos
+    lote_db: List[Dict] = []
+
+    caminhos = [p for _, p in xmls_arquivos]
+    completo = (lambda p: os.path.join(zip_path, p)) if zip_path else str
+
+    # <--- DB: Cache de parse (chave = caminho completo + tamanho + mtime/CRC)
+    digitais: Dict[str, Tuple[int, str]] = {}
+    em_cache: Dict[str, Optional[Dict]] = {}
+    if config.cache_parse and caminhos:
+        digitais = impressoes_digitais(caminhos, zip_path)
+        hits = db.buscar_cache_parse({completo(p): d for p, d in digitais.items()}, VERSAO_PARSER)
+        em_cache = {p: hits[completo(p)] for p in digitais if completo(p) in hits}
+        print(f"[Cache] {len(em_cache)} de {len(caminhos)} XML(s) reaproveitados do cache de parse.")
+    novos_cache = []
+
+    lotes = parse_xmls_em_lotes(
+        caminhos, workers=config.workers, streaming=config.xml_streaming, zip_path=zip_path, cache=em_cache
+    )
+    infos = (info for lote in lotes for info in lote)
+
+    for ordem, ((empresa_nome, xml_path), info) in enumerate(zip(xmls_arquivos, infos)):
+        if info and "Erro" in info:
+            # Falha de leitura: não entra no cache, o arquivo é relido no próximo run
+            print(f"[XML] Não foi possível ler {completo(xml_path)}: {info['Erro']}")
             continue
+        if xml_path in digitais and xml_path not in em_cache:
+            novos_cache.append((completo(xml_path), *digitais[xml_path], dict(info) if info else None))
 
         if not info or not info.get("Nota"): continue
         
         # <--- DB: Adiciona info de arquivo e empresa para salvar no banco
         info['Arquivo'] = os.path.basename(xml_path)
-        info['CaminhoCompleto'] = str(xml_path)
+        info['CaminhoCompleto'] = completo(xml_path)
         info['Empresa'] = empresa_nome
-        lista_dados_xml_brutos.append(info) # Guarda na lista
+        info['Ordem'] = ordem
+        lote_db.append(info)
+        if len(lote_db) >= config.db_lote_xml:
+            db.salvar_xmls(lote_db)
+            lote_db = []
 
         nota = str(info["Nota"]).strip()
-        
+
+        # Mesmo documento em dois arquivos (nfeProc + NFe, cópia em outra empresa): soma uma vez só
+        doc_id = info.get("Chave") or info.get("Hash")
+        if doc_id:
+            if doc_id in docs_vistos:
+                xmls_duplicados.append({
+                    "Nota": nota, "Empresa": empresa_nome, "Arquivo": info["Arquivo"],
+                    "Chave": info.get("Chave", ""), "Mantido": docs_vistos[doc_id],
+                })
+                continue
+            docs_vistos[doc_id] = f"{empresa_nome}/{info['Arquivo']}"
+
+        if not agrupar_em_python:
+            continue
+
         if nota not in xmls_agrupados:
             xmls_agrupados[nota] = {
                 "Empresa": empresa_nome, "Tipo": info["Tipo"],
@@ -136,110 +338,72 @@ def auditar_pasta_pai(
         if nome_arq not in xmls_agrupados[nota]["Arquivos"]:
             xmls_agrupados[nota]["Arquivos"].append(nome_arq)
 
-    # <--- DB: Salva todos os XMLs processados no banco de uma vez
-    db.salvar_xmls(lista_dados_xml_brutos)
+    if xmls_duplicados:
+        print(f"[XML] {len(xmls_duplicados)} XML(s) duplicado(s) ignorado(s) na soma (mesma chave/conteúdo).")
+
+    # <--- DB: Salva o que sobrou no último lote
+    db.salvar_xmls(lote_db)
+    if novos_cache:
+        db.salvar_cache_parse(novos_cache, VERSAO_PARSER)
+        db.podar_cache_parse(config.cache_max_entradas)
 
     # ============================================================
     # 5. Comparação Final (Excel Agrupado vs XML Agrupado)
     # ============================================================
-    relatorio: List[Dict] = []
-    notas_sem_xml: List[Dict] = [] 
-    notas_xml_vistas = set()
-
-    for _, row in df_agrupado.iterrows():
-        nota_ex = str(row["NF_Clean"]).strip()
-        if not nota_ex or nota_ex.upper() == "NAN": continue
-
-        vol_ex = safe_float(row.get("Vol_Excel", 0))
-        liq_ex = safe_float(row.get("Liq_Excel", 0))
-
-        item: Dict = {
-            "Nota": nota_ex,
-            "Mes": row.get("Mes", "-"),
-            "Vol Excel": vol_ex,
-            "Liq Excel": liq_ex,
-            "ICMS Excel": safe_float(row.get("ICMS_Excel", 0)),
-            "PIS Excel": safe_float(row.get("PIS_Excel", 0)),
-            "COFINS Excel": safe_float(row.get("COFINS_Excel", 0)),
-            "Empresa": row.get("Empresa", "-"),
-            "Status": "PENDENTE",
-            "Obs": "",
-            "Tipo": "-",
-            "Arquivo": "-",
-        }
-
-        if nota_ex in xmls_agrupados:
-            xml = xmls_agrupados[nota_ex]
-            notas_xml_vistas.add(nota_ex)
-
-            item.update({
-                # Mantemos Empresa do Excel, e usamos tipo/arquivo/valores do XML
-                "Tipo": xml["Tipo"],
-                "Arquivo": ", ".join(xml["Arquivos"]),
-                "Vol XML": xml["Vol"],
-                "Bruto XML": xml["Bruto"],
-                "ICMS XML": xml["ICMS"],
-            })
-            
-            p_xml, c_xml = xml["PIS"], xml["COFINS"]
-            if xml["Tipo"] == "CT-e" and p_xml == 0 and item["PIS Excel"] != 0:
-                p_xml, c_xml = item["PIS Excel"], item["COFINS Excel"]
-                item["Obs"] = "CT-e: Usado impostos do Excel."
-            
-            item["PIS"], item["COFINS"] = p_xml, c_xml
-            
-            bruto = xml["Bruto"]
-            liq_calc = bruto - sum(v for v in (xml["ICMS"], p_xml, c_xml) if 0 < v < bruto)
-            item["Liq XML (Calc)"] = max(liq_calc, 0.0)
-            
-            item["Diff Vol"] = "-" if vol_ex == 0 else (xml["Vol"] - vol_ex)
-            item["Diff R$"] = item["Liq XML (Calc)"] - liq_ex
-
-            tol = config.tolerancia_cte if xml["Tipo"] == "CT-e" else config.tolerancia_nfe
-            v_ok = True if vol_ex == 0 else abs(float(item["Diff Vol"])) < config.tolerancia_volume
-            f_ok = abs(item["Diff R$"]) < tol
-
-            if v_ok and f_ok: item["Status"] = "OK ✅"
-            else:
-                errs = []
-                if not v_ok: errs.append("VOL")
-                if not f_ok: errs.append("VALOR")
-                item["Status"] = f"ERRO {'+'.join(errs)} ❌"
-        else:
-            item["Status"] = "SEM XML ❌"
-            item["Diff R$"] = 0.0 - liq_ex
-            item["Diff Vol"] = "-"
-            notas_sem_xml.append(item.copy())
-
-        relatorio.append(item)
-
-    # XMLs sobrantes
-    for nt, dados in xmls_agrupados.items():
-        if nt not in notas_xml_vistas:
-            relatorio.append({
-                "Nota": nt, "Status": "SEM EXCEL ❌", "Empresa": dados["Empresa"],
-                "Tipo": dados["Tipo"], "Vol XML": dados["Vol"], "Bruto XML": dados["Bruto"],
-                "Liq XML (Calc)": dados["Bruto"], "Arquivo": ", ".join(dados["Arquivos"]),
-                "Mes": "-", "Liq Excel": 0, "Vol Excel": 0
-            })
+    # Outer join Excel x XML pela nota, com diferenças e Status calculados por coluna
+    if agrupar_em_python:
+        relatorio, notas_sem_xml = conciliar(df_agrupado, xmls_agrupados, config)
+    else:
+        relatorio, notas_sem_xml = conciliar_sql(db.con, db.run_id, config)
 
     # <--- DB: Salva o relatório final no DuckDB para BI
     if relatorio:
         db.salvar_relatorio_final(pd.DataFrame(relatorio))
-    
-    db.fechar()
+
+    return relatorio, df_duplicadas, notas_sem_xml, xmls_duplicados
+
+
+def auditar_pasta_pai(
+    pasta_pai: Path,
+    empresas: Sequence[Union[str, Path]],
+    excel_path: str,
+    saida: Optional[str] = None,
+    config: Optional[AuditConfig] = None,
+    mes_filtro: Optional[str] = None,
+) -> str:
+    if config is None:
+        config = AuditConfig()
+    if config.backend_conciliacao not in ("pandas", "duckdb"):
+        raise ValueError(f"backend_conciliacao inválido: {config.backend_conciliacao!r} (use 'pandas' ou 'duckdb').")
+
+    # <--- DB: Inicializa o banco de dados
+    print("Inicializando banco de dados DuckDB...")
+    db = AuditDB(config.db_path)
+    try:
+        db.inicializar()
+        db.iniciar_run(mes_filtro=mes_filtro, excel_path=str(excel_path), origem_xml=str(pasta_pai))
+        try:
+            relatorio, df_duplicadas, notas_sem_xml, xmls_duplicados = _auditar_run(
+                db, pasta_pai, empresas, excel_path, config, mes_filtro
+            )
+        except Exception:
+            # Run com erro (Excel vazio, falha no parse, ...): não vale como último do mês
+            db.finalizar_run(status="ERRO")
+            raise
+        db.finalizar_run()
+        if config.historico_max_runs:
+            db.reter_runs(manter_ultimos=config.historico_max_runs)
+            db.compactar_se_preciso(config.historico_compactar_fracao)
+    finally:
+        db.fechar()
     # <--- Fim DB
 
     # --- GERAÇÃO DOS ARQUIVOS ---
     
-    # 1. Relatório Principal (Resultado da Auditoria)
-    caminho_resultado = gerar_relatorio(relatorio, saida=saida)
-    
-    # 2. Relatório de Avisos (Duplicatas e Sem XML)
-    caminho_avisos = ""
-    if not df_duplicadas.empty or notas_sem_xml:
-        caminho_avisos = gerar_relatorio_avisos(df_duplicadas, notas_sem_xml, caminho_resultado)
-        
+    caminho_resultado, caminho_avisos = gerar_arquivos(
+        relatorio, saida, df_duplicadas, notas_sem_xml, xmls_duplicados, config
+    )
+    if caminho_avisos:
         try:
             os.startfile(caminho_avisos)
         except:
@@ -0,0 +1,254 @@
+from typing import Dict, Iterable, List, Tuple
+
+import numpy as np
+import pandas as pd
+
+STATUS_OK = "OK ✅"
+STATUS_SEM_XML = "SEM XML ❌"
+STATUS_SEM_EXCEL = "SEM EXCEL ❌"
+OBS_CTE_IMPOSTOS_EXCEL = "CT-e: Usado impostos do Excel."
+
+_CAMPOS_XML_SOMADOS = ("Vol", "Bruto", "ICMS", "PIS", "COFINS")
+
+
+def _coluna_float(df: pd.DataFrame, nome: str) -> np.ndarray:
+    """Mesma regra do safe_float: ausente/NaN/texto inválido viram 0.0."""
+    if nome not in df.columns:
+        return np.zeros(len(df))
+    return pd.to_numeric(df[nome], errors="coerce").fillna(0.0).to_numpy(dtype=float)
+
+
+def _alinhar(valores: List, pos: np.ndarray, vazio, dtype=None) -> np.ndarray:
+    # Sentinela no fim: pos == -1 (nota sem XML) cai nele
+    return np.asarray(valores + [vazio], dtype=dtype)[pos]
+
+
+def conciliar(df_agrupado: pd.DataFrame, xmls_agrupados: Dict[str, Dict], config) -> Tuple[List[Dict], List[Dict]]:
+    """
+    Cruza o Excel agrupado por nota com os XMLs agrupados (outer join pela nota).
+    Diferenças, tolerâncias e Status são calculados em colunas inteiras de uma vez.
+
+    Devolve (relatorio, notas_sem_xml) no mesmo formato de antes: as linhas do Excel
+    na ordem do agrupamento, seguidas das notas "SEM EXCEL" na ordem de leitura dos XMLs.
+    """
+    notas = df_agrupado["NF_Clean"].astype(str).str.strip()
+    validas = ((notas != "") & (notas.str.upper() != "NAN")).to_numpy(dtype=bool)
+    ex = df_agrupado.loc[validas]
+    notas_ex = notas[validas].tolist()
+
+    # Posição de cada nota do Excel entre os XMLs (-1 = sem XML)
+    pos = pd.Index(list(xmls_agrupados), dtype=object).get_indexer(notas_ex)
+    tem_xml = pos >= 0
+
+    vol_ex = _coluna_float(ex, "Vol_Excel")
+    liq_ex = _coluna_float(ex, "Liq_Excel")
+    icms_ex = _coluna_float(ex, "ICMS_Excel")
+    pis_ex = _coluna_float(ex, "PIS_Excel")
+    cofins_ex = _coluna_float(ex, "COFINS_Excel")
+
+    grupos = list(xmls_agrupados.values())
+    vol, bruto, icms, pis, cofins = (
+        _alinhar([d[c] for d in grupos], pos, 0.0, float) for c in _CAMPOS_XML_SOMADOS
+    )
+    tipo = _alinhar([d["Tipo"] for d in grupos], pos, "-", object)
+    empresa_xml = _alinhar([d["Empresa"] for d in grupos], pos, "-", object)
+    arquivo = _alinhar([", ".join(d["Arquivos"]) for d in grupos], pos, "-", object)
+    eh_cte = tipo == "CT-e"
+
+    # CT-e sem PIS/COFINS no XML: usa os impostos do Excel
+    usa_excel = tem_xml & eh_cte & (pis == 0) & (pis_ex != 0)
+    pis = np.where(usa_excel, pis_ex, pis)
+    cofins = np.where(usa_excel, cofins_ex, cofins)
+
+    def _abatimento(v: np.ndarray) -> np.ndarray:
+        return np.where((v > 0) & (v < bruto), v, 0.0)
+
+    liq_xml = np.maximum(bruto - (_abatimento(icms) + _abatimento(pis) + _abatimento(cofins)), 0.0)
+    diff_vol = vol - vol_ex
+    diff_rs = np.where(tem_xml, liq_xml - liq_ex, 0.0 - liq_ex)
+
+    tol = np.where(eh_cte, config.tolerancia_cte, config.tolerancia_nfe)
+    v_ok = (vol_ex == 0) | (np.abs(diff_vol) < config.tolerancia_volume)
+    f_ok = np.abs(diff_rs) < tol
+    status = np.select(
+        [~tem_xml, v_ok & f_ok, ~v_ok & ~f_ok, ~v_ok],
+        [STATUS_SEM_XML, STATUS_OK, "ERRO VOL+VALOR ❌", "ERRO VOL ❌"],
+        default="ERRO VALOR ❌",
+    )
+
+    mes = ex["Mes"].tolist() if "Mes" in ex.columns else ["-"] * len(ex)
+    # Empresa: a da planilha, se vier; senão a pasta/empresa do XML casado
+    empresa = empresa_xml.tolist()
+    if "Empresa" in ex.columns:
+        empresa = [e if pd.notna(e) else x for e, x in zip(ex["Empresa"].tolist(), empresa)]
+
+    # XMLs sobrantes (anti-join), na ordem em que foram lidos
+    vistas = set(n for n, achou in zip(notas_ex, tem_xml.tolist()) if achou)
+    sobras = (
+        (nt, dados["Empresa"], dados["Tipo"], dados["Vol"], dados["Bruto"], ", ".join(dados["Arquivos"]))
+        for nt, dados in xmls_agrupados.items()
+        if nt not in vistas
+    )
+
+    return _montar_linhas(
+        zip(
+            notas_ex, mes, empresa, tem_xml.tolist(), usa_excel.tolist(), status.tolist(), tipo.tolist(),
+            arquivo.tolist(), vol_ex.tolist(), liq_ex.tolist(), icms_ex.tolist(), pis_ex.tolist(),
+            cofins_ex.tolist(), vol.tolist(), bruto.tolist(), icms.tolist(), pis.tolist(), cofins.tolist(),
+            liq_xml.tolist(), diff_vol.tolist(), diff_rs.tolist(),
+        ),
+        sobras,
+    )
+
+
+def _montar_linhas(linhas: Iterable[tuple], sobras: Iterable[tuple]) -> Tuple[List[Dict], List[Dict]]:
+    """
+    Dicts do relatório a partir das colunas já calculadas (mesmo formato nos dois motores).
+    `linhas`: notas do Excel, na ordem de _COLUNAS_LINHA; `sobras`: XMLs sem Excel, na
+    ordem (nota, empresa, tipo, vol, bruto, arquivos).
+    """
+    relatorio: List[Dict] = []
+    notas_sem_xml: List[Dict] = []
+    for (nota, m, emp, achou, obs_cte, st, tp, arq, v_ex, l_ex, i_ex, p_ex, c_ex,
+         v, b, i, p, c, l_xml, d_vol, d_rs) in linhas:
+        item: Dict = {
+            "Nota": nota, "Mes": m, "Vol Excel": v_ex, "Liq Excel": l_ex,
+            "ICMS Excel": i_ex, "PIS Excel": p_ex, "COFINS Excel": c_ex,
+            "Empresa": emp, "Status": st, "Obs": OBS_CTE_IMPOSTOS_EXCEL if obs_cte else "",
+            "Tipo": tp, "Arquivo": arq,
+        }
+        if achou:
+            item.update({
+                "Vol XML": v, "Bruto XML": b, "ICMS XML": i, "PIS": p, "COFINS": c,
+                "Liq XML (Calc)": l_xml, "Diff Vol": "-" if v_ex == 0 else d_vol, "Diff R$": d_rs,
+            })
+        else:
+            item["Diff R$"] = d_rs
+            item["Diff Vol"] = "-"
+            notas_sem_xml.append(item.copy())
+        relatorio.append(item)
+
+    for nt, emp, tp, v, b, arqs in sobras:
+        relatorio.append({
+            "Nota": nt, "Status": STATUS_SEM_EXCEL, "Empresa": emp,
+            "Tipo": tp, "Vol XML": v, "Bruto XML": b,
+            "Liq XML (Calc)": b, "Arquivo": arqs,
+            "Mes": "-", "Liq Excel": 0, "Vol Excel": 0
+        })
+
+    return relatorio, notas_sem_xml
+
+
+# Colunas devolvidas pelo SQL, na ordem que _montar_linhas espera
+_COLUNAS_LINHA = [
+    "nota", "mes", "empresa", "tem_xml", "usa_excel", "status", "tipo", "arquivo",
+    "vol_ex", "liq_ex", "icms_ex", "pis_ex", "cofins_ex", "vol", "bruto", "icms", "pis", "cofins",
+    "liq_xml", "diff_vol", "diff_rs",
+]
+
+_SQL_BASE = """
+WITH ex AS (
+    -- Excel agrupado por nota (mesmas regras do groupby do audit: Mes/Empresa = primeiro não nulo)
+    SELECT
+        NF_Clean AS nota,
+        first(Mes ORDER BY ordem) FILTER (WHERE Mes IS NOT NULL) AS mes,
+        first(Empresa ORDER BY ordem) FILTER (WHERE Empresa IS NOT NULL) AS empresa,
+        coalesce(sum(Vol_Excel), 0.0) AS vol_ex,
+        coalesce(sum(Liq_Excel), 0.0) AS liq_ex,
+        coalesce(sum(ICMS_Excel), 0.0) AS icms_ex,
+        coalesce(sum(PIS_Excel), 0.0) AS pis_ex,
+        coalesce(sum(COFINS_Excel), 0.0) AS cofins_ex
+    FROM raw_excel
+    WHERE run_id = $run_id AND NF_Clean IS NOT NULL AND NF_Clean <> '' AND upper(NF_Clean) <> 'NAN'
+    GROUP BY NF_Clean
+),
+docs AS (
+    -- Um documento por chave de acesso (ou hash do conteúdo): o primeiro lido
+    SELECT trim(nota) AS nota, empresa, tipo, arquivo_origem, ordem,
+           coalesce(vol, 0.0) AS vol, coalesce(valor_total, 0.0) AS bruto,
+           coalesce(icms, 0.0) AS icms, coalesce(pis, 0.0) AS pis, coalesce(cofins, 0.0) AS cofins
+    FROM raw_xmls
+    WHERE run_id = $run_id
+    QUALIFY coalesce(nullif(chave, ''), hash) IS NULL
+         OR row_number() OVER (PARTITION BY coalesce(nullif(chave, ''), hash) ORDER BY ordem) = 1
+),
+arqs AS (
+    SELECT nota, string_agg(arquivo_origem, ', ' ORDER BY primeiro) AS arquivos
+    FROM (SELECT nota, arquivo_origem, min(ordem) AS primeiro FROM docs GROUP BY nota, arquivo_origem)
+    GROUP BY nota
+),
+xml AS (
+    SELECT d.nota, first(empresa ORDER BY ordem) AS empresa, first(tipo ORDER BY ordem) AS tipo,
+           min(ordem) AS ordem, sum(vol) AS vol, sum(bruto) AS bruto,
+           sum(icms) AS icms, sum(pis) AS pis, sum(cofins) AS cofins, any_value(a.arquivos) AS arquivos
+    FROM docs d JOIN arqs a USING (nota)
+    GROUP BY d.nota
+)
+"""
+
+_SQL_LINHAS = _SQL_BASE + """,
+j AS (
+    -- Empresa: a da planilha, se vier; senão a do XML casado
+    SELECT ex.* REPLACE (coalesce(ex.empresa, x.empresa, '-') AS empresa), x.nota IS NOT NULL AS tem_xml,
+           coalesce(x.tipo, '-') AS tipo, coalesce(x.arquivos, '-') AS arquivo,
+           coalesce(x.vol, 0.0) AS vol, coalesce(x.bruto, 0.0) AS bruto, coalesce(x.icms, 0.0) AS icms,
+           coalesce(x.pis, 0.0) AS pis_xml, coalesce(x.cofins, 0.0) AS cofins_xml
+    FROM ex LEFT JOIN xml x ON x.nota = ex.nota
+),
+imp AS (
+    -- CT-e sem PIS/COFINS no XML: usa os impostos do Excel
+    SELECT *, usa_excel_ AS usa_excel,
+           CASE WHEN usa_excel_ THEN pis_ex ELSE pis_xml END AS pis,
+           CASE WHEN usa_excel_ THEN cofins_ex ELSE cofins_xml END AS cofins
+    FROM (SELECT *, tem_xml AND tipo = 'CT-e' AND pis_xml = 0 AND pis_ex <> 0 AS usa_excel_ FROM j)
+),
+calc AS (
+    SELECT *,
+           vol - vol_ex AS diff_vol,
+           CASE WHEN tem_xml THEN liq_xml - liq_ex ELSE 0.0 - liq_ex END AS diff_rs,
+           CASE WHEN tipo = 'CT-e' THEN $tol_cte ELSE $tol_nfe END AS tol
+    FROM (
+        SELECT *, greatest(bruto - (
+            CASE WHEN icms > 0 AND icms < bruto THEN icms ELSE 0.0 END
+            + CASE WHEN pis > 0 AND pis < bruto THEN pis ELSE 0.0 END
+            + CASE WHEN cofins > 0 AND cofins < bruto THEN cofins ELSE 0.0 END
+        ), 0.0) AS liq_xml
+        FROM imp
+    )
+),
+ok AS (
+    SELECT *, (vol_ex = 0 OR abs(diff_vol) < $tol_vol) AS v_ok, abs(diff_rs) < tol AS f_ok FROM calc
+)
+SELECT *,
+    CASE
+        WHEN NOT tem_xml THEN $st_sem_xml
+        WHEN v_ok AND f_ok THEN $st_ok
+        WHEN NOT v_ok AND NOT f_ok THEN 'ERRO VOL+VALOR ❌'
+        WHEN NOT v_ok THEN 'ERRO VOL ❌'
+        ELSE 'ERRO VALOR ❌'
+    END AS status
+FROM ok
+ORDER BY nota
+"""
+
+_SQL_SOBRAS = _SQL_BASE + """
+SELECT x.nota, x.empresa, x.tipo, x.vol, x.bruto, x.arquivos
+FROM xml x ANTI JOIN ex ON ex.nota = x.nota
+ORDER BY x.ordem
+"""
+
+
+def conciliar_sql(con, run_id: int, config) -> Tuple[List[Dict], List[Dict]]:
+    """
+    Mesmo resultado de `conciliar`, calculado pelo DuckDB sobre raw_excel/raw_xmls do run:
+    agrupamento, outer join, tolerâncias e Status em SQL (hash join paralelo, com spill em
+    disco), e só o resultado volta para o Python montar o relatório.
+    """
+    params = {
+        "run_id": run_id, "tol_cte": float(config.tolerancia_cte), "tol_nfe": float(config.tolerancia_nfe),
+        "tol_vol": float(config.tolerancia_volume), "st_ok": STATUS_OK, "st_sem_xml": STATUS_SEM_XML,
+    }
+    df = con.execute(_SQL_LINHAS, params).df()
+    sobras = con.execute(_SQL_SOBRAS, {"run_id": run_id}).fetchall()
+    linhas = zip(*(df[c].tolist() for c in _COLUNAS_LINHA)) if not df.empty else []
+    return _montar_linhas(linhas, sobras)
@@ -1,107 +1,489 @@
-import pandas as pd
+import hashlib
+import posixpath
+import re
+import xml.etree.ElementTree as ET
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
 
-from .utils import ANO_ALVO, MESES_ALVO, limpar_numero_nf_bruto, make_unique_columns, to_float
+import numpy as np
+import pandas as pd
+from openpyxl import load_workbook
+from openpyxl.cell.cell import TYPE_ERROR, TYPE_NUMERIC
 
+from .utils import ANO_ALVO, MESES_ALVO, limpar_numero_nf_series, make_unique_columns, to_float_series
+from .xml_batch import resolver_workers
 
-def carregar_excel(caminho: str) -> pd.DataFrame:
-    dados = []
-    xls = pd.read_excel(caminho, sheet_name=None, header=None)
 
-    for aba, df in xls.items():
+def filtrar_abas(abas: Iterable, mes_filtro: Optional[str] = None) -> List:
+    """
+    Abas do ano/meses alvo (e do `mes_filtro`, se houver), na ordem do arquivo.
+    O filtro de mês segue a mesma regra do `str.contains` aplicado à coluna Mes.
+    """
+    mes_busca = str(mes_filtro).upper().strip() if mes_filtro and str(mes_filtro).strip() else None
+    out = []
+    for aba in abas:
         aba_upper = str(aba).upper()
         if ANO_ALVO not in aba_upper:
             continue
         if not any(mes in aba_upper for mes in MESES_ALVO):
             continue
-
-        idx = -1
-        for i, row in df.head(120).iterrows():
-            linha = [str(x).upper() for x in row.values]
-            if any("NOTA" in x for x in linha) and (
-                any("S/TRIBUTOS" in x for x in linha)
-                or any("C/TRIBUTOS" in x for x in linha)
-                or any("TOTAL" in x for x in linha)
-            ):
-                idx = i
-                break
-
-        if idx == -1:
+        if mes_busca and not re.search(mes_busca, aba_upper):
             continue
+        out.append(aba)
+    return out
 
-        cols = make_unique_columns([str(c).upper().strip() for c in df.iloc[idx]])
-        df2 = df[idx + 1 :].copy()
-        df2.columns = cols
-
-        c_nf = next((c for c in df2.columns if "NOTA" in c or c == "NF"), None)
-        c_liq = next((c for c in df2.columns if "S/TRIBUTOS" in c), None)
-        c_vol = next(
-            (
-                c
-                for c in df2.columns
-                if "VOL" in c or "M³" in c or "M3" in c or "QTDE" in c or "QTD" in c or "QUANT" in c
-            ),
-            None,
-        )
-
-        c_icms = [c for c in df2.columns if c.startswith("ICMS")]
-        c_pis = [c for c in df2.columns if c.startswith("PIS")]
-        c_cof = [c for c in df2.columns if c.startswith("COFINS")]
-
-        c_icms = c_icms[-1] if c_icms else None
-        c_pis = c_pis[-1] if c_pis else None
-        c_cof = c_cof[-1] if c_cof else None
-
-        if not (c_nf and c_liq):
-            continue
 
-        temp = df2.copy()
-
-        # ============================================================
-        # Correção para planilhas com células mescladas/linhas repetidas:
-        # Em muitos relatórios, o número da Nota Fiscal aparece só na 1ª linha
-        # e as linhas seguintes ficam "em branco" (visual), mas ainda fazem parte da mesma NF.
-        # Aqui, nós propagamos (ffill) a NF para as linhas vazias APENAS quando a linha tem
-        # valores relevantes (ex.: líquidos/volume/impostos), evitando preencher totais/linhas de separação.
-        # ============================================================
-        def _has_content(v) -> bool:
-            if pd.isna(v):
-                return False
-            s = str(v).strip()
-            return s != "" and s.upper() != "NAN"
-
-        nf_raw = temp[c_nf]
-        nf_norm = nf_raw.where(nf_raw.apply(_has_content), pd.NA)
-
-        cols_relevantes = [c for c in [c_liq, c_vol, c_icms, c_pis, c_cof] if c]
-        if cols_relevantes:
-            sub = temp[cols_relevantes]
-            # Substitui applymap (removido em versões novas do pandas)
-            mask = sub.apply(lambda col: col.map(_has_content))
-            row_has_values = mask.any(axis=1)
-        else:
-            row_has_values = pd.Series([True] * len(temp), index=temp.index)
-
-        nf_ffill = nf_norm.ffill()
-        nf_final = nf_norm.copy()
-        mask_preencher = nf_norm.isna() & row_has_values
-        nf_final.loc[mask_preencher] = nf_ffill.loc[mask_preencher]
-
-        temp["NF_Clean"] = nf_final.apply(limpar_numero_nf_bruto)
-        temp["Vol_Excel"] = temp[c_vol].apply(to_float) if c_vol else 0.0
-        temp["Liq_Excel"] = temp[c_liq].apply(to_float)
-
-        temp["ICMS_Excel"] = temp[c_icms].apply(to_float) if c_icms else 0.0
-        temp["PIS_Excel"] = temp[c_pis].apply(to_float) if c_pis else 0.0
-        temp["COFINS_Excel"] = temp[c_cof].apply(to_float) if c_cof else 0.0
-
-        temp["Mes"] = aba
-        temp = temp[temp["NF_Clean"] != ""]
-
-        if not temp.empty:
-            dados.append(
-                temp[
-                    ["NF_Clean", "Vol_Excel", "Liq_Excel", "ICMS_Excel", "PIS_Excel", "COFINS_Excel", "Mes"]
-                ]
-            )
+def listar_abas_alvo(caminho: str, mes_filtro: Optional[str] = None) -> List:
+    """Nomes das abas alvo, lidos do índice do arquivo (sem carregar as planilhas)."""
+    with pd.ExcelFile(caminho) as arquivo:
+        return filtrar_abas(arquivo.sheet_names, mes_filtro)
+
+
+# Linha de cabeçalho: alguma célula com "NOTA" e alguma com um dos termos de valor
+_TERMOS_NOTA = ("NOTA",)
+_TERMOS_VALOR = ("S/TRIBUTOS", "C/TRIBUTOS", "TOTAL")
+MAX_LINHAS_CABECALHO = 120
+
+COLUNAS_SAIDA = ["NF_Clean", "Vol_Excel", "Liq_Excel", "ICMS_Excel", "PIS_Excel", "COFINS_Excel", "Mes"]
+
+
+def localizar_cabecalho(df: pd.DataFrame, max_linhas: int = MAX_LINHAS_CABECALHO) -> int:
+    """
+    Rótulo da linha de cabeçalho (tem "NOTA" e "S/TRIBUTOS", "C/TRIBUTOS" ou "TOTAL"),
+    procurando nas primeiras `max_linhas`; -1 se não houver.
+    """
+    cab = df.head(max_linhas)
+    if cab.empty:
+        return -1
+    # Todas as células de uma vez, em ordem linha a linha
+    texto = pd.Series(cab.to_numpy(dtype=object).ravel(), dtype=object).map(str).str.upper()
+    forma = cab.shape
+
+    def _linhas_com(*termos: str):
+        achou = texto.str.contains(termos[0], regex=False)
+        for t in termos[1:]:
+            achou |= texto.str.contains(t, regex=False)
+        return achou.to_numpy(dtype=bool).reshape(forma).any(axis=1)
+
+    ok = _linhas_com(*_TERMOS_NOTA) & _linhas_com(*_TERMOS_VALOR)
+    return cab.index[ok.argmax()] if ok.any() else -1
+
+
+def tem_conteudo(col: pd.Series) -> pd.Series:
+    """Célula preenchida: não nula e, se for texto, não vazia nem "nan"."""
+    # Testa cada valor distinto uma vez; nulos ficam no código -1 (última posição)
+    codigos, unicos = pd.factorize(col, use_na_sentinel=True)
+    unicos = pd.Series(np.asarray(unicos, dtype=object), dtype=object)
+    try:
+        # .str devolve nulo para o que não é texto (números, datas): esses contam como conteúdo
+        vazio = unicos.str.strip().str.upper().isin(["", "NAN"]).to_numpy(dtype=bool)
+    except AttributeError:
+        vazio = np.zeros(len(unicos), dtype=bool)  # nenhum texto
+    return pd.Series(~np.append(vazio, True)[codigos], index=col.index)
+
+
+def mapear_colunas(cols: List[str]) -> Optional[Dict[str, Optional[str]]]:
+    """
+    Colunas de origem de cada campo a partir dos nomes do cabeçalho (já em maiúsculas).
+    None quando a aba não tem NOTA e S/TRIBUTOS.
+    """
+    c_nf = next((c for c in cols if "NOTA" in c or c == "NF"), None)
+    c_liq = next((c for c in cols if "S/TRIBUTOS" in c), None)
+    c_vol = next(
+        (
+            c
+            for c in cols
+            if "VOL" in c or "M³" in c or "M3" in c or "QTDE" in c or "QTD" in c or "QUANT" in c
+        ),
+        None,
+    )
+
+    c_icms = [c for c in cols if c.startswith("ICMS")]
+    c_pis = [c for c in cols if c.startswith("PIS")]
+    c_cof = [c for c in cols if c.startswith("COFINS")]
+
+    if not (c_nf and c_liq):
+        return None
+
+    return {
+        "nf": c_nf,
+        "liq": c_liq,
+        "vol": c_vol,
+        "icms": c_icms[-1] if c_icms else None,
+        "pis": c_pis[-1] if c_pis else None,
+        "cofins": c_cof[-1] if c_cof else None,
+    }
+
+
+# ============================================================
+# Layouts conhecidos: impressão digital do cabeçalho -> mapa de colunas
+# ============================================================
+# Os fornecedores reusam poucos modelos de planilha: o mapa resolvido por
+# mapear_colunas fica guardado aqui (e no AuditDB, ver registrar_layouts/layouts_novos).
+_LAYOUTS: Dict[str, Optional[Dict[str, Optional[str]]]] = {}
+_LAYOUTS_NOVOS: Dict[str, Optional[Dict[str, Optional[str]]]] = {}
+
+
+def impressao_cabecalho(cols: List[str]) -> str:
+    """SHA-1 dos nomes de coluna (já normalizados) na ordem do cabeçalho."""
+    return hashlib.sha1("\x1f".join(cols).encode("utf-8")).hexdigest()
+
+
+def registrar_layouts(layouts: Dict[str, Optional[Dict[str, Optional[str]]]]) -> None:
+    """Carrega layouts já conhecidos (ex.: lidos do AuditDB) para o cache do processo."""
+    _LAYOUTS.update(layouts)
+
+
+def layouts_novos() -> Dict[str, Optional[Dict[str, Optional[str]]]]:
+    """Layouts resolvidos desde a última chamada (para gravar no AuditDB); esvazia a lista."""
+    novos = dict(_LAYOUTS_NOVOS)
+    _LAYOUTS_NOVOS.clear()
+    return novos
+
+
+def _mapear_com_layout(cols: List[str], aba) -> Optional[Dict[str, Optional[str]]]:
+    digital = impressao_cabecalho(cols)
+    if digital in _LAYOUTS:
+        mapa, origem = _LAYOUTS[digital], "conhecido"
+    else:
+        mapa = _LAYOUTS[digital] = _LAYOUTS_NOVOS[digital] = mapear_colunas(cols)
+        origem = "novo"
+
+    if mapa is None:
+        print(f"[Excel] {aba}: layout {digital[:8]} ({origem}) sem NOTA e S/TRIBUTOS, aba ignorada.")
+    else:
+        campos = ", ".join(f"{k}={v!r}" for k, v in mapa.items())
+        print(f"[Excel] {aba}: layout {digital[:8]} ({origem}) -> {campos}")
+    return mapa
+
+
+def _normalizar_bloco(temp: pd.DataFrame, mapa: Dict[str, Optional[str]], aba, nf_anterior=None):
+    """
+    Converte um bloco de linhas (depois do cabeçalho) nas COLUNAS_SAIDA.
+    `nf_anterior` é a última NF preenchida do bloco anterior (leitura em blocos);
+    devolve (saida, última NF preenchida deste bloco).
+    """
+    c_nf, c_liq, c_vol = mapa["nf"], mapa["liq"], mapa["vol"]
+    c_icms, c_pis, c_cof = mapa["icms"], mapa["pis"], mapa["cofins"]
+
+    # ============================================================
+    # Correção para planilhas com células mescladas/linhas repetidas:
+    # Em muitos relatórios, o número da Nota Fiscal aparece só na 1ª linha
+    # e as linhas seguintes ficam "em branco" (visual), mas ainda fazem parte da mesma NF.
+    # Aqui, nós propagamos (ffill) a NF para as linhas vazias APENAS quando a linha tem
+    # valores relevantes (ex.: líquidos/volume/impostos), evitando preencher totais/linhas de separação.
+    # ============================================================
+    nf_raw = temp[c_nf]
+    nf_norm = nf_raw.where(tem_conteudo(nf_raw), pd.NA)
+
+    cols_relevantes = [c for c in [c_liq, c_vol, c_icms, c_pis, c_cof] if c]
+    if cols_relevantes:
+        mask = pd.concat([tem_conteudo(temp[c]) for c in cols_relevantes], axis=1)
+        row_has_values = mask.any(axis=1)
+    else:
+        row_has_values = pd.Series([True] * len(temp), index=temp.index)
+
+    nf_ffill = nf_norm.ffill()
+    if nf_anterior is not None:
+        nf_ffill = nf_ffill.where(nf_ffill.notna(), nf_anterior)
+    nf_final = nf_norm.copy()
+    mask_preencher = nf_norm.isna() & row_has_values
+    nf_final.loc[mask_preencher] = nf_ffill.loc[mask_preencher]
+
+    preenchidas = nf_norm.dropna()
+    nf_ultima = preenchidas.iloc[-1] if len(preenchidas) else nf_anterior
+
+    out = pd.DataFrame(index=temp.index)
+    out["NF_Clean"] = limpar_numero_nf_series(nf_final)
+    out["Vol_Excel"] = to_float_series(temp[c_vol]) if c_vol else 0.0
+    out["Liq_Excel"] = to_float_series(temp[c_liq])
+
+    out["ICMS_Excel"] = to_float_series(temp[c_icms]) if c_icms else 0.0
+    out["PIS_Excel"] = to_float_series(temp[c_pis]) if c_pis else 0.0
+    out["COFINS_Excel"] = to_float_series(temp[c_cof]) if c_cof else 0.0
+
+    out["Mes"] = aba
+    return out[out["NF_Clean"] != ""], nf_ultima
+
+
+def _processar_aba(aba, df: pd.DataFrame) -> Optional[pd.DataFrame]:
+    idx = localizar_cabecalho(df)
+    if idx == -1:
+        return None
+
+    cols = make_unique_columns([str(c).upper().strip() for c in df.iloc[idx]])
+    mapa = _mapear_com_layout(cols, aba)
+    if mapa is None:
+        return None
+
+    df2 = df[idx + 1 :].copy()
+    df2.columns = cols
+    saida, _ = _normalizar_bloco(df2, mapa, aba)
+    return saida
 
+
+# ============================================================
+# Leitura em streaming (openpyxl read-only): linha a linha, só as colunas usadas,
+# em blocos de tamanho fixo. Mesmo resultado do caminho pandas.
+# ============================================================
+# na_values padrão do pandas.read_excel: essas strings viram NaN
+_NA_PADRAO = frozenset([
+    "", "#N/A", "#N/A N/A", "#NA", "-1.#IND", "-1.#QNAN", "-NaN", "-nan", "1.#IND", "1.#QNAN",
+    "<NA>", "N/A", "NA", "NULL", "NaN", "None", "n/a", "nan", "null",
+])
+TAMANHO_BLOCO_STREAMING = 50_000
+
+
+def _valor_celula(cell):
+    """Mesma conversão do leitor openpyxl do pandas (+ na_values padrão)."""
+    v = cell.value
+    if v is None or cell.data_type == TYPE_ERROR:
+        return np.nan
+    if cell.data_type == TYPE_NUMERIC:
+        i = int(v)
+        return i if i == v else float(v)
+    if isinstance(v, str) and v in _NA_PADRAO:
+        return np.nan
+    return v
+
+
+def _linha_eh_cabecalho(valores: List) -> bool:
+    textos = [str(v).upper() for v in valores]
+    return any(t in x for t in _TERMOS_NOTA for x in textos) and any(
+        t in x for t in _TERMOS_VALOR for x in textos
+    )
+
+
+def _blocos_aba_streaming(ws, aba, tamanho_bloco: int) -> Iterator[pd.DataFrame]:
+    linhas = ws.iter_rows()
+
+    cabecalho = None
+    anteriores: List[List] = []
+    for _, row in zip(range(MAX_LINHAS_CABECALHO), linhas):
+        valores = [_valor_celula(c) for c in row]
+        anteriores.append(valores)
+        if _linha_eh_cabecalho(valores):
+            cabecalho = valores
+            break
+    if cabecalho is None:
+        return
+
+    cols = make_unique_columns([str(c).upper().strip() for c in cabecalho])
+    mapa = _mapear_com_layout(cols, aba)
+    if mapa is None:
+        return
+
+    # Só as colunas mapeadas são lidas das linhas seguintes
+    usadas = list(dict.fromkeys(c for c in mapa.values() if c))
+    posicoes = [cols.index(c) for c in usadas]
+
+    # O pandas unifica valores "iguais" numa coluna de texto (1/True, 0/False) no
+    # primeiro que aparece, inclusive acima do cabeçalho. Só muda o resultado na coluna da NF.
+    j_nf = cols.index(mapa["nf"])
+    primeiros: Dict = {}
+
+    def _unificar(v):
+        if isinstance(v, (bool, int, float)) and v == v:
+            return primeiros.setdefault(v, v)
+        return v
+
+    for valores in anteriores:
+        if j_nf < len(valores):
+            _unificar(valores[j_nf])
+
+    def _bloco(buffer: List[List]) -> pd.DataFrame:
+        return pd.DataFrame({c: pd.Series(v, dtype=object) for c, v in zip(usadas, buffer)})
+
+    nf_anterior = None
+    buffer: List[List] = [[] for _ in usadas]
+    n = 0
+    for row in linhas:
+        largura = len(row)
+        for col, j in zip(buffer, posicoes):
+            v = _valor_celula(row[j]) if j < largura else np.nan
+            col.append(_unificar(v) if j == j_nf else v)
+        n += 1
+        if n == tamanho_bloco:
+            saida, nf_anterior = _normalizar_bloco(_bloco(buffer), mapa, aba, nf_anterior)
+            if not saida.empty:
+                yield saida.reset_index(drop=True)
+            buffer = [[] for _ in usadas]
+            n = 0
+    if n:
+        saida, _ = _normalizar_bloco(_bloco(buffer), mapa, aba, nf_anterior)
+        if not saida.empty:
+            yield saida.reset_index(drop=True)
+
+
+def iterar_excel_streaming(
+    caminho: str, mes_filtro: Optional[str] = None, tamanho_bloco: int = TAMANHO_BLOCO_STREAMING
+) -> Iterator[pd.DataFrame]:
+    """
+    Blocos já tipados (COLUNAS_SAIDA) das abas alvo, lidos em modo read-only sem
+    montar a planilha inteira na memória.
+    """
+    wb = load_workbook(caminho, read_only=True, data_only=True, keep_links=False)
+    try:
+        for aba in filtrar_abas(wb.sheetnames, mes_filtro):
+            ws = wb[aba]
+            ws.reset_dimensions()
+            yield from _blocos_aba_streaming(ws, aba, tamanho_bloco)
+    finally:
+        wb.close()
+
+
+def _carregar_aba_worker(aba, caminho: str, streaming: bool, layouts: Dict):
+    """
+    Roda no processo worker: lê e normaliza uma aba. Recebe os layouts já conhecidos
+    e devolve os resolvidos aqui, para o processo principal guardar.
+    """
+    registrar_layouts(layouts)
+    saida = carregar_abas(caminho, [aba], streaming=streaming)[aba]
+    return saida, layouts_novos()
+
+
+def carregar_abas(caminho: str, abas: List, streaming: bool = False, workers: int = 1) -> Dict[str, pd.DataFrame]:
+    """
+    Saída normalizada (COLUNAS_SAIDA) de cada aba pedida, na ordem pedida.
+    Abas sem cabeçalho reconhecido ou sem notas vêm como DataFrame vazio.
+
+    Com workers > 1 (0/None = autodetecta) cada aba é lida e normalizada num processo
+    de um ProcessPoolExecutor; a ordem é preservada porque `executor.map` devolve os
+    resultados na ordem de submissão.
+    """
+    out: Dict[str, pd.DataFrame] = {}
+    if not abas:
+        return out
+
+    workers = min(resolver_workers(workers), len(abas))
+    if workers > 1:
+        print(f"[Excel] Leitura paralela: {len(abas)} aba(s), {workers} worker(s).")
+        ler = partial(_carregar_aba_worker, caminho=caminho, streaming=streaming, layouts=dict(_LAYOUTS))
+        with ProcessPoolExecutor(max_workers=workers) as ex:
+            for aba, (saida, novos) in zip(abas, ex.map(ler, abas)):
+                out[aba] = saida
+                registrar_layouts(novos)
+                _LAYOUTS_NOVOS.update(novos)
+        return out
+
+    if streaming:
+        wb = load_workbook(caminho, read_only=True, data_only=True, keep_links=False)
+        try:
+            for aba in abas:
+                ws = wb[aba]
+                ws.reset_dimensions()
+                blocos = list(_blocos_aba_streaming(ws, aba, TAMANHO_BLOCO_STREAMING))
+                out[aba] = pd.concat(blocos, ignore_index=True) if blocos else pd.DataFrame()
+        finally:
+            wb.close()
+        return out
+
+    with pd.ExcelFile(caminho) as arquivo:
+        xls = pd.read_excel(arquivo, sheet_name=list(abas), header=None)
+
+    for aba, df in xls.items():
+        saida = _processar_aba(aba, df)
+        out[aba] = saida if saida is not None else pd.DataFrame()
+    return out
+
+
+def carregar_excel(
+    caminho: str, mes_filtro: Optional[str] = None, streaming: bool = False, workers: int = 1
+) -> pd.DataFrame:
+    """
+    Lê só as abas que interessam: os nomes vêm do índice do arquivo (sem parsear
+    as planilhas) e apenas as abas do ano/meses alvo e do `mes_filtro` são carregadas.
+    `streaming=True` usa a leitura linha a linha (bases muito grandes) e `workers`
+    processa as abas em paralelo (ver carregar_abas).
+    """
+    if streaming and resolver_workers(workers) == 1:
+        blocos = list(iterar_excel_streaming(caminho, mes_filtro))
+        return pd.concat(blocos, ignore_index=True) if blocos else pd.DataFrame()
+
+    abas = listar_abas_alvo(caminho, mes_filtro)
+    dados = [df for df in carregar_abas(caminho, abas, streaming=streaming, workers=workers).values() if not df.empty]
     return pd.concat(dados, ignore_index=True) if dados else pd.DataFrame()
+
+
+# ============================================================
+# Impressão digital de cada aba (cache do AuditDB)
+# ============================================================
+# Incrementar sempre que a saída normalizada mudar (invalida o cache de abas do AuditDB)
+VERSAO_EXCEL_LOADER = 1
+
+_NS_PLANILHA = "{http://schemas.openxmlformats.org/spreadsheetml/2006/main}"
+_NS_REL_DOC = "{http://schemas.openxmlformats.org/officeDocument/2006/relationships}"
+_NS_REL_PACOTE = "{http://schemas.openxmlformats.org/package/2006/relationships}"
+# Células de texto compartilhado: <c ... t="s"><v>índice</v>
+_RE_CELULA_COMPARTILHADA = re.compile(rb'<(?:\w+:)?c\b[^>]*\bt="s"[^>]*>\s*<(?:\w+:)?v>(\d+)<')
+
+
+def _partes_do_livro(z: zipfile.ZipFile) -> Tuple[Dict[str, str], Optional[str]]:
+    """({nome da aba: parte XML no pacote}, parte dos textos compartilhados) pelo workbook.xml e seus rels."""
+    rels = ET.fromstring(z.read("xl/_rels/workbook.xml.rels"))
+    destinos: Dict[str, str] = {}
+    textos = None
+    for r in rels.iter(f"{_NS_REL_PACOTE}Relationship"):
+        alvo = r.get("Target", "")
+        alvo = alvo.lstrip("/") if alvo.startswith("/") else posixpath.normpath(posixpath.join("xl", alvo))
+        destinos[r.get("Id")] = alvo
+        if r.get("Type", "").endswith("/sharedStrings"):
+            textos = alvo
+
+    livro = ET.fromstring(z.read("xl/workbook.xml"))
+    abas = {
+        s.get("name"): destinos.get(s.get(f"{_NS_REL_DOC}id"))
+        for s in livro.iter(f"{_NS_PLANILHA}sheet")
+    }
+    return abas, textos
+
+
+def _textos_compartilhados(z: zipfile.ZipFile, parte: Optional[str]) -> List[bytes]:
+    if not parte or parte not in z.NameToInfo:
+        return []
+    out: List[bytes] = []
+    with z.open(parte) as f:
+        for _, el in ET.iterparse(f):
+            if el.tag == f"{_NS_PLANILHA}si":
+                out.append("".join(el.itertext()).encode("utf-8"))
+                el.clear()
+    return out
+
+
+def impressoes_digitais_abas(caminho: str, mes_filtro: Optional[str] = None) -> Dict[str, Tuple[int, str]]:
+    """
+    (tamanho, assinatura) do XML de cada aba alvo dentro do .xlsx, na ordem do arquivo.
+    A assinatura cobre o XML da aba e os textos compartilhados que ela usa, então
+    editar outra aba (mesmo que acrescente textos) não muda a assinatura desta.
+    Devolve {} se o arquivo não for um pacote xlsx (ex.: .xls).
+    """
+    try:
+        z = zipfile.ZipFile(caminho)
+    except (OSError, zipfile.BadZipFile):
+        return {}
+
+    with z:
+        try:
+            partes, parte_textos = _partes_do_livro(z)
+        except (KeyError, ET.ParseError):
+            return {}
+        textos: Optional[List[bytes]] = None
+
+        out: Dict[str, Tuple[int, str]] = {}
+        for aba in filtrar_abas(partes, mes_filtro):
+            parte = partes[aba]
+            if not parte or parte not in z.NameToInfo:
+                continue
+            dados = z.read(parte)
+            h = hashlib.sha1(dados)
+            indices = _RE_CELULA_COMPARTILHADA.findall(dados)
+            if indices:
+                if textos is None:
+                    textos = _textos_compartilhados(z, parte_textos)
+                for i in indices:
+                    i = int(i)
+                    h.update(b"\x00" + (textos[i] if i < len(textos) else b""))
+            out[aba] = (len(dados), f"sha1:{h.hexdigest()}")
+        return out
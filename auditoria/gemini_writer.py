@@ -1,5 +1,7 @@
+import hashlib
 import json
 import os
+import time
 import urllib.error
 import urllib.request
 from typing import Dict, List, Optional
@@ -28,6 +30,51 @@ def _try_load_dotenv():
         return
 
 
+# Cache em disco das respostas (relatórios repetidos não chamam a API de novo)
+CACHE_DIR_PADRAO = ".cache_gemini"  # relativo à pasta de execução, como o auditoria.db
+CACHE_TTL_S = 7 * 24 * 3600
+CACHE_MAX_ENTRADAS = 500
+API_BASE_PADRAO = "https://generativelanguage.googleapis.com"
+
+
+def _chave_cache(model: str, prompt: str, body: Dict) -> str:
+    """Hash do modelo + prompt (que já embute o JSON do payload) + parâmetros de geração."""
+    bruto = json.dumps({"model": model, "prompt": prompt, "body": body}, ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(bruto.encode("utf-8")).hexdigest()
+
+
+def _ler_cache(cache_dir: str, chave: str, ttl_s: float) -> Optional[List[str]]:
+    caminho = os.path.join(cache_dir, f"{chave}.json")
+    try:
+        if time.time() - os.path.getmtime(caminho) > ttl_s:
+            os.remove(caminho)
+            return None
+        with open(caminho, encoding="utf-8") as f:
+            linhas = json.load(f)["linhas"]
+    except (OSError, ValueError, KeyError):
+        return None
+    return linhas if isinstance(linhas, list) and linhas else None
+
+
+def _gravar_cache(cache_dir: str, chave: str, linhas: List[str], max_entradas: int) -> None:
+    """Grava de forma atômica e poda as entradas mais antigas acima de `max_entradas`."""
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        caminho = os.path.join(cache_dir, f"{chave}.json")
+        tmp = f"{caminho}.{os.getpid()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"linhas": linhas, "gravado_em": time.time()}, f, ensure_ascii=False)
+        os.replace(tmp, caminho)
+
+        entradas = [e for e in os.scandir(cache_dir) if e.name.endswith(".json")]
+        if len(entradas) > max_entradas:
+            entradas.sort(key=lambda e: e.stat().st_mtime)
+            for e in entradas[: len(entradas) - max_entradas]:
+                os.remove(e.path)
+    except OSError as ex:
+        print(f"[Gemini] Não foi possível gravar o cache: {ex}")
+
+
 def _as_float(v) -> Optional[float]:
     try:
         if v is None:
@@ -107,10 +154,20 @@ def gerar_texto_pdf_com_gemini(
     # modelo atual da API (texto, multimodal) - v1
     model: str = "gemini-2.5-flash",
     timeout_s: int = 30,
+    base_url: Optional[str] = None,
+    cache_dir: Optional[str] = None,
+    cache_ttl_s: float = CACHE_TTL_S,
+    cache_max_entradas: int = CACHE_MAX_ENTRADAS,
+    usar_cache: bool = True,
 ) -> Optional[List[str]]:
     """
     Retorna uma lista de linhas para o PDF.
     Se não houver chave/erro, retorna None (caller faz fallback para texto fixo).
+
+    Respostas válidas ficam em cache no disco (`cache_dir`, padrão GEMINI_CACHE_DIR
+    ou ./.cache_gemini) por `cache_ttl_s` segundos: o mesmo modelo + prompt + payload
+    não volta à rede. `base_url` (ou GEMINI_API_BASE) troca o endpoint, ex.: um
+    servidor local nos testes.
     """
     _try_load_dotenv()
     api_key = (api_key or os.getenv("GEMINI_API_KEY") or "").strip()
@@ -141,10 +198,8 @@ def gerar_texto_pdf_com_gemini(
     )
 
     # Endpoint v1 estável
-    url = (
-        "https://generativelanguage.googleapis.com/v1/"
-        f"models/{model}:generateContent?key={api_key}"
-    )
+    base_url = (base_url or os.getenv("GEMINI_API_BASE") or API_BASE_PADRAO).rstrip("/")
+    url = f"{base_url}/v1/models/{model}:generateContent?key={api_key}"
 
     body = {
         "contents": [{"role": "user", "parts": [{"text": prompt}]}],
@@ -154,6 +209,14 @@ def gerar_texto_pdf_com_gemini(
         },
     }
 
+    cache_dir = cache_dir or os.getenv("GEMINI_CACHE_DIR") or CACHE_DIR_PADRAO
+    chave = _chave_cache(model, prompt, body)
+    if usar_cache:
+        em_cache = _ler_cache(cache_dir, chave, cache_ttl_s)
+        if em_cache:
+            print("[Gemini] Texto reaproveitado do cache (sem chamar a API).")
+            return em_cache
+
     req = urllib.request.Request(
         url,
         data=json.dumps(body).encode("utf-8"),
@@ -194,5 +257,8 @@ def gerar_texto_pdf_com_gemini(
         return None
 
     print("[Gemini] Texto gerado com sucesso para o PDF.")
-    return linhas[:60]
+    linhas = linhas[:60]
+    if usar_cache:
+        _gravar_cache(cache_dir, chave, linhas, cache_max_entradas)
+    return linhas
 
@@ -4,13 +4,13 @@ from pathlib import Path
 from datetime import datetime
 
 # Ajuste o import conforme a estrutura da sua pasta
-from .audit import auditar_pasta_pai, coletar_xmls_por_empresas
+from .audit import AuditConfig, auditar_pasta_pai, coletar_xmls_por_empresas
 
 class App(tk.Tk):
     def __init__(self):
         super().__init__()
         self.title("Auditoria XML (Soma XMLs -> Compara com Excel)")
-        self.geometry("900x650") 
+        self.geometry("900x720") 
         self.minsize(760, 550)
 
         self.pasta_pai: Path | None = None
@@ -93,6 +93,18 @@ class App(tk.Tk):
         self.lbl_dest = tk.Label(linha_dest, text="(Downloads por padrão)", fg="gray")
         self.lbl_dest.pack(side="left", padx=10)
 
+        # -- Saída para BI --
+        tk.Label(bottom, text="6) Arquivos para BI (Opcional):", font=("Segoe UI", 11, "bold")).pack(anchor="w", pady=(10, 0))
+        linha_bi = tk.Frame(bottom)
+        linha_bi.pack(fill="x", pady=4)
+        self.var_parquet = tk.BooleanVar(value=False)
+        self.var_csv = tk.BooleanVar(value=False)
+        self.var_so_divergentes = tk.BooleanVar(value=False)
+        tk.Checkbutton(linha_bi, text="Parquet", variable=self.var_parquet).pack(side="left")
+        tk.Checkbutton(linha_bi, text="CSV", variable=self.var_csv).pack(side="left", padx=8)
+        tk.Checkbutton(linha_bi, text="Excel só com as divergências", variable=self.var_so_divergentes).pack(side="left", padx=8)
+        tk.Label(bottom, text="(Parquet/CSV saem ao lado do Excel, sempre com todas as linhas)", fg="gray", font=("Segoe UI", 9)).pack(anchor="w")
+
         # ======== RODAPÉ (BOTÃO GRANDE + STATUS) ========
         footer = tk.Frame(self, bg="#f0f0f0")
         footer.pack(fill="x", padx=8, pady=8)
@@ -214,6 +226,10 @@ class App(tk.Tk):
             ts = datetime.now().strftime("%Y%m%d_%H%M%S")
             saida = str(self.destino_relatorio / f"Auditoria_XML_{ts}.xlsx")
 
+        # Formatos do relatório: o Excel sempre; Parquet/CSV completos para o BI
+        formatos = ["xlsx"] + [f for f, var in (("parquet", self.var_parquet), ("csv", self.var_csv)) if var.get()]
+        config = AuditConfig(formatos_saida=tuple(formatos), xlsx_so_divergentes=self.var_so_divergentes.get())
+
         try:
             self.status.config(text="Iniciando auditoria...")
             self.btn_auditar.config(state="disabled")
@@ -225,6 +241,7 @@ class App(tk.Tk):
                 empresas, 
                 self.excel_path, 
                 saida=saida,
+                config=config,
                 mes_filtro=mes_digitado  # <--- AQUI ESTÁ A CORREÇÃO IMPORTANTE
             )
 
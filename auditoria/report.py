@@ -1,9 +1,14 @@
 import os
+import duckdb
 import pandas as pd
 from datetime import datetime
-from typing import List, Dict, Optional
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from typing import List, Dict, Optional, Sequence
 from openpyxl import Workbook
-from openpyxl.styles import PatternFill, Font, Alignment, Border, Side
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.formatting.rule import FormulaRule
+from openpyxl.styles import NamedStyle, PatternFill, Font, Alignment, Border, Side
+from openpyxl.utils import get_column_letter
 from openpyxl.utils.dataframe import dataframe_to_rows
 
 from .gemini_writer import gerar_texto_pdf_com_gemini
@@ -17,13 +22,84 @@ except ImportError:
     HAS_REPORTLAB = False
     print("Aviso: Biblioteca 'reportlab' não encontrada. PDF não será gerado.")
 
-def gerar_relatorio(lista: List[Dict], saida: Optional[str] = None) -> str:
+# Formatos do relatório principal: "xlsx" (estilizado), "parquet" e "csv" (colunares, para BI)
+FORMATOS_SAIDA = ("xlsx", "parquet", "csv")
+CSV_LINHAS_POR_BLOCO = 50_000
+
+# Colunas de valor: no Parquet/CSV saem numéricas ("-" vira nulo)
+_COLS_NUMERICAS = [
+    "Vol Excel", "Vol XML", "Diff Vol", "Liq Excel", "Liq XML (Calc)", "ICMS Excel", "ICMS XML",
+    "PIS Excel", "PIS", "COFINS Excel", "COFINS", "Diff R$",
+]
+
+def gerar_relatorio(
+    lista: List[Dict],
+    saida: Optional[str] = None,
+    formatos: Sequence[str] = ("xlsx",),
+    xlsx_so_divergentes: bool = False,
+    esperar_pdf: bool = True,
+) -> str:
     """
-    Gera o relatório principal (Excel Bonito) e o PDF explicativo.
+    Gera o relatório principal (Excel Bonito e/ou Parquet/CSV) e o PDF explicativo.
+    Os arquivos são gravados ao mesmo tempo; uma falha no PDF (ex.: Gemini) só vira
+    aviso no console, já uma falha num dos formatos pedidos é propagada.
+    Com `esperar_pdf=False` retorna assim que os formatos pedidos ficam prontos e o
+    PDF termina sozinho em segundo plano (não segura o retorno no timeout do Gemini).
+
+    - `formatos`: qualquer combinação de FORMATOS_SAIDA. Parquet/CSV ficam ao lado
+      de `saida`, com a mesma base de nome e as mesmas colunas.
+    - `xlsx_so_divergentes`: o Excel estilizado leva só as linhas que não estão OK
+      (o Parquet/CSV e o PDF continuam com todas).
+
+    Retorna o caminho do .xlsx (ou, sem xlsx, do primeiro formato gravado).
     """
     if not lista:
         return ""
 
+    formatos = [f.lower() for f in formatos]
+    invalidos = [f for f in formatos if f not in FORMATOS_SAIDA]
+    if invalidos or not formatos:
+        raise ValueError(f"Formato(s) de saída inválido(s): {invalidos or formatos}. Use {FORMATOS_SAIDA}.")
+
+    df = _df_relatorio(lista)
+    saida = resolver_saida(saida)
+    base = os.path.splitext(saida)[0]
+
+    # 2. GERA PDF EXPLICATIVO (Se possível), em thread própria
+    fut_pdf = _gerar_pdf_em_segundo_plano(f"{base}.pdf", df) if HAS_REPORTLAB else None
+
+    with ThreadPoolExecutor(max_workers=len(formatos)) as ex:
+        futs = {}
+        # 1. GERA EXCEL ESTILIZADO
+        if "xlsx" in formatos:
+            df_xlsx = df[~df["Status"].astype(str).str.upper().str.contains("OK")] if xlsx_so_divergentes else df
+            futs["xlsx"] = ex.submit(_gravar_xlsx, df_xlsx, saida)
+        # 1b. SAÍDAS COLUNARES (BI)
+        if "parquet" in formatos:
+            futs["parquet"] = ex.submit(_gravar_parquet, df, f"{base}.parquet")
+        if "csv" in formatos:
+            futs["csv"] = ex.submit(_gravar_csv, df, f"{base}.csv")
+
+    caminhos = {f: fut.result() for f, fut in futs.items()}
+    if fut_pdf is not None and esperar_pdf:
+        wait([fut_pdf])
+
+    return caminhos.get("xlsx") or caminhos[formatos[0]]
+
+def _gerar_pdf_em_segundo_plano(caminho: str, df: pd.DataFrame) -> Future:
+    """Dispara o PDF num executor só dele, sem esperar; uma falha só vira aviso no console."""
+    ex = ThreadPoolExecutor(max_workers=1, thread_name_prefix="pdf")
+    fut = ex.submit(_gerar_pdf_resumo, caminho, df)
+    ex.shutdown(wait=False)
+    fut.add_done_callback(_avisar_falha_pdf)
+    return fut
+
+def _avisar_falha_pdf(fut: Future) -> None:
+    if fut.exception() is not None:
+        print(f"⚠️ AVISO: PDF explicativo não gerado: {fut.exception()}")
+
+def _df_relatorio(lista: List[Dict]) -> pd.DataFrame:
+    """Monta o DataFrame do relatório principal na ordem fixa de colunas."""
     df = pd.DataFrame(lista)
     
     # Colunas padrão para garantir a ordem no Excel:
@@ -54,38 +130,63 @@ def gerar_relatorio(lista: List[Dict], saida: Optional[str] = None) -> str:
         if c not in df.columns:
             df[c] = "-"
     
-    df = df[cols_order]
+    return df[cols_order]
 
-    # Define nome do arquivo se não passar
+def resolver_saida(saida: Optional[str] = None) -> str:
+    """Define nome do arquivo se não passar (relatorios/Auditoria_Resultado_<timestamp>.xlsx)."""
     if not saida:
         ts = datetime.now().strftime("%Y%m%d_%H%M%S")
         pasta_relatorios = os.path.join(os.getcwd(), "relatorios")
         os.makedirs(pasta_relatorios, exist_ok=True)
         saida = os.path.join(pasta_relatorios, f"Auditoria_Resultado_{ts}.xlsx")
+    return saida
 
-    # 1. GERA EXCEL ESTILIZADO
-    wb = Workbook()
-    ws = wb.active
-    ws.title = "Resultado Auditoria"
-
-    # Adiciona dados
-    for r in dataframe_to_rows(df, index=False, header=True):
-        ws.append(r)
-
-    # Aplica Estilos "Bonitos"
-    _estilizar_planilha(ws)
-    
+def _gravar_xlsx(df: pd.DataFrame, saida: str) -> str:
+    """Excel estilizado em modo write-only: linhas estilizadas enquanto são gravadas."""
+    wb = Workbook(write_only=True)
+    _escrever_aba(wb, "Resultado Auditoria", df)
     wb.save(saida)
     print(f"Excel gerado com sucesso: {saida}")
-
-    # 2. GERA PDF EXPLICATIVO (Se possível)
-    if HAS_REPORTLAB:
-        caminho_pdf = saida.replace(".xlsx", ".pdf")
-        _gerar_pdf_resumo(caminho_pdf, df)
-
     return saida
 
-def gerar_relatorio_avisos(df_duplicadas: pd.DataFrame, lista_sem_xml: List[Dict], caminho_resultado: str) -> str:
+def _df_colunar(df: pd.DataFrame) -> pd.DataFrame:
+    """Tipos fixos por coluna para Parquet/CSV: valores em float, o resto em texto."""
+    out = df.copy()
+    for c in out.columns:
+        if c in _COLS_NUMERICAS:
+            out[c] = pd.to_numeric(out[c], errors="coerce")
+        else:
+            out[c] = out[c].where(out[c].notna(), None).astype("string")
+    return out
+
+def _gravar_parquet(df: pd.DataFrame, caminho: str) -> str:
+    """Parquet via DuckDB (já é dependência do projeto; dispensa pyarrow)."""
+    df_saida = _df_colunar(df)
+    con = duckdb.connect()
+    try:
+        con.register("df_saida", df_saida)
+        destino = caminho.replace("'", "''")
+        con.execute(f"COPY df_saida TO '{destino}' (FORMAT PARQUET, COMPRESSION ZSTD)")
+    finally:
+        con.close()
+    print(f"Parquet gerado com sucesso: {caminho}")
+    return caminho
+
+def _gravar_csv(df: pd.DataFrame, caminho: str) -> str:
+    """CSV (UTF-8, separador vírgula) gravado em blocos de CSV_LINHAS_POR_BLOCO linhas."""
+    df_saida = _df_colunar(df)
+    with open(caminho, "w", encoding="utf-8", newline="") as f:
+        for ini in range(0, max(len(df_saida), 1), CSV_LINHAS_POR_BLOCO):
+            df_saida.iloc[ini:ini + CSV_LINHAS_POR_BLOCO].to_csv(f, index=False, header=(ini == 0))
+    print(f"CSV gerado com sucesso: {caminho}")
+    return caminho
+
+def gerar_relatorio_avisos(
+    df_duplicadas: pd.DataFrame,
+    lista_sem_xml: List[Dict],
+    caminho_resultado: str,
+    lista_xml_duplicados: Optional[List[Dict]] = None,
+) -> str:
     """
     Gera um relatório de AVISOS (separado) bem formatado.
     """
@@ -114,39 +215,35 @@ def gerar_relatorio_avisos(df_duplicadas: pd.DataFrame, lista_sem_xml: List[Dict
     # Cria pasta específica para avisos para ficar organizado
     os.makedirs(os.path.dirname(caminho_avisos), exist_ok=True)
 
-    wb = Workbook()
-    
+    wb = Workbook(write_only=True)
+
     # --- ABA 1: DUPLICADAS ---
     if not df_duplicadas.empty:
-        ws1 = wb.active
-        ws1.title = "Duplicadas no Excel"
-        
         # Seleciona colunas úteis
         cols_dup = ["Mes", "NF_Clean", "Vol_Excel", "Liq_Excel", "ICMS_Excel"]
         cols_existentes = [c for c in cols_dup if c in df_duplicadas.columns]
         df_export = df_duplicadas[cols_existentes].sort_values(by="NF_Clean")
-        
-        for r in dataframe_to_rows(df_export, index=False, header=True):
-            ws1.append(r)
-        
-        _estilizar_planilha(ws1, cor_padrao="FFFFE0") # Amarelo claro para avisos
+
+        _escrever_aba(wb, "Duplicadas no Excel", df_export, cor_padrao="FFFFE0") # Amarelo claro para avisos
 
     # --- ABA 2: SEM XML ---
     if lista_sem_xml:
-        if "Duplicadas no Excel" in wb.sheetnames:
-            ws2 = wb.create_sheet("Faltam XMLs")
-        else:
-            ws2 = wb.active
-            ws2.title = "Faltam XMLs"
-
         df_sem = pd.DataFrame(lista_sem_xml)
         cols_sem = ["Nota", "Mes", "Liq Excel", "Status", "Obs"]
         cols_sem = [c for c in cols_sem if c in df_sem.columns]
-        
-        for r in dataframe_to_rows(df_sem[cols_sem], index=False, header=True):
-            ws2.append(r)
 
-        _estilizar_planilha(ws2, cor_padrao="FFC7CE") # Vermelho claro para erros
+        _escrever_aba(wb, "Faltam XMLs", df_sem[cols_sem], cor_padrao="FFC7CE") # Vermelho claro para erros
+
+    # --- ABA 3: XMLs DUPLICADOS (ignorados na soma) ---
+    if lista_xml_duplicados:
+        df_xdup = pd.DataFrame(lista_xml_duplicados)
+        cols_xdup = ["Nota", "Empresa", "Arquivo", "Chave", "Mantido"]
+        cols_xdup = [c for c in cols_xdup if c in df_xdup.columns]
+
+        _escrever_aba(wb, "XMLs Duplicados", df_xdup[cols_xdup], cor_padrao="FFFFE0")
+
+    if not wb.sheetnames:
+        wb.create_sheet("Sheet")
 
     try:
         wb.save(caminho_avisos)
@@ -155,74 +252,99 @@ def gerar_relatorio_avisos(df_duplicadas: pd.DataFrame, lista_sem_xml: List[Dict
 
     return caminho_avisos
 
-def _estilizar_planilha(ws, cor_padrao=None):
-    """Aplica formatação profissional: Cabeçalho Azul, Zebra ou Condicional."""
-    # Cores
-    header_fill = PatternFill(start_color="203764", end_color="203764", fill_type="solid") # Azul Escuro
-    header_font = Font(bold=True, color="FFFFFF")
-    
-    fill_verde = PatternFill(start_color="C6EFCE", end_color="C6EFCE", fill_type="solid")
-    font_verde = Font(color="006100")
-    
-    fill_vermelho = PatternFill(start_color="FFC7CE", end_color="FFC7CE", fill_type="solid")
-    font_vermelho = Font(color="9C0006")
-
-    fill_amarelo = PatternFill(start_color="FFEB9C", end_color="FFEB9C", fill_type="solid")
-    font_amarelo = Font(color="9C6500")
-
-    # Formata Cabeçalho
-    for cell in ws[1]:
-        cell.fill = header_fill
-        cell.font = header_font
-        cell.alignment = Alignment(horizontal="center", vertical="center")
-
-    # Tenta achar coluna de Status
-    col_status = None
-    for cell in ws[1]:
-        if str(cell.value).lower() == "status":
-            col_status = cell.column
-            break
-
-    # Formata Linhas
-    for row in ws.iter_rows(min_row=2):
-        status_val = ""
-        if col_status:
-            status_val = str(row[col_status-1].value).upper()
-
-        fill_atual = None
-        font_atual = None
-
-        if "OK" in status_val:
-            fill_atual = fill_verde
-            font_atual = font_verde
-        elif "ERRO" in status_val or "SEM" in status_val:
-            fill_atual = fill_vermelho
-            font_atual = font_vermelho
-        elif "PENDENTE" in status_val:
-            fill_atual = fill_amarelo
-            font_atual = font_amarelo
-        elif cor_padrao:
-             fill_atual = PatternFill(start_color=cor_padrao, end_color=cor_padrao, fill_type="solid")
-
-        if fill_atual:
-            for cell in row:
-                cell.fill = fill_atual
-                if font_atual: cell.font = font_atual
-        
-        # Formatação de Números
-        for cell in row:
-            v = cell.value
-            if isinstance(v, (int, float)):
-                cell.number_format = '#,##0.00'
-
-    # Ajuste Automático de Largura
-    for col in ws.columns:
-        largura = 15
-        try:
-            val = str(col[0].value)
-            if len(val) > largura: largura = len(val) + 2
-        except: pass
-        ws.column_dimensions[col[0].column_letter].width = largura
+def _escrever_aba(wb, titulo: str, df: pd.DataFrame, cor_padrao=None):
+    """
+    Grava `df` numa aba nova de um Workbook write-only (cabeçalho azul, cores
+    por Status, números em #,##0.00), sem montar estilo célula a célula:
+    - cabeçalho, números e cor padrão vêm de estilos nomeados do workbook;
+    - as cores de Status são regras de formatação condicional da aba.
+    """
+    ws = wb.create_sheet(titulo)
+    colunas = [str(c) for c in df.columns]
+
+    # Largura (no write-only tem de ser definida antes da primeira linha)
+    for i, nome in enumerate(colunas, start=1):
+        ws.column_dimensions[get_column_letter(i)].width = len(nome) + 2 if len(nome) > 15 else 15
+
+    estilo_cab = _estilo_nomeado(wb, "Auditoria Cabeçalho", fill=_HEADER_FILL, font=_HEADER_FONT, alignment=_HEADER_ALIGN)
+    sufixo = f" {cor_padrao}" if cor_padrao else ""
+    fill_padrao = PatternFill(start_color=cor_padrao, end_color=cor_padrao, fill_type="solid") if cor_padrao else None
+    estilo_num = _estilo_nomeado(wb, f"Auditoria Número{sufixo}", fill=fill_padrao, numero=True)
+    estilo_txt = _estilo_nomeado(wb, f"Auditoria Texto{sufixo}", fill=fill_padrao) if cor_padrao else None
+
+    def _celula(v):
+        if isinstance(v, (int, float)):
+            estilo = estilo_num
+        elif estilo_txt:
+            estilo = estilo_txt
+        else:
+            return v
+        cell = WriteOnlyCell(ws, value=v)
+        cell.style = estilo
+        return cell
+
+    cabecalho = []
+    for nome in df.columns:
+        cell = WriteOnlyCell(ws, value=nome)
+        cell.style = estilo_cab
+        cabecalho.append(cell)
+    ws.append(cabecalho)
+
+    for r in dataframe_to_rows(df, index=False, header=False):
+        ws.append([_celula(v) for v in r])
+
+    col_status = next((i for i, nome in enumerate(colunas, start=1) if nome.lower() == "status"), None)
+    if col_status is not None and len(df):
+        _formatar_status(ws, col_status, len(colunas), len(df) + 1)
+    return ws
+
+
+def _estilo_nomeado(wb, nome: str, fill=None, font=None, alignment=None, numero: bool = False) -> str:
+    """Registra (uma vez por workbook) o estilo nomeado `nome` e devolve o nome."""
+    if nome not in wb.named_styles:
+        estilo = NamedStyle(name=nome)
+        if fill is not None:
+            estilo.fill = fill
+        if font is not None:
+            estilo.font = font
+        if alignment is not None:
+            estilo.alignment = alignment
+        if numero:
+            estilo.number_format = "#,##0.00"
+        wb.add_named_style(estilo)
+    return nome
+
+
+def _formatar_status(ws, col_status: int, n_colunas: int, ultima_linha: int):
+    """
+    Pinta a linha inteira conforme o texto da coluna Status (sem diferenciar
+    maiúsculas, como antes). A ordem das regras é a prioridade: OK, ERRO/SEM, PENDENTE.
+    """
+    faixa = f"A2:{get_column_letter(n_colunas)}{ultima_linha}"
+    ref = f"${get_column_letter(col_status)}2"
+    regras = [
+        (("OK",), _FILL_VERDE, _FONT_VERDE),
+        (("ERRO", "SEM"), _FILL_VERMELHO, _FONT_VERMELHO),
+        (("PENDENTE",), _FILL_AMARELO, _FONT_AMARELO),
+    ]
+    for termos, fill, font in regras:
+        testes = [f'ISNUMBER(SEARCH("{t}",{ref}))' for t in termos]
+        formula = testes[0] if len(testes) == 1 else f"OR({','.join(testes)})"
+        ws.conditional_formatting.add(faixa, FormulaRule(formula=[formula], fill=fill, font=font, stopIfTrue=True))
+
+
+# Cores
+_HEADER_FILL = PatternFill(start_color="203764", end_color="203764", fill_type="solid") # Azul Escuro
+_HEADER_FONT = Font(bold=True, color="FFFFFF")
+_HEADER_ALIGN = Alignment(horizontal="center", vertical="center")
+
+_FILL_VERDE = PatternFill(start_color="C6EFCE", end_color="C6EFCE", fill_type="solid")
+_FONT_VERDE = Font(color="006100")
+_FILL_VERMELHO = PatternFill(start_color="FFC7CE", end_color="FFC7CE", fill_type="solid")
+_FONT_VERMELHO = Font(color="9C0006")
+_FILL_AMARELO = PatternFill(start_color="FFEB9C", end_color="FFEB9C", fill_type="solid")
+_FONT_AMARELO = Font(color="9C6500")
+
 
 def _gerar_pdf_resumo(caminho, df):
     """Gera PDF com a explicação solicitada."""
@@ -2,25 +2,72 @@ import math
 import re
 from typing import Iterable, List
 
+import numpy as np
 import pandas as pd
 
 
 ANO_ALVO = "25"
 MESES_ALVO = ["OUT", "NOV", "DEZ"]
 
+# Operações de string vetorizadas (ufuncs de np.strings) só existem a partir do numpy 2
+HAS_NP_STRINGS = hasattr(np, "strings") and hasattr(np.dtypes, "StringDType")
+
+
+# Número da NF: corta no primeiro "-" ou "/", ignora pontos e fica com a primeira
+# sequência de dígitos sem zeros à esquerda. Mesmas regex no escalar e no vetorizado.
+_RE_NF_CORTE = re.compile(r"[-/].*|\.", re.S)
+_RE_NF_DIGITOS = re.compile(r"0*(\d+)")
+
 
 def limpar_numero_nf_bruto(valor) -> str:
-    if pd.isna(valor) or str(valor).strip() == "":
+    if pd.isna(valor):
         return ""
-    texto = str(valor).upper().strip()
-    if "-" in texto:
-        texto = texto.split("-")[0]
-    if "/" in texto:
-        texto = texto.split("/")[0]
-    nums = re.findall(r"\d+", texto.replace(".", ""))
-    if nums:
-        return str(int(nums[0]))
-    return ""
+    m = _RE_NF_DIGITOS.search(_RE_NF_CORTE.sub("", str(valor)))
+    return str(int(m.group(1))) if m else ""
+
+
+def _limpar_nf_textos(textos: pd.Series) -> pd.Series:
+    """Regras do limpar_numero_nf_bruto com extração vetorizada (textos = Series de str)."""
+    digitos = textos.str.replace(_RE_NF_CORTE, "", regex=True).str.extract(_RE_NF_DIGITOS, expand=False)
+
+    # Dígitos fora do ASCII (ex.: árabes) também contam para o \d: normaliza como o int()
+    fora_ascii = ~digitos.str.fullmatch(r"[0-9]+", na=True).astype(bool)
+    if fora_ascii.any():
+        digitos[fora_ascii] = [str(int(d)) for d in digitos[fora_ascii]]
+    return digitos.fillna("")
+
+
+def limpar_numero_nf_series(serie: pd.Series, como_inteiro: bool = False) -> pd.Series:
+    """
+    Versão vetorizada de `limpar_numero_nf_bruto` (mesmo resultado linha a linha).
+    Cada valor distinto é tratado uma vez; células só com dígitos (o caso comum) não passam por regex.
+    Com `como_inteiro=True` devolve a chave como Int64 (nulo quando não há número, ou
+    com mais de 18 dígitos), para joins sem hash de texto.
+    """
+    # Texto antes do factorize: 1, 1.0 e True são "iguais" para o pandas, mas não como texto
+    texto = serie.astype(str).to_numpy(dtype=object)
+    texto[serie.isna().to_numpy()] = None
+    codigos, unicos = pd.factorize(texto, use_na_sentinel=True)
+    textos = pd.Series(unicos, dtype=object)
+
+    # Última posição = sentinela dos nulos (código -1)
+    limpos = np.empty(len(textos) + 1, dtype=object)
+    limpos[-1] = ""
+    so_digitos = np.zeros(len(textos), dtype=bool)
+    if HAS_NP_STRINGS and len(textos):
+        a = np.array(textos.tolist(), dtype=np.dtypes.StringDType())
+        so_digitos = (np.strings.str_len(a) > 0) & (np.strings.str_len(np.strings.lstrip(a, "0123456789")) == 0)
+        sem_zeros = np.strings.lstrip(a[so_digitos], "0")
+        sem_zeros[np.strings.str_len(sem_zeros) == 0] = "0"
+        limpos[:-1][so_digitos] = sem_zeros.tolist()
+    if not so_digitos.all():
+        limpos[:-1][~so_digitos] = _limpar_nf_textos(textos[~so_digitos]).tolist()
+
+    limpo = pd.Series(limpos[codigos], index=serie.index, name=serie.name).astype(str)
+    if como_inteiro:
+        curto = limpo.where(limpo.str.len().between(1, 18))
+        return pd.to_numeric(curto, errors="coerce", dtype_backend="numpy_nullable").astype("Int64")
+    return limpo
 
 
 def to_float(texto) -> float:
@@ -55,6 +102,73 @@ def to_float(texto) -> float:
         return 0.0
 
 
+def _decodificar_textos(textos: List[str]) -> np.ndarray:
+    """Regras de texto do to_float aplicadas a um array inteiro de strings."""
+    if not HAS_NP_STRINGS:
+        return np.array([to_float(t) for t in textos], dtype=float)
+
+    a = np.array(textos, dtype=np.dtypes.StringDType())
+
+    # Fora do alfabeto 0-9 . , - (R$, espaços, letras): mesma regex do to_float.
+    # Remover esses caracteres antes de corrigir as vírgulas dá o mesmo resultado.
+    sujo = np.strings.str_len(np.strings.lstrip(a, "0123456789.,-")) > 0
+    if sujo.any():
+        a[sujo] = [re.sub(r"[^\d.,-]", "", t) for t in a[sujo].tolist()]
+
+    virgulas = np.strings.count(a, ",")
+    uma = virgulas == 1
+    if uma.any():
+        a[uma] = np.strings.replace(np.strings.replace(a[uma], ".", ""), ",", ".")
+
+    # Múltiplas vírgulas (milhar errado): só a última vira separador decimal
+    varias = virgulas > 1
+    if varias.any():
+        a[varias] = [
+            t[: t.rindex(",")].replace(",", "") + "." + t[t.rindex(",") + 1 :] for t in a[varias].tolist()
+        ]
+
+    try:
+        return a.astype(float)
+    except ValueError:
+        # Vazio, "-", "1.2.3"...: float() recusa e o to_float devolve 0.0
+        out = np.zeros(len(a), dtype=float)
+        for i, t in enumerate(a.tolist()):
+            try:
+                out[i] = float(t)
+            except ValueError:
+                pass
+        return out
+
+
+def to_float_series(serie: pd.Series) -> pd.Series:
+    """
+    Versão vetorizada de `to_float` para uma coluna inteira (mesmo resultado célula a célula).
+    Colunas já numéricas passam direto; nas demais cada valor distinto é decodificado
+    uma única vez (factorize funciona como memo dos valores repetidos).
+    """
+    if pd.api.types.is_bool_dtype(serie) or pd.api.types.is_integer_dtype(serie) or pd.api.types.is_float_dtype(serie):
+        valores = serie.to_numpy(dtype=float, na_value=np.nan)
+        return pd.Series(np.where(np.isnan(valores), 0.0, valores), index=serie.index, name=serie.name)
+
+    codigos, unicos = pd.factorize(serie, use_na_sentinel=True)
+    unicos = np.asarray(unicos, dtype=object)
+
+    # Mesma regra do to_float (isinstance int/float), decidida uma vez por tipo
+    tipos = pd.Series(unicos, dtype=object).map(type)
+    eh_nativo = {t: issubclass(t, (int, float)) for t in set(tipos)}
+    nativo = tipos.map(eh_nativo).to_numpy(dtype=bool)
+
+    # Última posição = sentinela dos nulos (código -1)
+    valores = np.zeros(len(unicos) + 1, dtype=float)
+    valores[:-1][nativo] = unicos[nativo].astype(float)
+
+    if not nativo.all():
+        textos = [u if isinstance(u, str) else str(u) for u in unicos[~nativo]]
+        valores[:-1][~nativo] = _decodificar_textos(textos)
+
+    return pd.Series(valores[codigos], index=serie.index, name=serie.name)
+
+
 def make_unique_columns(cols: Iterable[str]) -> List[str]:
     seen = {}
     out = []
@@ -0,0 +1,137 @@
+import math
+import os
+import zipfile
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple, Union
+
+from .xml_parser import CAMPOS_XML, parse_xml_file
+
+# Abaixo disso não compensa subir um pool de processos
+MIN_ARQUIVOS_PARALELO = 200
+TAMANHO_LOTE_MAX = 500
+# Falhas de leitura (arquivo travado, sem permissão, ZIP truncado) podem não se repetir no
+# próximo run: o item vira {"Erro": ...} em vez de None e não vai para o cache de parse
+_ERROS_LEITURA = (OSError, EOFError, zipfile.BadZipFile, zlib.error)
+
+
+def resolver_workers(workers: Optional[int]) -> int:
+    """None/0 = autodetecta pelos núcleos da máquina; 1 = serial."""
+    if workers is None or workers <= 0:
+        return max(1, os.cpu_count() or 1)
+    return int(workers)
+
+
+def _parse_um(caminho: str, streaming: bool, z: Optional[zipfile.ZipFile]) -> Union[Dict, str, None]:
+    """dict do parser; None se o XML é inválido/não fiscal; str com a falha de leitura."""
+    try:
+        if z is not None:
+            with z.open(caminho) as f:
+                return parse_xml_file(f, streaming=streaming)
+        return parse_xml_file(caminho, streaming=streaming)
+    except _ERROS_LEITURA as e:
+        return f"{type(e).__name__}: {e}"
+    except Exception:
+        return None
+
+
+def _parse_lote(
+    caminhos: List[str], streaming: bool = False, zip_path: Optional[str] = None
+) -> List[Union[tuple, str, None]]:
+    """
+    Roda no processo worker. Devolve uma tupla por arquivo (na ordem de CAMPOS_XML)
+    em vez do dict completo, para reduzir o custo de serialização entre processos
+    (a mensagem, se a leitura falhou).
+    Com `zip_path`, `caminhos` são membros do ZIP, lidos direto do arquivo compactado.
+    """
+    z = zipfile.ZipFile(zip_path) if zip_path else None
+    try:
+        out: List[Union[tuple, str, None]] = []
+        for p in caminhos:
+            info = _parse_um(p, streaming, z)
+            out.append(tuple(info.get(c) for c in CAMPOS_XML) if isinstance(info, dict) else info)
+        return out
+    finally:
+        if z is not None:
+            z.close()
+
+
+def impressoes_digitais(caminhos: Sequence[str], zip_path: Optional[str] = None) -> Dict[str, Tuple[int, str]]:
+    """
+    (tamanho, assinatura) de cada arquivo, usados como chave do cache de parse:
+    mtime em disco ou CRC do membro quando a fonte é um ZIP. Só lê metadados.
+    """
+    out: Dict[str, Tuple[int, str]] = {}
+    if zip_path:
+        with zipfile.ZipFile(zip_path) as z:
+            membros = {i.filename: i for i in z.infolist()}
+        for p in caminhos:
+            i = membros.get(p)
+            if i is not None:
+                out[p] = (i.file_size, f"crc:{i.CRC:08x}")
+        return out
+
+    for p in caminhos:
+        try:
+            st = os.stat(p)
+        except OSError:
+            continue
+        out[p] = (st.st_size, f"mtime:{st.st_mtime_ns}")
+    return out
+
+
+def _expandir(compactos: List[Union[tuple, str, None]]) -> List[Optional[Dict]]:
+    return [
+        {"Erro": t} if isinstance(t, str) else dict(zip(CAMPOS_XML, t)) if t is not None else None
+        for t in compactos
+    ]
+
+
+def parse_xmls_em_lotes(
+    caminhos: Sequence[str],
+    workers: int = 1,
+    tamanho_lote: Optional[int] = None,
+    streaming: bool = False,
+    zip_path: Optional[str] = None,
+    cache: Optional[Dict[str, Optional[Dict]]] = None,
+) -> Iterator[List[Optional[Dict]]]:
+    """
+    Faz o parse de `caminhos` e devolve os resultados em lotes, na MESMA ordem da entrada.
+    Cada item é o dict de `parse_xml_file`, None (XML inválido / não fiscal) ou
+    {"Erro": mensagem} quando a leitura falhou (arquivo travado, sem permissão, ZIP truncado).
+
+    Com workers > 1 os lotes são distribuídos num ProcessPoolExecutor; a ordem é
+    preservada porque `executor.map` devolve os lotes na ordem de submissão.
+    `streaming` usa o parser iterparse (memória constante por arquivo) e `zip_path`
+    indica que `caminhos` são membros desse ZIP (sem extrair para o disco).
+    `cache` traz resultados já conhecidos (caminho -> dict/None): esses não são relidos.
+    """
+    caminhos = list(caminhos)
+    if not caminhos:
+        return
+
+    if cache:
+        pendentes = [p for p in caminhos if p not in cache]
+        novos = (i for lote in parse_xmls_em_lotes(pendentes, workers, tamanho_lote, streaming, zip_path) for i in lote)
+        passo = tamanho_lote or TAMANHO_LOTE_MAX
+        for ini in range(0, len(caminhos), passo):
+            yield [cache[p] if p in cache else next(novos) for p in caminhos[ini : ini + passo]]
+        return
+
+    workers = resolver_workers(workers)
+    if not tamanho_lote:
+        tamanho_lote = max(1, min(TAMANHO_LOTE_MAX, math.ceil(len(caminhos) / (workers * 4))))
+
+    parse = partial(_parse_lote, streaming=streaming, zip_path=str(zip_path) if zip_path else None)
+    lotes = [caminhos[i : i + tamanho_lote] for i in range(0, len(caminhos), tamanho_lote)]
+
+    if workers == 1 or len(caminhos) < MIN_ARQUIVOS_PARALELO:
+        for lote in lotes:
+            yield _expandir(parse(lote))
+        return
+
+    print(f"[XML] Parse paralelo: {len(caminhos)} arquivo(s), {workers} worker(s), lotes de {tamanho_lote}.")
+    with ProcessPoolExecutor(max_workers=workers) as ex:
+        for compactos in ex.map(parse, lotes):
+            yield _expandir(compactos)
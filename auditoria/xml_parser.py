@@ -1,8 +1,16 @@
+import hashlib
+import os
 import re
 import xml.etree.ElementTree as ET
-from typing import Dict, Optional
+from typing import IO, Dict, Optional, Union
 
-from .utils import to_float
+from .utils import limpar_numero_nf_bruto, to_float
+
+# Ordem dos campos devolvidos por parse_nfe/parse_cte (usada para trafegar
+# resultados compactos entre processos, ver xml_batch.py)
+CAMPOS_XML = ("Tipo", "Nota", "Vol", "Bruto", "ICMS", "PIS", "COFINS", "Liq_Calc", "Chave", "Hash")
+# Incrementar sempre que o dict devolvido mudar (invalida o cache de parse do AuditDB)
+VERSAO_PARSER = 4
 
 
 def strip_ns(tag: str) -> str:
@@ -29,129 +37,375 @@ def get_first_text(root: ET.Element, path_names):
     return rec(root, 0)
 
 
-def parse_nfe(root: ET.Element) -> Optional[Dict]:
-    inf = next(iter(iter_elems(root, "infNFe")), None)
-    if inf is None:
-        return None
+# ============================================================
+# Extração em passada única
+# ============================================================
+# Tabela tag -> slot dos campos com caminho fixo a partir do infNFe/infCte, em
+# forma de trie (mesma semântica de get_first_text: primeiro texto não-nulo
+# em ordem de documento, independente por campo).
+def _trie(caminhos: Dict[tuple, str]) -> Dict:
+    raiz: Dict = {}
+    for caminho, slot in caminhos.items():
+        no = raiz
+        for i, nome in enumerate(caminho):
+            ent = no.setdefault(nome, [None, {}])
+            if i == len(caminho) - 1:
+                ent[0] = slot
+            no = ent[1]
+    return raiz
+
+
+_TRIE_NFE = _trie(
+    {
+        ("ide", "nNF"): "nNF",
+        ("total", "ICMSTot", "vNF"): "vNF",
+        ("total", "ICMSTot", "vICMS"): "vICMS",
+        ("total", "ICMSTot", "vPIS"): "vPIS",
+        ("total", "ICMSTot", "vCOFINS"): "vCOFINS",
+        ("transp", "vol", "qVol"): "qVol",
+    }
+)
+_TRIE_CTE = _trie(
+    {
+        ("ide", "nCT"): "nCT",
+        ("vPrest", "vTPrest"): "vTPrest",
+    }
+)
+# No CT-e os impostos valem pela primeira ocorrência em qualquer profundidade do infCte
+_IMPOSTOS_CTE = ("vICMS", "vPIS", "vCOFINS")
+
+_NOMES_LOCAIS: Dict[str, str] = {}
+
 
-    nNF = get_first_text(inf, ["ide", "nNF"])
-    nota = re.sub(r"\D", "", nNF or "")
-    if nota:
-        nota = str(int(nota))
-
-    vNF = get_first_text(inf, ["total", "ICMSTot", "vNF"])
-    vICMS = get_first_text(inf, ["total", "ICMSTot", "vICMS"])
-    vPIS = get_first_text(inf, ["total", "ICMSTot", "vPIS"])
-    vCOFINS = get_first_text(inf, ["total", "ICMSTot", "vCOFINS"])
-
-    bruto = to_float(vNF)
-    icms = to_float(vICMS)
-    pis = to_float(vPIS)
-    cof = to_float(vCOFINS)
-
-    # Volume: soma itens com unidade M3/NM3
-    vol = 0.0
-    for det in iter_elems(inf, "det"):
-        prod = next((ch for ch in det if strip_ns(ch.tag) == "prod"), None)
-        if prod is None:
+def _nome_local(tag: str) -> str:
+    nome = _NOMES_LOCAIS.get(tag)
+    if nome is None:
+        if len(_NOMES_LOCAIS) > 10_000:
+            _NOMES_LOCAIS.clear()
+        nome = _NOMES_LOCAIS[tag] = strip_ns(tag)
+    return nome
+
+
+def _primeiros_textos(node: ET.Element, trie: Dict, out: Dict[str, str]) -> None:
+    for ch in node:
+        ent = trie.get(_nome_local(ch.tag))
+        if ent is None:
             continue
-        uCom = get_first_text(prod, ["uCom"]) or ""
-        qCom = get_first_text(prod, ["qCom"])
-        u = uCom.upper().replace("³", "3")
-        if "M3" in u:
-            vol += to_float(qCom)
+        slot, sub = ent
+        if slot is not None and slot not in out and ch.text is not None:
+            out[slot] = ch.text
+        if sub:
+            _primeiros_textos(ch, sub, out)
 
-    # fallback transporte
-    if vol == 0.0:
-        qVol = get_first_text(inf, ["transp", "vol", "qVol"])
-        if qVol:
-            vol = to_float(qVol)
 
+def _primeiro_filho(node: ET.Element, nome: str, com_texto: bool = False) -> Optional[ET.Element]:
+    for ch in node:
+        if _nome_local(ch.tag) == nome and (not com_texto or ch.text is not None):
+            return ch
+    return None
+
+
+class _ColetorFiscal:
+    """
+    Acumula os campos de um infNFe/infCte recebendo seus filhos diretos, em ordem
+    de documento. Cada subárvore é percorrida uma única vez (iterador em C do
+    ElementTree + tabela de nomes), em vez de uma busca completa por campo.
+    """
+
+    def __init__(self, tipo: str, inf: ET.Element):
+        self.tipo = tipo
+        self.chave = _chave_acesso(inf)
+        self.campos: Dict[str, str] = {}
+        self.filhos_vistos = set()
+        self.vol_itens = 0.0
+        # CT-e
+        self.impostos: Dict[str, float] = {}
+        self.vol_carga = 0.0
+        self.vol_carga_ok = False
+
+    def consumir(self, filho: ET.Element) -> None:
+        self.filhos_vistos.add(_nome_local(filho.tag))
+        if self.tipo == "NF-e":
+            self._consumir_nfe(filho)
+        else:
+            self._consumir_cte(filho)
+
+    def _consumir_nfe(self, filho: ET.Element) -> None:
+        ent = _TRIE_NFE.get(_nome_local(filho.tag))
+        if ent is not None:
+            _primeiros_textos(filho, ent[1], self.campos)
+
+        # Volume: soma itens com unidade M3/NM3
+        for el in filho.iter():
+            if _nome_local(el.tag) != "det":
+                continue
+            prod = _primeiro_filho(el, "prod")
+            if prod is None:
+                continue
+            uCom = _primeiro_filho(prod, "uCom", com_texto=True)
+            qCom = _primeiro_filho(prod, "qCom", com_texto=True)
+            u = (uCom.text if uCom is not None else "").upper().replace("³", "3")
+            if "M3" in u:
+                self.vol_itens += to_float(qCom.text if qCom is not None else None)
+
+    def _consumir_cte(self, filho: ET.Element) -> None:
+        ent = _TRIE_CTE.get(_nome_local(filho.tag))
+        if ent is not None:
+            _primeiros_textos(filho, ent[1], self.campos)
+
+        for el in filho.iter():
+            nome = _nome_local(el.tag)
+            if nome in _IMPOSTOS_CTE:
+                if nome not in self.impostos:
+                    self.impostos[nome] = to_float(el.text)
+            elif nome == "infQ" and not self.vol_carga_ok:
+                q = _primeiro_filho(el, "qCarga", com_texto=True)
+                if q is not None and q.text:
+                    self.vol_carga = to_float(q.text)
+                    self.vol_carga_ok = self.vol_carga > 0
+
+    def completo(self) -> bool:
+        """
+        True quando nada que ainda venha no documento muda o resultado (permite encerrar
+        a leitura cedo). NF-e: no leiaute oficial nada do que interessa vem depois do
+        total/transp. CT-e: os impostos valem pela primeira ocorrência em qualquer ponto
+        do infCte, então só encerra com os três já vistos (vPIS/vCOFINS podem vir depois
+        do imp/infCTeNorm) e a primeira carga positiva lida.
+        """
+        vistos = self.filhos_vistos
+        if self.tipo == "NF-e":
+            return "ide" in vistos and "total" in vistos and (self.vol_itens > 0 or "transp" in vistos)
+        return ("ide" in vistos and "vPrest" in vistos and self.vol_carga_ok
+                and len(self.impostos) == len(_IMPOSTOS_CTE))
+
+    def montar(self) -> Dict:
+        return _montar_nfe(self) if self.tipo == "NF-e" else _montar_cte(self)
+
+
+def _chave_acesso(inf: ET.Element) -> str:
+    """Chave de acesso de 44 dígitos do atributo Id (ex.: Id="NFe3525...")."""
+    chave = re.sub(r"\D", "", inf.get("Id") or "")
+    return chave if len(chave) == 44 else ""
+
+
+def _liquido(bruto: float, icms: float, pis: float, cof: float) -> float:
     liq = bruto
     for v in (icms, pis, cof):
         if bruto > 0 and 0 < v < bruto:
             liq -= v
-    liq = max(liq, 0.0)
+    return max(liq, 0.0)
+
+
+def _montar_nfe(c: _ColetorFiscal) -> Dict:
+    bruto = to_float(c.campos.get("vNF"))
+    icms = to_float(c.campos.get("vICMS"))
+    pis = to_float(c.campos.get("vPIS"))
+    cof = to_float(c.campos.get("vCOFINS"))
+
+    vol = c.vol_itens
+    # fallback transporte
+    if vol == 0.0:
+        qVol = c.campos.get("qVol")
+        if qVol:
+            vol = to_float(qVol)
 
     return {
         "Tipo": "NF-e",
-        "Nota": nota,
+        "Nota": limpar_numero_nf_bruto(c.campos.get("nNF")),
         "Vol": vol,
         "Bruto": bruto,
         "ICMS": icms,
         "PIS": pis,
         "COFINS": cof,
-        "Liq_Calc": liq,
+        "Liq_Calc": _liquido(bruto, icms, pis, cof),
+        "Chave": c.chave,
     }
 
 
-def parse_cte(root: ET.Element) -> Optional[Dict]:
-    inf = next(iter(iter_elems(root, "infCte")), None)
-    if inf is None:
-        return None
-
-    nCT = get_first_text(inf, ["ide", "nCT"])
-    nota = re.sub(r"\D", "", nCT or "")
-    if nota:
-        nota = str(int(nota))
-
-    bruto = to_float(get_first_text(inf, ["vPrest", "vTPrest"]))
-
-    icms = 0.0
-    for el in iter_elems(inf, "vICMS"):
-        icms = to_float(el.text)
-        break
-
-    pis = 0.0
-    cof = 0.0
-    for el in iter_elems(inf, "vPIS"):
-        pis = to_float(el.text)
-        break
-    for el in iter_elems(inf, "vCOFINS"):
-        cof = to_float(el.text)
-        break
-
-    vol = 0.0
-    for infQ in iter_elems(inf, "infQ"):
-        q = get_first_text(infQ, ["qCarga"])
-        if q:
-            vol = to_float(q)
-            if vol > 0:
-                break
-
-    liq = bruto
-    for v in (icms, pis, cof):
-        if bruto > 0 and 0 < v < bruto:
-            liq -= v
-    liq = max(liq, 0.0)
+def _montar_cte(c: _ColetorFiscal) -> Dict:
+    bruto = to_float(c.campos.get("vTPrest"))
+    icms = c.impostos.get("vICMS", 0.0)
+    pis = c.impostos.get("vPIS", 0.0)
+    cof = c.impostos.get("vCOFINS", 0.0)
 
     return {
         "Tipo": "CT-e",
-        "Nota": nota,
-        "Vol": vol,
+        "Nota": limpar_numero_nf_bruto(c.campos.get("nCT")),
+        "Vol": c.vol_carga,
         "Bruto": bruto,
         "ICMS": icms,
         "PIS": pis,
         "COFINS": cof,
-        "Liq_Calc": liq,
+        "Liq_Calc": _liquido(bruto, icms, pis, cof),
+        "Chave": c.chave,
     }
 
 
-def parse_xml_file(path: str) -> Optional[Dict]:
-    tree = ET.parse(path)
-    root = tree.getroot()
+def _extrair(inf: ET.Element, tipo: str) -> Dict:
+    c = _ColetorFiscal(tipo, inf)
+    for filho in inf:
+        c.consumir(filho)
+    return c.montar()
 
-    root_tag = strip_ns(root.tag).lower()
-    tags = {strip_ns(el.tag) for el in root.iter()}
 
-    # prioridade CT-e se for namespace/estrutura CT-e
-    if "infCte" in tags and ("cte" in root_tag or "portalfiscal.inf.br/cte" in root.tag.lower()):
-        return parse_cte(root)
+def _raiz_cte(root_tag: str) -> bool:
+    return "cte" in strip_ns(root_tag).lower() or "portalfiscal.inf.br/cte" in root_tag.lower()
 
-    if "infNFe" in tags:
-        return parse_nfe(root)
 
-    if "infCte" in tags:
-        return parse_cte(root)
+def _localizar_documento(root: ET.Element):
+    """
+    Devolve (tipo, inf) com a mesma prioridade do detector original:
+    CT-e se a raiz for de CT-e, senão NF-e, senão CT-e. Para de ler assim que decide.
+    """
+    raiz_cte = _raiz_cte(root.tag)
+    inf_nfe = inf_cte = None
+    for el in root.iter():
+        nome = _nome_local(el.tag)
+        if nome == "infNFe" and inf_nfe is None:
+            inf_nfe = el
+            if not raiz_cte:
+                break
+        elif nome == "infCte" and inf_cte is None:
+            inf_cte = el
+            if raiz_cte:
+                break
+
+    if inf_cte is not None and raiz_cte:
+        return "CT-e", inf_cte
+    if inf_nfe is not None:
+        return "NF-e", inf_nfe
+    if inf_cte is not None:
+        return "CT-e", inf_cte
+    return None, None
 
+
+def _primeiro(root: ET.Element, nome: str) -> Optional[ET.Element]:
+    for el in root.iter():
+        if _nome_local(el.tag) == nome:
+            return el
     return None
+
+
+def parse_nfe(root: ET.Element) -> Optional[Dict]:
+    inf = _primeiro(root, "infNFe")
+    if inf is None:
+        return None
+    return _extrair(inf, "NF-e")
+
+
+def parse_cte(root: ET.Element) -> Optional[Dict]:
+    inf = _primeiro(root, "infCte")
+    if inf is None:
+        return None
+    return _extrair(inf, "CT-e")
+
+
+def _parse_streaming(arquivo, parar_cedo: bool = True) -> Optional[Dict]:
+    raiz = None
+    raiz_cte = False
+    prof = 0
+    coletor: Optional[_ColetorFiscal] = None
+    inf = None
+    inf_prof = 0
+    ambiguo = False
+
+    for evento, el in ET.iterparse(arquivo, events=("start", "end")):
+        if evento == "start":
+            prof += 1
+            if raiz is None:
+                raiz = el
+                raiz_cte = _raiz_cte(el.tag)
+            if coletor is None and not ambiguo:
+                nome = _nome_local(el.tag)
+                if nome == "infNFe" or nome == "infCte":
+                    if (nome == "infCte") == raiz_cte:
+                        coletor = _ColetorFiscal("CT-e" if raiz_cte else "NF-e", el)
+                        inf, inf_prof = el, prof
+                    else:
+                        # ex.: infNFe numa raiz de CT-e -> o tipo só se decide no fim do documento
+                        ambiguo = True
+            continue
+
+        prof_el = prof
+        prof -= 1
+        if coletor is not None:
+            if el is inf:
+                return coletor.montar()
+            if prof_el == inf_prof + 1:
+                coletor.consumir(el)
+                el.clear()
+                inf.remove(el)
+                if parar_cedo and coletor.completo():
+                    return coletor.montar()
+        elif not ambiguo:
+            # Antes do infNFe/infCte: nada aqui contém o documento fiscal
+            el.clear()
+
+    if ambiguo and raiz is not None:
+        tipo, inf = _localizar_documento(raiz)
+        return _extrair(inf, tipo) if inf is not None else None
+    return None
+
+
+class _LeitorComHash:
+    """Repassa read() ao arquivo e vai calculando o hash do conteúdo lido."""
+
+    def __init__(self, arquivo):
+        self.arquivo = arquivo
+        self.hash = hashlib.sha1()
+
+    def read(self, n: int = -1) -> bytes:
+        dados = self.arquivo.read(n)
+        self.hash.update(dados)
+        return dados
+
+    def hexdigest(self) -> str:
+        # consome o que o parser não precisou ler, em blocos (memória constante)
+        while self.read(1 << 16):
+            pass
+        return self.hash.hexdigest()
+
+
+def _parse_streaming_com_hash(arquivo) -> Optional[Dict]:
+    leitor = _LeitorComHash(arquivo)
+    info = _parse_streaming(leitor)
+    if info is not None:
+        info["Hash"] = leitor.hexdigest()
+    return info
+
+
+def parse_xml_streaming(fonte) -> Optional[Dict]:
+    """
+    Mesmo resultado de parse_xml_file, mas lendo com ET.iterparse: cada filho do
+    infNFe/infCte é consumido e descartado assim que fecha, então a memória não
+    cresce com o número de itens. A interpretação para assim que o resto do documento
+    não pode mais mudar o resultado (ver _ColetorFiscal.completo); o resto do arquivo
+    só passa pelo hash.
+    Aceita caminho ou arquivo aberto em modo binário.
+    """
+    if isinstance(fonte, (str, os.PathLike)):
+        with open(fonte, "rb") as f:
+            return _parse_streaming_com_hash(f)
+    return _parse_streaming_com_hash(fonte)
+
+
+def parse_xml_file(path: Union[str, IO[bytes]], streaming: bool = False) -> Optional[Dict]:
+    """
+    Lê uma NF-e/CT-e (caminho ou arquivo binário aberto). Além dos valores, devolve
+    a chave de acesso ("Chave") e o SHA-1 do conteúdo ("Hash") para deduplicação.
+    """
+    if streaming:
+        return parse_xml_streaming(path)
+
+    if isinstance(path, (str, os.PathLike)):
+        with open(path, "rb") as f:
+            dados = f.read()
+    else:
+        dados = path.read()
+
+    tipo, inf = _localizar_documento(ET.fromstring(dados))
+    if inf is None:
+        return None
+    info = _extrair(inf, tipo)
+    info["Hash"] = hashlib.sha1(dados).hexdigest()
+    return info
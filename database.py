@@ -1,88 +1,732 @@
 # auditoria/database.py
+import json
+import re
 import duckdb
 import pandas as pd
-from typing import List, Dict
+from contextlib import contextmanager
+from datetime import datetime
+from typing import List, Dict, Optional, Sequence, Tuple, Union
+
+from auditoria.utils import limpar_numero_nf_bruto
+
+# pyarrow é opcional: com ele os lotes vão ao DuckDB como tabelas Arrow (lidas sem cópia)
+try:
+    import pyarrow as pa
+    HAS_PYARROW = True
+    _TIPOS_ARROW = {"VARCHAR": pa.string(), "DOUBLE": pa.float64(), "BIGINT": pa.int64()}
+except ImportError:
+    HAS_PYARROW = False
+_DTYPES_PANDAS = {"VARCHAR": "string", "DOUBLE": "float64", "BIGINT": "Int64"}
 
 class AuditDB:
+    # Esquema fixo das tabelas de fatos (todas com run_id; só recebem INSERT)
+    _COLUNAS_RAW_EXCEL = {
+        "NF_Clean": "VARCHAR", "Vol_Excel": "DOUBLE", "Liq_Excel": "DOUBLE", "ICMS_Excel": "DOUBLE",
+        "PIS_Excel": "DOUBLE", "COFINS_Excel": "DOUBLE", "Mes": "VARCHAR", "Empresa": "VARCHAR",
+        "ordem": "BIGINT",  # posição da linha no Excel (primeiro Mes/Empresa no agrupamento)
+    }
+    _COLUNAS_RELATORIO = {
+        "Arquivo": "VARCHAR", "Tipo": "VARCHAR", "Nota": "VARCHAR", "Empresa": "VARCHAR", "Mes": "VARCHAR",
+        "Vol_Excel": "DOUBLE", "Vol_XML": "DOUBLE", "Diff_Vol": "DOUBLE",
+        "Liq_Excel": "DOUBLE", "Liq_XML_Calc": "DOUBLE", "Bruto_XML": "DOUBLE",
+        "ICMS_Excel": "DOUBLE", "ICMS_XML": "DOUBLE", "PIS_Excel": "DOUBLE", "PIS": "DOUBLE",
+        "COFINS_Excel": "DOUBLE", "COFINS": "DOUBLE", "Diff_R": "DOUBLE",
+        "Status": "VARCHAR", "Obs": "VARCHAR",
+    }
+    # raw_xmls: coluna da tabela -> (chave do dict do xml_parser/audit, tipo)
+    _ESQUEMA_XML = {
+        "chave": ("Chave", "VARCHAR"), "nota": ("Nota", "VARCHAR"), "tipo": ("Tipo", "VARCHAR"),
+        "empresa": ("Empresa", "VARCHAR"), "arquivo_origem": ("Arquivo", "VARCHAR"),
+        "caminho": ("CaminhoCompleto", "VARCHAR"), "hash": ("Hash", "VARCHAR"),
+        "vol": ("Vol", "DOUBLE"), "valor_total": ("Bruto", "DOUBLE"), "icms": ("ICMS", "DOUBLE"),
+        "pis": ("PIS", "DOUBLE"), "cofins": ("COFINS", "DOUBLE"), "liq_calc": ("Liq_Calc", "DOUBLE"),
+        "ordem": ("Ordem", "BIGINT"),  # ordem de leitura no run (primeiro documento de cada chave)
+    }
+    _TABELAS_DE_FATOS = ("raw_xmls", "raw_excel", "relatorio_final", "run_meses", "resumo_relatorio")
+
+    # Consultas de histórico: a CTE MATERIALIZED filtra a tabela de fatos só pela nota/chave,
+    # que é o que faz o DuckDB usar os índices idx_* (qualquer outro filtro no mesmo scan, ou
+    # o JOIN direto, volta para o Sequential Scan); runs e os filtros opcionais entram depois
+    _SQL_HISTORICO = {
+        "nota": """
+            WITH f AS MATERIALIZED (SELECT * FROM relatorio_final WHERE Nota = $1)
+            SELECT r.run_id, r.iniciado_em, r.mes_filtro, r.status AS status_run, f.* EXCLUDE (run_id)
+            FROM f JOIN runs r USING (run_id)
+            WHERE TRUE{filtros}
+            ORDER BY f.run_id
+        """,
+        "xml_nota": """
+            WITH f AS MATERIALIZED (SELECT * FROM raw_xmls WHERE nota = $1)
+            SELECT r.run_id, r.iniciado_em, r.mes_filtro, f.* EXCLUDE (run_id)
+            FROM f JOIN runs r USING (run_id)
+            WHERE TRUE{filtros}
+            ORDER BY f.run_id, f.ordem
+        """,
+    }
+    _SQL_HISTORICO["xml_chave"] = _SQL_HISTORICO["xml_nota"].replace("WHERE nota = $1", "WHERE chave = $1")
+    # Filtros opcionais: só entram no SQL quando informados ({} = número do parâmetro)
+    _FILTROS_HISTORICO = {
+        "empresa": "f.Empresa = ${}", "desde": "r.iniciado_em >= ${}::TIMESTAMP", "ate": "r.iniciado_em < ${}::TIMESTAMP",
+    }
+
     def __init__(self, db_path='auditoria.db'):
         self.con = duckdb.connect(db_path)
+        self.run_id: Optional[int] = None
+        self._preparadas = set()  # PREPAREs de histórico já feitos nesta conexão
 
     def inicializar(self):
         """Cria as tabelas necessárias"""
-        # Tabela de XMLs (Dados Brutos)
-        self.con.execute("""
+        # Tabela de XMLs (Dados Brutos): as colunas são os campos que o xml_parser produz
+        defs_xml = ", ".join(f"{c} {t}" for c, (_, t) in self._ESQUEMA_XML.items())
+        self.con.execute(f"""
             CREATE TABLE IF NOT EXISTS raw_xmls (
-                chave VARCHAR,
-                nota VARCHAR,
-                data_emissao VARCHAR,
-                emitente VARCHAR,
-                cnpj_emitente VARCHAR,
-                valor_total DOUBLE,
-                vol DOUBLE,
-                icms DOUBLE,
-                pis DOUBLE,
-                cofins DOUBLE,
-                arquivo_origem VARCHAR,
-                importado_em TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                {defs_xml},
+                importado_em TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                run_id BIGINT
             );
         """)
-        
-        # Limpa tabelas temporárias para nova carga
-        self.con.execute("DROP TABLE IF EXISTS raw_excel")
-        self.con.execute("DROP TABLE IF EXISTS relatorio_final")
+        # Bancos antigos: raw_xmls sem run_id (linhas antigas ficam com run_id NULL) e sem os
+        # campos novos do parser (data/emitente/CNPJ de lá ficam, sempre vazios)
+        self.con.execute("ALTER TABLE raw_xmls ADD COLUMN IF NOT EXISTS run_id BIGINT")
+        for coluna, (_, tipo) in self._ESQUEMA_XML.items():
+            self.con.execute(f"ALTER TABLE raw_xmls ADD COLUMN IF NOT EXISTS {coluna} {tipo}")
 
-    def salvar_xmls(self, dados_xml: List[Dict]):
-        """Salva a lista de dicionários dos XMLs"""
-        if not dados_xml:
-            return
-        
-        # Normaliza dados para o DF
-        df = pd.DataFrame(dados_xml)
-        
-        # Seleciona colunas úteis e renomeia se necessário para bater com a tabela
-        # Ajuste conforme as chaves reais que vêm do seu xml_parser.py
-        colunas_map = {
-            'Chave': 'chave', 'Nota': 'nota', 'Data': 'data_emissao',
-            'Emitente': 'emitente', 'CNPJ': 'cnpj_emitente', 
-            'Valor': 'valor_total', 'Vol': 'vol', 
-            'ICMS': 'icms', 'PIS': 'pis', 'COFINS': 'cofins',
-            'Arquivo': 'arquivo_origem'
-        }
-        
-        # Garante que as colunas existam
-        for k in colunas_map.keys():
-            if k not in df.columns:
-                df[k] = None
+        # Histórico de execuções: cada auditoria é um run e as tabelas de fatos só crescem
+        self.con.execute("CREATE SEQUENCE IF NOT EXISTS seq_runs START 1")
+        self.con.execute("""
+            CREATE TABLE IF NOT EXISTS runs (
+                run_id BIGINT PRIMARY KEY,
+                iniciado_em TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                finalizado_em TIMESTAMP,
+                mes_filtro VARCHAR,
+                excel_path VARCHAR,
+                origem_xml VARCHAR,
+                status VARCHAR
+            );
+        """)
+        # Linhas de fatos apagadas pela retenção desde a última compactação (linha única)
+        self.con.execute("""
+            CREATE TABLE IF NOT EXISTS manutencao (
+                linhas_apagadas BIGINT,
+                compactado_em TIMESTAMP
+            );
+        """)
+        self.con.execute("INSERT INTO manutencao SELECT 0, NULL WHERE NOT EXISTS (SELECT 1 FROM manutencao)")
+        # Meses presentes em cada run (base pequena do "último run por mês")
+        self.con.execute("""
+            CREATE TABLE IF NOT EXISTS run_meses (
+                run_id BIGINT,
+                mes VARCHAR,
+                linhas BIGINT
+            );
+        """)
+        # Bancos antigos gravaram o '-' das linhas SEM EXCEL como se fosse um mês
+        self.con.execute("DELETE FROM run_meses WHERE mes IS NULL OR mes = '-'")
+
+        # Resumo do relatório por empresa x mês x tipo x status, gravado no fim de cada run
+        # (dashboards leem daqui: custo proporcional ao número de grupos, não de linhas)
+        resumo_novo = not self._existe_tabela("resumo_relatorio")
+        self.con.execute("""
+            CREATE TABLE IF NOT EXISTS resumo_relatorio (
+                run_id BIGINT,
+                empresa VARCHAR,
+                mes VARCHAR,
+                tipo VARCHAR,
+                status VARCHAR,
+                linhas BIGINT,
+                soma_diff_rs DOUBLE,
+                soma_diff_vol DOUBLE
+            );
+        """)
 
-        df_final = df[list(colunas_map.keys())].rename(columns=colunas_map)
+        # raw_excel/relatorio_final de versões antigas (recriados a cada execução, sem run_id)
+        for tabela in ("raw_excel", "relatorio_final"):
+            if self._existe_tabela(tabela) and "run_id" not in self._colunas(tabela):
+                self.con.execute(f"DROP TABLE {tabela}")
+        for tabela, colunas in (("raw_excel", self._COLUNAS_RAW_EXCEL), ("relatorio_final", self._COLUNAS_RELATORIO)):
+            defs = ", ".join(f"{c} {t}" for c, t in colunas.items())
+            self.con.execute(f"CREATE TABLE IF NOT EXISTS {tabela} (run_id BIGINT, {defs})")
+            for c, t in colunas.items():
+                self.con.execute(f"ALTER TABLE {tabela} ADD COLUMN IF NOT EXISTS {c} {t}")
         
-        # Insere só as 11 colunas; `importado_em` fica com o DEFAULT da tabela
+        # Cache de parse dos XMLs (reauditorias incrementais do mesmo mês)
+        self.con.execute("""
+            CREATE TABLE IF NOT EXISTS cache_parse (
+                caminho VARCHAR PRIMARY KEY,
+                tamanho BIGINT,
+                assinatura VARCHAR,
+                versao INTEGER,
+                resultado VARCHAR,
+                usado_em TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            );
+        """)
+
+        # Cache da saída normalizada de cada aba do Excel (só relê abas alteradas)
         self.con.execute("""
-            INSERT INTO raw_xmls (
-                chave, nota, data_emissao, emitente, cnpj_emitente,
-                valor_total, vol, icms, pis, cofins, arquivo_origem
+            CREATE TABLE IF NOT EXISTS cache_excel (
+                caminho VARCHAR,
+                aba VARCHAR,
+                tamanho BIGINT,
+                assinatura VARCHAR,
+                versao INTEGER,
+                usado_em TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                PRIMARY KEY (caminho, aba)
+            );
+        """)
+        self.con.execute("""
+            CREATE TABLE IF NOT EXISTS cache_excel_linhas (
+                caminho VARCHAR,
+                aba VARCHAR,
+                ordem BIGINT,
+                NF_Clean VARCHAR,
+                Vol_Excel DOUBLE,
+                Liq_Excel DOUBLE,
+                ICMS_Excel DOUBLE,
+                PIS_Excel DOUBLE,
+                COFINS_Excel DOUBLE,
+                Mes VARCHAR
+            );
+        """)
+
+        # Layouts de cabeçalho já resolvidos (impressão digital -> mapa de colunas)
+        self.con.execute("""
+            CREATE TABLE IF NOT EXISTS layouts_excel (
+                digital VARCHAR PRIMARY KEY,
+                versao INTEGER,
+                mapa VARCHAR,
+                visto_em TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            );
+        """)
+
+        # Índices para as consultas pontuais de histórico (nota normalizada e chave de acesso)
+        self.con.execute("CREATE INDEX IF NOT EXISTS idx_relatorio_nota ON relatorio_final (Nota)")
+        self.con.execute("CREATE INDEX IF NOT EXISTS idx_xmls_nota ON raw_xmls (nota)")
+        self.con.execute("CREATE INDEX IF NOT EXISTS idx_xmls_chave ON raw_xmls (chave)")
+
+        if resumo_novo:
+            # Runs gravados antes de existir o resumo (uma vez só, na criação da tabela)
+            self._atualizar_resumo("SELECT DISTINCT run_id FROM relatorio_final WHERE run_id IS NOT NULL")
+
+        # Último run concluído de cada mês (e o relatório correspondente) para o BI.
+        # As tabelas de fatos são gravadas em ordem de run_id, então o filtro por run
+        # usa os zonemaps do DuckDB e não varre o histórico inteiro.
+        self.con.execute("""
+            CREATE OR REPLACE VIEW ultimo_run_por_mes AS
+            SELECT m.mes, m.run_id, m.linhas, r.iniciado_em, r.finalizado_em
+            FROM run_meses m JOIN runs r USING (run_id)
+            WHERE r.status = 'OK'
+            QUALIFY row_number() OVER (PARTITION BY m.mes ORDER BY m.run_id DESC) = 1
+        """)
+        # Linhas SEM EXCEL (Mes '-') não têm mês próprio: ficam com o mês do run quando ele
+        # gravou um mês só (o caso do filtro por mês); em runs de vários meses seguem com '-'
+        # e entram uma vez, se o run é o último de algum dos meses dele
+        self.con.execute("""
+            CREATE OR REPLACE VIEW mes_do_run AS
+            SELECT run_id, any_value(mes) AS mes
+            FROM run_meses
+            GROUP BY run_id
+            HAVING count(DISTINCT mes) = 1
+        """)
+        self.con.execute("""
+            CREATE OR REPLACE VIEW relatorio_ultimo_por_mes AS
+            WITH f AS (
+                SELECT f.* REPLACE (CASE WHEN f.Mes IS NULL OR f.Mes = '-' THEN coalesce(d.mes, f.Mes) ELSE f.Mes END AS Mes)
+                FROM relatorio_final f LEFT JOIN mes_do_run d ON f.run_id = d.run_id
             )
-            SELECT * FROM df_final
+            SELECT f.* FROM f JOIN ultimo_run_por_mes u ON f.run_id = u.run_id AND f.Mes = u.mes
+            UNION ALL
+            SELECT f.* FROM f
+            WHERE (f.Mes IS NULL OR f.Mes = '-') AND f.run_id IN (SELECT run_id FROM ultimo_run_por_mes)
+        """)
+        # Resumo com o mesmo mês efetivo (SEM EXCEL no mês do run), para os dashboards
+        self.con.execute("""
+            CREATE OR REPLACE VIEW resumo_por_run AS
+            SELECT s.* REPLACE (CASE WHEN s.mes IS NULL OR s.mes = '-' THEN coalesce(d.mes, s.mes) ELSE s.mes END AS mes)
+            FROM resumo_relatorio s LEFT JOIN mes_do_run d ON s.run_id = d.run_id
         """)
-        print(f"[DB] {len(df_final)} registros de XML salvos.")
+        self.con.execute("""
+            CREATE OR REPLACE VIEW resumo_ultimo_por_mes AS
+            SELECT s.* FROM resumo_por_run s JOIN ultimo_run_por_mes u ON s.run_id = u.run_id AND s.mes = u.mes
+            UNION ALL
+            SELECT s.* FROM resumo_por_run s
+            WHERE (s.mes IS NULL OR s.mes = '-') AND s.run_id IN (SELECT run_id FROM ultimo_run_por_mes)
+        """)
+
+    def _existe_tabela(self, tabela: str) -> bool:
+        return bool(self.con.execute(
+            "SELECT count(*) FROM information_schema.tables WHERE table_name = ?", [tabela]
+        ).fetchone()[0])
+
+    def _colunas(self, tabela: str) -> List[str]:
+        return [r[0] for r in self.con.execute(
+            "SELECT column_name FROM information_schema.columns WHERE table_name = ?", [tabela]
+        ).fetchall()]
+
+    # ============================================================
+    # Runs (histórico de execuções)
+    # ============================================================
+    def iniciar_run(self, mes_filtro: Optional[str] = None, excel_path: Optional[str] = None,
+                    origem_xml: Optional[str] = None) -> int:
+        """Abre um run novo; tudo que for salvo depois fica marcado com este run_id."""
+        self.run_id = self.con.execute("SELECT nextval('seq_runs')").fetchone()[0]
+        self.con.execute("""
+            INSERT INTO runs (run_id, mes_filtro, excel_path, origem_xml, status)
+            VALUES (?, ?, ?, ?, 'EM ANDAMENTO')
+        """, [self.run_id, mes_filtro, excel_path, origem_xml])
+        return self.run_id
+
+    def finalizar_run(self, status: str = "OK"):
+        """Fecha o run atual e grava o resumo dele. Só runs 'OK' entram em ultimo_run_por_mes."""
+        if self.run_id is None:
+            return
+        self._atualizar_resumo("SELECT ?", [self.run_id])
+        self.con.execute(
+            "UPDATE runs SET status = ?, finalizado_em = CURRENT_TIMESTAMP WHERE run_id = ?", [status, self.run_id]
+        )
+
+    def _atualizar_resumo(self, runs_sql: str, params: Optional[List] = None):
+        """(Re)grava resumo_relatorio dos runs devolvidos por `runs_sql` (lê só as linhas deles)."""
+        params = params or []
+        self.con.execute(f"DELETE FROM resumo_relatorio WHERE run_id IN ({runs_sql})", params)
+        self.con.execute(f"""
+            INSERT INTO resumo_relatorio
+            SELECT run_id, Empresa, Mes, Tipo, Status, count(*), sum(Diff_R), sum(Diff_Vol)
+            FROM relatorio_final
+            WHERE run_id IN ({runs_sql})
+            GROUP BY run_id, Empresa, Mes, Tipo, Status
+        """, params)
+
+    # ============================================================
+    # Leitura para dashboards (só tabelas de resumo)
+    # ============================================================
+    def resumo_por_empresa(self, mes: Optional[str] = None, run_id: Optional[int] = None) -> pd.DataFrame:
+        """
+        Linhas, soma de Diff R$ e de Diff Vol por empresa x tipo x status. Por padrão usa o
+        último run concluído de cada mês; `mes` restringe a um mês e `run_id` fixa um run.
+        """
+        return self._ler_resumo("empresa", "mes", mes, run_id)
+
+    def resumo_por_mes(self, empresa: Optional[str] = None, run_id: Optional[int] = None) -> pd.DataFrame:
+        """Como resumo_por_empresa, agrupado por mês x tipo x status (opcionalmente de uma empresa)."""
+        return self._ler_resumo("mes", "empresa", empresa, run_id)
+
+    # ============================================================
+    # Histórico de uma nota entre runs (consulta pontual indexada)
+    # ============================================================
+    def historico_nota(self, nota: Optional[str] = None, chave: Optional[str] = None,
+                       empresa: Optional[str] = None, desde: Optional[Union[str, datetime]] = None,
+                       ate: Optional[Union[str, datetime]] = None) -> pd.DataFrame:
+        """
+        Todas as linhas do relatório de uma nota, run a run (com data e status do run).
+        A nota passa pelo mesmo limpar_numero_nf_bruto do Excel/XML ("NF 000123" -> "123");
+        com `chave` (só os dígitos contam) vêm as linhas da nota daquela chave, só nos runs
+        em que a chave foi lida (outra nota com o mesmo número não entra).
+        `empresa`, `desde` e `ate` (início do run, intervalo semiaberto) filtram o resultado.
+        """
+        docs = None
+        if chave is not None:
+            # O número se repete entre emitentes: só valem os runs em que a chave apareceu
+            docs = self.historico_xmls(chave=chave, desde=desde, ate=ate)[["run_id", "nota"]].dropna().drop_duplicates()
+            notas = docs["nota"].unique().tolist()
+        elif nota is not None:
+            notas = [limpar_numero_nf_bruto(nota)]
+        else:
+            raise ValueError("Informe a nota ou a chave de acesso.")
+
+        # Nota "" não casa com nada: devolve o DataFrame vazio, já com as colunas
+        notas = [n for n in notas if n] or [""]
+        partes = [self._historico("nota", n, empresa, desde, ate) for n in notas]
+        hist = pd.concat(partes, ignore_index=True)
+        if docs is not None and not docs.empty:
+            # relatorio_final tem uma linha por nota em cada run: (run_id, Nota) identifica o documento
+            hist = hist.merge(docs.rename(columns={"nota": "Nota"}), on=["run_id", "Nota"])
+        return hist.sort_values("run_id", kind="stable", ignore_index=True)
+
+    def historico_xmls(self, nota: Optional[str] = None, chave: Optional[str] = None,
+                       empresa: Optional[str] = None, desde: Optional[Union[str, datetime]] = None,
+                       ate: Optional[Union[str, datetime]] = None) -> pd.DataFrame:
+        """Documentos XML gravados para uma nota (normalizada) ou chave de acesso, run a run."""
+        if chave is not None:
+            coluna, valor = "chave", re.sub(r"\D", "", str(chave))
+        elif nota is not None:
+            coluna, valor = "nota", limpar_numero_nf_bruto(nota)
+        else:
+            raise ValueError("Informe a nota ou a chave de acesso.")
+        return self._historico(f"xml_{coluna}", valor, empresa, desde, ate)
+
+    def _historico(self, consulta: str, valor: str, empresa, desde, ate) -> pd.DataFrame:
+        """
+        Executa a consulta de histórico preparada para este conjunto de filtros (um PREPARE
+        por combinação, reaproveitado na conexão). Os valores chegam ao EXECUTE por variáveis
+        da sessão, gravadas com parâmetro: EXECUTE não aceita parâmetros vindos do Python.
+        """
+        filtros = [(f, v) for f, v in (("empresa", empresa), ("desde", desde), ("ate", ate)) if v is not None]
+        nome = "_".join(["historico", consulta] + [f for f, _ in filtros])
+        if nome not in self._preparadas:
+            where = "".join(f" AND {self._FILTROS_HISTORICO[f].format(i)}" for i, (f, _) in enumerate(filtros, start=2))
+            self.con.execute(f"PREPARE {nome} AS {self._SQL_HISTORICO[consulta].format(filtros=where)}")
+            self._preparadas.add(nome)
+
+        args = []
+        for i, v in enumerate([valor] + [v for _, v in filtros], start=1):
+            self.con.execute(f"SET VARIABLE historico_{i} = ?", [v])
+            args.append(f"getvariable('historico_{i}')")
+        return self.con.execute(f"EXECUTE {nome}({', '.join(args)})").df()
+
+    def _ler_resumo(self, dimensao: str, filtro: str, valor: Optional[str], run_id: Optional[int]) -> pd.DataFrame:
+        origem = "resumo_por_run WHERE run_id = $run_id" if run_id is not None else "resumo_ultimo_por_mes WHERE TRUE"
+        params: Dict = {"run_id": run_id} if run_id is not None else {}
+        if valor is not None:
+            origem += f" AND {filtro} = $valor"
+            params["valor"] = valor
+        return self.con.execute(f"""
+            SELECT {dimensao}, tipo, status,
+                   sum(linhas)::BIGINT AS linhas, sum(soma_diff_rs) AS soma_diff_rs, sum(soma_diff_vol) AS soma_diff_vol
+            FROM {origem}
+            GROUP BY {dimensao}, tipo, status
+            ORDER BY {dimensao}, tipo, status
+        """, params).df()
+
+    def _run_atual(self) -> int:
+        return self.run_id if self.run_id is not None else self.iniciar_run()
+
+    def reter_runs(self, manter_ultimos: Optional[int] = None, dias: Optional[int] = None) -> int:
+        """
+        Apaga runs antigos e as linhas deles: fora dos `manter_ultimos` mais recentes e/ou
+        iniciados há mais de `dias` dias. O último run concluído de cada mês e o run atual
+        são sempre mantidos. Retorna quantos runs foram apagados.
+        """
+        if manter_ultimos is None and dias is None:
+            return 0
+        criterios = []
+        params: List = []
+        if manter_ultimos is not None:
+            criterios.append("run_id NOT IN (SELECT run_id FROM runs ORDER BY run_id DESC LIMIT ?)")
+            params.append(int(manter_ultimos))
+        if dias is not None:
+            criterios.append("iniciado_em < CURRENT_TIMESTAMP - to_days(?)")
+            params.append(int(dias))
+        df_apagar = self.con.execute(f"""
+            SELECT run_id FROM runs
+            WHERE ({' OR '.join(criterios)})
+              AND run_id NOT IN (SELECT run_id FROM ultimo_run_por_mes)
+              AND run_id IS DISTINCT FROM ?
+        """, params + [self.run_id]).df()
+        if df_apagar.empty:
+            return 0
+
+        with self._transacao():
+            apagadas = 0
+            for tabela in self._TABELAS_DE_FATOS:
+                apagadas += self.con.execute(f"DELETE FROM {tabela} WHERE run_id IN (SELECT run_id FROM df_apagar)").fetchone()[0]
+            self.con.execute("DELETE FROM runs WHERE run_id IN (SELECT run_id FROM df_apagar)")
+            self.con.execute("UPDATE manutencao SET linhas_apagadas = linhas_apagadas + ?", [apagadas])
+        print(f"[DB] {len(df_apagar)} run(s) antigo(s) removido(s) do histórico.")
+        return len(df_apagar)
+
+    def compactar(self):
+        """
+        Regrava as tabelas de fatos em ordem de run_id (sem as linhas apagadas) e faz
+        checkpoint, devolvendo o espaço e mantendo os zonemaps por run bem estreitos.
+        Tudo numa transação: se algo falhar no meio, o histórico fica como estava.
+        Reescreve o banco inteiro; no fluxo normal use compactar_se_preciso.
+        """
+        with self._transacao():
+            for tabela in self._TABELAS_DE_FATOS:
+                self.con.execute(f"CREATE OR REPLACE TEMP TABLE _compactar AS SELECT * FROM {tabela} ORDER BY run_id NULLS FIRST")
+                self.con.execute(f"DELETE FROM {tabela}")
+                self.con.execute(f"INSERT INTO {tabela} SELECT * FROM _compactar")
+                self.con.execute("DROP TABLE _compactar")
+            self.con.execute("UPDATE manutencao SET linhas_apagadas = 0, compactado_em = CURRENT_TIMESTAMP")
+        self.con.execute("FORCE CHECKPOINT")
+
+    def compactar_se_preciso(self, fracao_minima: float) -> bool:
+        """
+        Compacta só quando as linhas apagadas pela retenção desde a última compactação
+        chegam a `fracao_minima` das linhas das tabelas de fatos (0 = nunca). Retorna se compactou.
+        """
+        if fracao_minima <= 0:
+            return False
+        apagadas = self.con.execute("SELECT linhas_apagadas FROM manutencao").fetchone()[0]
+        if not apagadas:
+            return False
+        vivas = sum(self.con.execute(f"SELECT count(*) FROM {t}").fetchone()[0] for t in self._TABELAS_DE_FATOS)
+        if apagadas < fracao_minima * (apagadas + vivas):
+            return False
+        print(f"[DB] Compactando o histórico ({apagadas} linha(s) apagada(s) desde a última compactação).")
+        self.compactar()
+        return True
+
+    @contextmanager
+    def _transacao(self):
+        """BEGIN/COMMIT na conexão; em qualquer erro faz ROLLBACK e repassa a exceção."""
+        self.con.execute("BEGIN TRANSACTION")
+        try:
+            yield
+        except BaseException:
+            self.con.execute("ROLLBACK")
+            raise
+        self.con.execute("COMMIT")
+
+    def salvar_xmls(self, dados_xml: List[Dict]):
+        """
+        Acrescenta um lote de resultados do xml_parser (com Arquivo/CaminhoCompleto/Empresa
+        do audit) ao run atual. Pode ser chamado várias vezes durante o parse.
+        """
+        if not dados_xml:
+            return
+
+        colunas = {}
+        for coluna, (chave, tipo) in self._ESQUEMA_XML.items():
+            valores = [d.get(chave) for d in dados_xml]
+            if tipo == "VARCHAR":
+                valores = [v if v is None or isinstance(v, str) else str(v) for v in valores]
+            colunas[coluna] = valores
+        lote_xml = self._lote(colunas, {c: t for c, (_, t) in self._ESQUEMA_XML.items()})
+
+        # `importado_em` fica com o DEFAULT da tabela
+        cols = ", ".join(self._ESQUEMA_XML)
+        self.con.execute(f"INSERT INTO raw_xmls ({cols}, run_id) SELECT *, ? FROM lote_xml", [self._run_atual()])
+        print(f"[DB] {len(dados_xml)} registros de XML salvos.")
 
     def salvar_excel(self, df_excel: pd.DataFrame):
-        """Salva o DataFrame do Excel"""
+        """Acrescenta o DataFrame do Excel (colunas de _COLUNAS_RAW_EXCEL) ao run atual"""
         # Limpeza básica nos nomes das colunas para o SQL não reclamar
-        df_excel.columns = [c.replace(" ", "_").replace(".", "") for c in df_excel.columns]
-        self.con.execute("CREATE TABLE raw_excel AS SELECT * FROM df_excel")
-        print(f"[DB] Tabela do Excel salva ({len(df_excel)} linhas).")
+        df_raw = self._tipar(
+            df_excel.rename(columns=lambda c: c.replace(" ", "_").replace(".", "")).assign(ordem=range(len(df_excel))),
+            self._COLUNAS_RAW_EXCEL,
+        )
+        if list(df_raw.columns) == ["ordem"]:
+            print("[DB] Excel sem nenhuma coluna conhecida; nada salvo.")
+            return
+        lote_excel = self._lote(dict(df_raw.items()), self._COLUNAS_RAW_EXCEL)
+        cols = ", ".join(df_raw.columns)
+        self.con.execute(f"INSERT INTO raw_excel (run_id, {cols}) SELECT ?, {cols} FROM lote_excel", [self._run_atual()])
+        print(f"[DB] Tabela do Excel salva ({len(df_raw)} linhas).")
 
     def salvar_relatorio_final(self, df_relatorio: pd.DataFrame):
-        """Salva o resultado final da auditoria (o que vai para o Excel)"""
+        """Acrescenta o resultado final da auditoria (o que vai para o Excel) ao run atual"""
         if df_relatorio.empty:
             return
         
         # Limpa nomes de colunas
-        df_relatorio.columns = [c.replace(" ", "_").replace("(", "").replace(")", "").replace("$", "") for c in df_relatorio.columns]
-        
-        self.con.execute("CREATE TABLE relatorio_final AS SELECT * FROM df_relatorio")
+        df_rel = self._tipar(
+            df_relatorio.rename(columns=lambda c: c.replace(" ", "_").replace("(", "").replace(")", "").replace("$", "")),
+            self._COLUNAS_RELATORIO,
+        )
+        lote_rel = self._lote(dict(df_rel.items()), self._COLUNAS_RELATORIO)
+        run_id = self._run_atual()
+        cols = ", ".join(df_rel.columns)
+        self.con.execute(f"INSERT INTO relatorio_final (run_id, {cols}) SELECT ?, {cols} FROM lote_rel", [run_id])
+        if "Mes" in df_rel.columns:
+            # Só meses reais: o '-' das linhas SEM EXCEL não é mês (ver mes_do_run)
+            self.con.execute("""
+                INSERT INTO run_meses (run_id, mes, linhas)
+                SELECT ?, Mes, count(*) FROM lote_rel WHERE Mes IS NOT NULL AND Mes <> '-' GROUP BY Mes
+            """, [run_id])
         print("[DB] Relatório Final salvo no banco de dados para BI.")
 
+    @staticmethod
+    def _lote(colunas: Dict[str, Sequence], esquema: Dict[str, str]):
+        """
+        Lote tipado pelo `esquema` para o DuckDB ler por replacement scan: tabela Arrow
+        (varrida direto dos buffers, sem cópia) ou, sem pyarrow, DataFrame com os mesmos tipos.
+        """
+        if HAS_PYARROW:
+            return pa.table({
+                c: pa.array(v, type=_TIPOS_ARROW[esquema[c]], from_pandas=True) for c, v in colunas.items()
+            })
+        return pd.DataFrame({c: pd.Series(v, dtype=_DTYPES_PANDAS[esquema[c]]) for c, v in colunas.items()})
+
+    @staticmethod
+    def _tipar(df: pd.DataFrame, esquema: Dict[str, str]) -> pd.DataFrame:
+        """Só as colunas do esquema, com o tipo dele ('-' e afins viram nulo nas numéricas)."""
+        out = pd.DataFrame(index=df.index)
+        for c, tipo in esquema.items():
+            if c not in df.columns:
+                continue
+            if tipo == "DOUBLE":
+                out[c] = pd.to_numeric(df[c], errors="coerce")
+            elif tipo == "BIGINT":
+                out[c] = pd.to_numeric(df[c], errors="coerce").astype("Int64")
+            else:
+                out[c] = df[c].astype("string")
+        return out
+
+    # ============================================================
+    # Cache de parse dos XMLs
+    # ============================================================
+    def buscar_cache_parse(self, digitais: Dict[str, Tuple[int, str]], versao: int) -> Dict[str, Optional[Dict]]:
+        """
+        Recebe {caminho: (tamanho, assinatura)} e devolve {caminho: resultado do parser}
+        apenas para os arquivos que não mudaram desde o último parse (mesma versão do parser).
+        """
+        if not digitais:
+            return {}
+
+        df_chaves = pd.DataFrame(
+            [(c, t, a) for c, (t, a) in digitais.items()], columns=["caminho", "tamanho", "assinatura"]
+        )
+        linhas = self.con.execute("""
+            SELECT c.caminho, c.resultado
+            FROM cache_parse c
+            JOIN df_chaves k ON c.caminho = k.caminho
+            WHERE c.tamanho = k.tamanho AND c.assinatura = k.assinatura AND c.versao = ?
+        """, [versao]).fetchall()
+
+        if linhas:
+            # Marca como usados (base da evicção por antiguidade)
+            self.con.execute("""
+                UPDATE cache_parse SET usado_em = CURRENT_TIMESTAMP
+                WHERE caminho IN (SELECT caminho FROM df_chaves)
+            """)
+        return {c: (json.loads(r) if r is not None else None) for c, r in linhas}
+
+    def salvar_cache_parse(self, entradas: List[Tuple[str, int, str, Optional[Dict]]], versao: int):
+        """Grava/atualiza (caminho, tamanho, assinatura, resultado) no cache."""
+        if not entradas:
+            return
+        df_cache = pd.DataFrame(
+            [(c, t, a, versao, json.dumps(r, ensure_ascii=False) if r is not None else None) for c, t, a, r in entradas],
+            columns=["caminho", "tamanho", "assinatura", "versao", "resultado"],
+        )
+        self.con.execute("""
+            INSERT OR REPLACE INTO cache_parse (caminho, tamanho, assinatura, versao, resultado, usado_em)
+            SELECT caminho, tamanho, assinatura, versao, resultado, CURRENT_TIMESTAMP FROM df_cache
+        """)
+        print(f"[DB] {len(df_cache)} resultado(s) de parse gravados no cache.")
+
+    def invalidar_cache_parse(self, prefixo: Optional[str] = None):
+        """Apaga o cache inteiro ou só os caminhos que começam com `prefixo` (ex.: uma pasta ou ZIP)."""
+        if prefixo:
+            self.con.execute("DELETE FROM cache_parse WHERE starts_with(caminho, ?)", [prefixo])
+        else:
+            self.con.execute("DELETE FROM cache_parse")
+
+    def podar_cache_parse(self, max_entradas: int):
+        """Mantém só as `max_entradas` usadas mais recentemente."""
+        self.con.execute("""
+            DELETE FROM cache_parse WHERE caminho IN (
+                SELECT caminho FROM cache_parse ORDER BY usado_em DESC OFFSET ?
+            )
+        """, [max_entradas])
+
+    # ============================================================
+    # Cache das abas do Excel
+    # ============================================================
+    _COLUNAS_CACHE_EXCEL = ["NF_Clean", "Vol_Excel", "Liq_Excel", "ICMS_Excel", "PIS_Excel", "COFINS_Excel", "Mes"]
+
+    def buscar_cache_excel(self, caminho: str, digitais: Dict[str, Tuple[int, str]], versao: int) -> Dict[str, pd.DataFrame]:
+        """
+        Recebe {aba: (tamanho, assinatura)} de uma pasta de trabalho e devolve {aba: DataFrame}
+        apenas para as abas que não mudaram desde a última leitura (mesma versão do leitor).
+        Abas sem notas voltam como DataFrame vazio.
+        """
+        if not digitais:
+            return {}
+
+        df_chaves = pd.DataFrame(
+            [(caminho, a, t, s) for a, (t, s) in digitais.items()], columns=["caminho", "aba", "tamanho", "assinatura"]
+        )
+        validas = [r[0] for r in self.con.execute("""
+            SELECT c.aba
+            FROM cache_excel c
+            JOIN df_chaves k ON c.caminho = k.caminho AND c.aba = k.aba
+            WHERE c.tamanho = k.tamanho AND c.assinatura = k.assinatura AND c.versao = ?
+        """, [versao]).fetchall()]
+        if not validas:
+            return {}
+
+        df_validas = pd.DataFrame({"aba": validas})
+        self.con.execute("""
+            UPDATE cache_excel SET usado_em = CURRENT_TIMESTAMP
+            WHERE caminho = ? AND aba IN (SELECT aba FROM df_validas)
+        """, [caminho])
+        colunas = ", ".join(self._COLUNAS_CACHE_EXCEL)
+        linhas = self.con.execute(f"""
+            SELECT aba, {colunas} FROM cache_excel_linhas
+            WHERE caminho = ? AND aba IN (SELECT aba FROM df_validas)
+            ORDER BY aba, ordem
+        """, [caminho]).df()
+
+        out = {a: pd.DataFrame() for a in validas}
+        for aba, df in linhas.groupby("aba", sort=False):
+            out[aba] = df[self._COLUNAS_CACHE_EXCEL].reset_index(drop=True)
+        return out
+
+    def salvar_cache_excel(self, caminho: str, entradas: Dict[str, Tuple[int, str, pd.DataFrame]], versao: int):
+        """Grava/substitui {aba: (tamanho, assinatura, saída normalizada)} de uma pasta de trabalho."""
+        if not entradas:
+            return
+        df_meta = pd.DataFrame(
+            [(caminho, a, t, s, versao) for a, (t, s, _) in entradas.items()],
+            columns=["caminho", "aba", "tamanho", "assinatura", "versao"],
+        )
+        partes = [
+            df[self._COLUNAS_CACHE_EXCEL].assign(caminho=caminho, aba=a, ordem=range(len(df)))
+            for a, (_, _, df) in entradas.items()
+            if not df.empty
+        ]
+
+        self.con.execute("""
+            DELETE FROM cache_excel_linhas
+            WHERE caminho = ? AND aba IN (SELECT aba FROM df_meta)
+        """, [caminho])
+        self.con.execute("""
+            INSERT OR REPLACE INTO cache_excel (caminho, aba, tamanho, assinatura, versao, usado_em)
+            SELECT caminho, aba, tamanho, assinatura, versao, CURRENT_TIMESTAMP FROM df_meta
+        """)
+        if partes:
+            df_linhas = pd.concat(partes, ignore_index=True)
+            colunas = ", ".join(self._COLUNAS_CACHE_EXCEL)
+            self.con.execute(f"""
+                INSERT INTO cache_excel_linhas (caminho, aba, ordem, {colunas})
+                SELECT caminho, aba, ordem, {colunas} FROM df_linhas
+            """)
+        print(f"[DB] {len(df_meta)} aba(s) do Excel gravadas no cache.")
+
+    def invalidar_cache_excel(self, caminho: Optional[str] = None):
+        """Apaga o cache de abas inteiro ou só o de uma pasta de trabalho."""
+        if caminho:
+            self.con.execute("DELETE FROM cache_excel_linhas WHERE caminho = ?", [caminho])
+            self.con.execute("DELETE FROM cache_excel WHERE caminho = ?", [caminho])
+        else:
+            self.con.execute("DELETE FROM cache_excel_linhas")
+            self.con.execute("DELETE FROM cache_excel")
+
+    def podar_cache_excel(self, max_abas: int):
+        """Mantém só as `max_abas` abas usadas mais recentemente (e as linhas delas)."""
+        self.con.execute("""
+            DELETE FROM cache_excel WHERE (caminho, aba) IN (
+                SELECT (caminho, aba) FROM cache_excel ORDER BY usado_em DESC OFFSET ?
+            )
+        """, [max_abas])
+        self.con.execute("""
+            DELETE FROM cache_excel_linhas l WHERE NOT EXISTS (
+                SELECT 1 FROM cache_excel c WHERE c.caminho = l.caminho AND c.aba = l.aba
+            )
+        """)
+
+    # ============================================================
+    # Layouts de cabeçalho do Excel
+    # ============================================================
+    def buscar_layouts_excel(self, versao: int) -> Dict[str, Optional[Dict]]:
+        """{impressão digital do cabeçalho: mapa de colunas (None = aba sem NOTA/S/TRIBUTOS)}."""
+        linhas = self.con.execute("SELECT digital, mapa FROM layouts_excel WHERE versao = ?", [versao]).fetchall()
+        return {d: (json.loads(m) if m is not None else None) for d, m in linhas}
+
+    def salvar_layouts_excel(self, layouts: Dict[str, Optional[Dict]], versao: int):
+        if not layouts:
+            return
+        df_layouts = pd.DataFrame(
+            [(d, versao, json.dumps(m, ensure_ascii=False) if m is not None else None) for d, m in layouts.items()],
+            columns=["digital", "versao", "mapa"],
+        )
+        self.con.execute("""
+            INSERT OR REPLACE INTO layouts_excel (digital, versao, mapa, visto_em)
+            SELECT digital, versao, mapa, CURRENT_TIMESTAMP FROM df_layouts
+        """)
+        print(f"[DB] {len(df_layouts)} layout(s) de Excel novo(s) gravados.")
+
     def fechar(self):
         self.con.close()
\ No newline at end of file
@@ -11,36 +11,37 @@ def main():
         # 1) Teste de XMLs (lista de dicts)
         dados_xml = [
             {
-                "Chave": "NFe123",
+                "Tipo": "NF-e",
                 "Nota": "0001",
-                "Data": "2026-01-28",
-                "Emitente": "Empresa A",
-                "CNPJ": "00.000.000/0001-00",
-                "Valor": 123.45,
+                "Chave": "35260100000000000100550010000000011000000010",
                 "Vol": 1.0,
+                "Bruto": 123.45,
                 "ICMS": 10.0,
                 "PIS": 2.0,
                 "COFINS": 3.0,
+                "Liq_Calc": 108.45,
                 "Arquivo": "arquivo1.xml",
+                "Empresa": "Empresa A",
             },
             {
-                "Chave": "NFe456",
+                "Tipo": "CT-e",
                 "Nota": "0002",
-                "Data": "2026-01-28",
-                "Emitente": "Empresa B",
-                "CNPJ": "11.111.111/0001-11",
-                "Valor": 999.99,
+                "Chave": "",
+                "Hash": "da39a3ee5e6b4b0d3255bfef95601890afd80709",
                 "Vol": 2.0,
+                "Bruto": 999.99,
                 "ICMS": 0.0,
                 "PIS": 0.0,
                 "COFINS": 0.0,
+                "Liq_Calc": 999.99,
                 "Arquivo": "arquivo2.xml",
+                "Empresa": "Empresa B",
             },
         ]
         db.salvar_xmls(dados_xml)
 
         df_xmls = db.con.execute(
-            "SELECT chave, nota, data_emissao, emitente, valor_total, arquivo_origem, importado_em FROM raw_xmls"
+            "SELECT chave, nota, tipo, empresa, valor_total, liq_calc, arquivo_origem, importado_em FROM raw_xmls"
         ).df()
         print("\n[TESTE] raw_xmls:")
         print(df_xmls)
@@ -48,8 +49,8 @@ def main():
         # 2) Teste de Excel (DataFrame)
         df_excel = pd.DataFrame(
             [
-                {"Nota": "0001", "Valor Total": 123.45, "Alguma Coluna": "x"},
-                {"Nota": "0002", "Valor Total": 999.99, "Alguma Coluna": "y"},
+                {"NF_Clean": "0001", "Liq Excel": 123.45, "Mes": "OUT"},
+                {"NF_Clean": "0002", "Liq Excel": 999.99, "Mes": "OUT"},
             ]
         )
         db.salvar_excel(df_excel)
@@ -0,0 +1,261 @@
+import duckdb
+import pytest
+import pandas as pd
+
+import database
+from database import AuditDB
+
+
+def _relatorio(mes, status="OK ✅", n=2):
+    return pd.DataFrame({
+        "Nota": [str(i) for i in range(n)], "Mes": [mes] * n, "Empresa": ["EMP"] * n,
+        "Liq Excel": [10.0] * n, "Diff Vol": ["-"] * n, "Diff R$": [0.5] * n, "Status": [status] * n,
+    })
+
+
+def _run(db, mes, status="OK ✅"):
+    db.iniciar_run(mes_filtro=mes)
+    db.salvar_excel(pd.DataFrame({"NF_Clean": ["1"], "Liq_Excel": [10.0], "Mes": [mes]}))
+    db.salvar_xmls([{"Nota": "1", "Vol": 1.0, "Arquivo": "a.xml"}])
+    db.salvar_relatorio_final(_relatorio(mes, status))
+    db.finalizar_run()
+    return db.run_id
+
+
+def test_historico_acumula_runs_e_ultimo_por_mes(tmp_path):
+    caminho = str(tmp_path / "a.db")
+    db = AuditDB(caminho)
+    db.inicializar()
+    r1 = _run(db, "OUT", "ERRO VALOR ❌")
+    db.fechar()
+
+    # Nova execução (novo processo): nada é apagado no inicializar
+    db = AuditDB(caminho)
+    db.inicializar()
+    r2 = _run(db, "OUT")
+    r3 = _run(db, "NOV")
+    db.iniciar_run(mes_filtro="OUT")  # run interrompido: não vale como último
+    db.salvar_relatorio_final(_relatorio("OUT", "PENDENTE"))
+
+    con = db.con
+    assert con.execute("SELECT count(DISTINCT run_id) FROM raw_xmls").fetchone()[0] == 3
+    assert con.execute("SELECT count(*) FROM raw_excel").fetchone()[0] == 3
+    assert dict(con.execute("SELECT mes, run_id FROM ultimo_run_por_mes").fetchall()) == {"OUT": r2, "NOV": r3}
+    atual = con.execute("SELECT Mes, Status, Diff_Vol, Diff_R FROM relatorio_ultimo_por_mes WHERE Mes = 'OUT'").fetchall()
+    assert atual == [("OUT", "OK ✅", None, 0.5)] * 2
+    assert r1 < r2
+    db.fechar()
+
+
+def test_sem_excel_fica_com_o_mes_do_run(tmp_path):
+    db = AuditDB(str(tmp_path / "a.db"))
+    db.inicializar()
+
+    def _run_com_sobra(mes, nota_sobra):
+        db.iniciar_run(mes_filtro=mes[:3])
+        sobra = pd.DataFrame({"Nota": [nota_sobra], "Mes": ["-"], "Empresa": ["EMP"], "Status": ["SEM EXCEL ❌"]})
+        db.salvar_relatorio_final(pd.concat([_relatorio(mes), sobra], ignore_index=True))
+        db.finalizar_run()
+        return db.run_id
+
+    r_out = _run_com_sobra("OUT_25", "900")
+    r_nov = _run_com_sobra("NOV_25", "901")
+
+    assert db.con.execute("SELECT DISTINCT mes FROM run_meses ORDER BY mes").fetchall() == [("NOV_25",), ("OUT_25",)]
+    sem_excel = "SELECT Mes, Nota, run_id FROM relatorio_ultimo_por_mes WHERE Status = 'SEM EXCEL ❌' ORDER BY Nota"
+    assert db.con.execute(sem_excel).fetchall() == [("OUT_25", "900", r_out), ("NOV_25", "901", r_nov)]
+
+    # Novo run de OUT_25: a sobra antiga de OUT sai, a de NOV continua
+    r_out2 = _run_com_sobra("OUT_25", "902")
+    assert db.con.execute(sem_excel).fetchall() == [("NOV_25", "901", r_nov), ("OUT_25", "902", r_out2)]
+    db.fechar()
+
+
+def test_retencao_mantem_ultimo_por_mes_e_compacta(tmp_path):
+    db = AuditDB(str(tmp_path / "a.db"))
+    db.inicializar()
+    r_nov = _run(db, "NOV")
+    runs_out = [_run(db, "OUT") for _ in range(4)]
+
+    apagados = db.reter_runs(manter_ultimos=2)
+    assert db.con.execute("SELECT linhas_apagadas FROM manutencao").fetchone()[0] > 0
+    assert not db.compactar_se_preciso(0.99)
+    assert db.compactar_se_preciso(0.1)
+    assert db.con.execute("SELECT linhas_apagadas FROM manutencao").fetchone()[0] == 0
+    assert not db.compactar_se_preciso(0.1)
+
+    restantes = [r[0] for r in db.con.execute("SELECT run_id FROM runs ORDER BY run_id").fetchall()]
+    assert apagados == 2
+    assert restantes == [r_nov] + runs_out[-2:]
+    for tabela in ("raw_xmls", "raw_excel", "relatorio_final", "run_meses"):
+        ids = {r[0] for r in db.con.execute(f"SELECT DISTINCT run_id FROM {tabela}").fetchall()}
+        assert ids == set(restantes)
+    assert db.reter_runs(dias=3650) == 0
+    db.fechar()
+
+
+class _ConexaoQuebrada:
+    """Repassa tudo à conexão real, mas falha no INSERT indicado (simula erro no meio da escrita)."""
+
+    def __init__(self, con, falhar_em):
+        self._con, self._falhar_em = con, falhar_em
+
+    def execute(self, sql, *args):
+        if sql.startswith(self._falhar_em):
+            raise duckdb.IOException("disco cheio")
+        return self._con.execute(sql, *args)
+
+
+def test_compactar_com_erro_nao_perde_historico(tmp_path):
+    db = AuditDB(str(tmp_path / "a.db"))
+    db.inicializar()
+    for _ in range(3):
+        _run(db, "OUT")
+    contar = "SELECT (SELECT count(*) FROM relatorio_final), (SELECT count(*) FROM raw_xmls)"
+    antes = db.con.execute(contar).fetchone()
+
+    con = db.con
+    db.con = _ConexaoQuebrada(con, "INSERT INTO relatorio_final")
+    with pytest.raises(duckdb.IOException):
+        db.compactar()
+    db.con = con
+
+    assert db.con.execute(contar).fetchone() == antes
+    db.compactar()
+    assert db.con.execute(contar).fetchone() == antes
+    db.fechar()
+
+
+def test_migra_tabelas_recriadas_por_execucao(tmp_path):
+    caminho = str(tmp_path / "antigo.db")
+    con = duckdb.connect(caminho)
+    con.execute("CREATE TABLE raw_excel AS SELECT 'x' AS Nota")
+    con.execute("CREATE TABLE raw_xmls (chave VARCHAR, nota VARCHAR, data_emissao VARCHAR, emitente VARCHAR,"
+                " cnpj_emitente VARCHAR, valor_total DOUBLE, vol DOUBLE, icms DOUBLE, pis DOUBLE, cofins DOUBLE,"
+                " arquivo_origem VARCHAR, importado_em TIMESTAMP DEFAULT CURRENT_TIMESTAMP)")
+    con.execute("INSERT INTO raw_xmls (nota) VALUES ('antiga')")
+    con.close()
+
+    db = AuditDB(caminho)
+    db.inicializar()
+    _run(db, "OUT")
+
+    assert "run_id" in db._colunas("raw_excel")
+    assert db.con.execute("SELECT nota, run_id FROM raw_xmls ORDER BY nota").fetchall() == [("1", 1), ("antiga", None)]
+    db.fechar()
+
+
+@pytest.mark.parametrize("com_arrow", [True, False])
+def test_salvar_xmls_esquema_do_parser(tmp_path, monkeypatch, com_arrow):
+    monkeypatch.setattr(database, "HAS_PYARROW", com_arrow and database.HAS_PYARROW)
+    db = AuditDB(str(tmp_path / "a.db"))
+    db.inicializar()
+    db.iniciar_run()
+    db.salvar_xmls([
+        {"Tipo": "NF-e", "Nota": "12", "Vol": 3.0, "Bruto": 100.0, "ICMS": 10.0, "PIS": 1.0, "COFINS": 2.0,
+         "Liq_Calc": 87.0, "Chave": "3" * 44, "Arquivo": "a.xml", "CaminhoCompleto": "/x/a.xml", "Empresa": "EMP"},
+    ])
+    db.salvar_xmls([{"Tipo": "CT-e", "Nota": 13, "Vol": None, "Bruto": 5.0, "Hash": "abc", "Arquivo": "b.xml"}])
+
+    linhas = db.con.execute("""
+        SELECT nota, tipo, empresa, caminho, chave, hash, vol, valor_total, liq_calc, run_id
+        FROM raw_xmls ORDER BY nota
+    """).fetchall()
+    assert linhas == [
+        ("12", "NF-e", "EMP", "/x/a.xml", "3" * 44, None, 3.0, 100.0, 87.0, db.run_id),
+        ("13", "CT-e", None, None, None, "abc", None, 5.0, None, db.run_id),
+    ]
+    # Banco novo: só as colunas do esquema do parser (+ importado_em/run_id)
+    assert db._colunas("raw_xmls") == [*AuditDB._ESQUEMA_XML, "importado_em", "run_id"]
+    db.fechar()
+
+
+def test_resumos_para_dashboard(tmp_path):
+    db = AuditDB(str(tmp_path / "a.db"))
+    db.inicializar()
+    r_antigo = _run(db, "OUT", "ERRO VALOR ❌")
+    _run(db, "OUT")
+    db.iniciar_run(mes_filtro="NOV")
+    db.salvar_relatorio_final(pd.concat([_relatorio("NOV"), _relatorio("NOV", "SEM XML ❌", n=3)]))
+    db.finalizar_run()
+
+    por_empresa = db.resumo_por_empresa()
+    assert por_empresa[["empresa", "status", "linhas"]].values.tolist() == [["EMP", "OK ✅", 4], ["EMP", "SEM XML ❌", 3]]
+    assert por_empresa["soma_diff_rs"].tolist() == [2.0, 1.5]
+
+    por_mes = db.resumo_por_mes(empresa="EMP")
+    assert por_mes[["mes", "status", "linhas"]].values.tolist() == [
+        ["NOV", "OK ✅", 2], ["NOV", "SEM XML ❌", 3], ["OUT", "OK ✅", 2],
+    ]
+    assert db.resumo_por_mes(run_id=r_antigo)["status"].tolist() == ["ERRO VALOR ❌"]
+    assert db.resumo_por_empresa(mes="DEZ").empty
+
+    # As leituras vêm só do resumo (uma linha por grupo e run), não do relatório
+    assert db.con.execute("SELECT count(*) FROM resumo_relatorio").fetchone()[0] == 4
+    db.fechar()
+
+
+def test_resumo_sem_excel_por_mes_do_run(tmp_path):
+    db = AuditDB(str(tmp_path / "a.db"))
+    db.inicializar()
+    for mes, n_sobras in (("OUT_25", 1), ("NOV_25", 2)):
+        db.iniciar_run(mes_filtro=mes[:3])
+        sobras = pd.DataFrame({"Nota": [f"9{i}" for i in range(n_sobras)], "Mes": ["-"] * n_sobras,
+                               "Empresa": ["EMP"] * n_sobras, "Status": ["SEM EXCEL ❌"] * n_sobras,
+                               "Diff R$": [-1.0] * n_sobras})
+        db.salvar_relatorio_final(pd.concat([_relatorio(mes), sobras], ignore_index=True))
+        db.finalizar_run()
+
+    # As sobras de cada mês contam no mês do próprio run, não só no run mais recente
+    por_mes = db.resumo_por_mes()
+    assert por_mes[["mes", "status", "linhas"]].values.tolist() == [
+        ["NOV_25", "OK ✅", 2], ["NOV_25", "SEM EXCEL ❌", 2], ["OUT_25", "OK ✅", 2], ["OUT_25", "SEM EXCEL ❌", 1],
+    ]
+    sem_excel_out = db.resumo_por_empresa(mes="OUT_25").set_index("status").loc["SEM EXCEL ❌"]
+    assert (sem_excel_out["linhas"], sem_excel_out["soma_diff_rs"]) == (1, -1.0)
+    db.fechar()
+
+
+def test_historico_de_uma_nota_entre_runs(tmp_path):
+    chave = "3" * 44
+    db = AuditDB(str(tmp_path / "a.db"))
+    db.inicializar()
+    runs = []
+    for status, empresa in [("ERRO VALOR ❌", "EMP"), ("OK ✅", "EMP"), ("OK ✅", "OUTRA")]:
+        db.iniciar_run(mes_filtro="OUT")
+        rel = _relatorio("OUT", status, n=3).assign(Empresa=empresa)
+        db.salvar_relatorio_final(rel)
+        db.salvar_xmls([{"Nota": "1", "Chave": chave, "Empresa": empresa, "Arquivo": "nf_1.xml", "Ordem": 0}])
+        db.finalizar_run()
+        runs.append(db.run_id)
+    # Outro documento (outra chave) com o mesmo número, num run seguinte
+    db.iniciar_run(mes_filtro="OUT")
+    db.salvar_relatorio_final(_relatorio("OUT", "SEM XML ❌", n=3))
+    db.salvar_xmls([{"Nota": "1", "Chave": "4" * 44, "Empresa": "EMP", "Arquivo": "outra_1.xml", "Ordem": 0}])
+    db.finalizar_run()
+    r_outro = db.run_id
+
+    hist = db.historico_nota("NF 0001")
+    assert hist["run_id"].tolist() == runs + [r_outro]
+    assert hist["Status"].tolist() == ["ERRO VALOR ❌", "OK ✅", "OK ✅", "SEM XML ❌"]
+    assert db.historico_nota(1, empresa="EMP")["run_id"].tolist() == runs[:2] + [r_outro]
+    assert db.historico_nota(chave=f"NFe{chave}")["run_id"].tolist() == runs
+    assert db.historico_nota(chave=f"NFe{chave}", empresa="OUTRA")["run_id"].tolist() == runs[2:]
+    assert db.historico_nota(chave="4" * 44)["run_id"].tolist() == [r_outro]
+    assert db.historico_nota(chave="5" * 44).empty
+    assert db.historico_nota("1", desde="2999-01-01").empty
+    assert db.historico_nota("999").empty
+
+    xmls = db.historico_xmls(chave=chave)
+    assert xmls["run_id"].tolist() == runs and set(xmls["arquivo_origem"]) == {"nf_1.xml"}
+
+    # O plano parte dos índices (relatorio_final por Nota, raw_xmls por chave), mesmo com filtros
+    def _plano(preparada, n_args):
+        args = ", ".join(f"getvariable('historico_{i}')" for i in range(1, n_args + 1))
+        return "\n".join(r[1] for r in db.con.execute(f"EXPLAIN ANALYZE EXECUTE {preparada}({args})").fetchall())
+
+    db.historico_nota("1", empresa="EMP")
+    assert "Index Scan" in _plano("historico_nota_empresa", 2)
+    db.historico_xmls(chave=chave)
+    assert "Index Scan" in _plano("historico_xml_chave", 1)
+    db.fechar()
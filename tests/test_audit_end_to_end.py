@@ -1,9 +1,11 @@
 import os
 from pathlib import Path
 import pandas as pd
+import pytest
 from openpyxl import load_workbook
 
 from auditoria.audit import auditar_pasta_pai
+from database import AuditDB
 
 
 def _write_minimal_excel(path: Path, notas):
@@ -112,3 +114,248 @@ def test_auditoria_end_to_end(tmp_path: Path):
     row_300 = df_res[df_res["Nota"].astype(str) == "300"]
     assert not row_300.empty
     assert "SEM XML" in str(row_300.iloc[0]["Status"])
+
+
+def test_auditoria_direto_do_zip_igual_a_pasta(tmp_path: Path, monkeypatch):
+    import zipfile
+
+    import auditoria.audit as audit_mod
+
+    monkeypatch.chdir(tmp_path)  # auditoria.db fica no tmp
+    capturados = []
+    monkeypatch.setattr(audit_mod, "gerar_relatorio", lambda rel, saida=None, **kw: capturados.append(rel) or "OK")
+    monkeypatch.setattr(audit_mod, "gerar_relatorio_avisos", lambda *a, **kw: "")
+
+    pasta_pai = tmp_path / "pasta"
+    (pasta_pai / "EMPRESA_A" / "sub").mkdir(parents=True)
+    (pasta_pai / "EMPRESA_B").mkdir(parents=True)
+    _write_nfe_xml(pasta_pai / "EMPRESA_A" / "nf_100.xml", "100")
+    _write_nfe_xml(pasta_pai / "EMPRESA_A" / "sub" / "nf_101.xml", "101", vNF="40.00")
+    _write_nfe_xml(pasta_pai / "EMPRESA_B" / "nf_200.xml", "200", vNF="50.00")
+
+    zip_path = tmp_path / "xmls.zip"
+    with zipfile.ZipFile(zip_path, "w") as z:
+        for arq in sorted(pasta_pai.rglob("*.xml")):
+            z.write(arq, arq.relative_to(pasta_pai).as_posix())
+
+    excel_path = tmp_path / "base.xlsx"
+    _write_minimal_excel(excel_path, [("100", 87.00, 3.000, 10.00, 1.00, 2.00)])
+
+    empresas_dir = [pasta_pai / "EMPRESA_A", pasta_pai / "EMPRESA_B"]
+    auditar_pasta_pai(pasta_pai, empresas_dir, str(excel_path))
+    assert audit_mod.listar_empresas_zip(zip_path) == ["EMPRESA_A", "EMPRESA_B"]
+    auditar_pasta_pai(zip_path, audit_mod.listar_empresas_zip(zip_path), str(excel_path))
+
+    via_pasta, via_zip = capturados
+    assert [(r["Nota"], r["Status"], r["Arquivo"]) for r in via_zip] == [
+        (r["Nota"], r["Status"], r["Arquivo"]) for r in via_pasta
+    ]
+    assert {r["Nota"] for r in via_zip} == {"100", "101", "200"}
+
+
+def test_cache_de_parse_so_rele_xmls_alterados(tmp_path: Path, monkeypatch):
+    import auditoria.audit as audit_mod
+    import auditoria.xml_batch as batch_mod
+    from auditoria.audit import AuditConfig
+
+    monkeypatch.setattr(audit_mod, "gerar_relatorio", lambda rel, saida=None, **kw: "OK")
+    monkeypatch.setattr(audit_mod, "gerar_relatorio_avisos", lambda *a, **kw: "")
+    lidos = []
+    parse_original = batch_mod.parse_xml_file
+
+    def parse_contando(p, **kw):
+        lidos.append(os.path.basename(p))
+        return parse_original(p, **kw)
+
+    monkeypatch.setattr(batch_mod, "parse_xml_file", parse_contando)
+
+    emp = tmp_path / "pasta" / "EMPRESA_A"
+    emp.mkdir(parents=True)
+    _write_nfe_xml(emp / "nf_100.xml", "100")
+    _write_nfe_xml(emp / "nf_101.xml", "101")
+    excel_path = tmp_path / "base.xlsx"
+    _write_minimal_excel(excel_path, [("100", 87.00, 3.000, 10.00, 1.00, 2.00)])
+    cfg = AuditConfig(db_path=str(tmp_path / "auditoria.db"))
+
+    auditar_pasta_pai(emp.parent, [emp], str(excel_path), config=cfg)
+    assert sorted(lidos) == ["nf_100.xml", "nf_101.xml"]
+
+    lidos.clear()
+    auditar_pasta_pai(emp.parent, [emp], str(excel_path), config=cfg)
+    assert lidos == []
+
+    _write_nfe_xml(emp / "nf_101.xml", "101", vNF="999.00")
+    os.utime(emp / "nf_101.xml", ns=(1, 1))
+    _write_nfe_xml(emp / "nf_102.xml", "102")
+    auditar_pasta_pai(emp.parent, [emp], str(excel_path), config=cfg)
+    assert sorted(lidos) == ["nf_101.xml", "nf_102.xml"]
+
+
+def test_falha_de_leitura_nao_vai_para_o_cache(tmp_path: Path, monkeypatch):
+    import auditoria.audit as audit_mod
+    import auditoria.xml_batch as batch_mod
+    from auditoria.audit import AuditConfig
+
+    capturados = []
+    monkeypatch.setattr(audit_mod, "gerar_relatorio", lambda rel, saida=None, **kw: capturados.append(rel) or "OK")
+    monkeypatch.setattr(audit_mod, "gerar_relatorio_avisos", lambda *a, **kw: "")
+    parse_original = batch_mod.parse_xml_file
+    travados = {"nf_101.xml"}
+
+    def parse_travando(p, **kw):
+        if os.path.basename(p) in travados:
+            raise PermissionError(13, "arquivo em uso", p)
+        return parse_original(p, **kw)
+
+    monkeypatch.setattr(batch_mod, "parse_xml_file", parse_travando)
+
+    emp = tmp_path / "pasta" / "EMPRESA_A"
+    emp.mkdir(parents=True)
+    _write_nfe_xml(emp / "nf_100.xml", "100")
+    _write_nfe_xml(emp / "nf_101.xml", "101")
+    (emp / "nao_fiscal.xml").write_text("<evento/>", encoding="utf-8")
+    excel_path = tmp_path / "base.xlsx"
+    _write_minimal_excel(excel_path, [("100", 87.00, 3.000, 10.00, 1.00, 2.00)])
+    cfg = AuditConfig(db_path=str(tmp_path / "auditoria.db"))
+
+    auditar_pasta_pai(emp.parent, [emp], str(excel_path), config=cfg)
+    assert {r["Nota"] for r in capturados[-1]} == {"100"}
+
+    # Sem mexer no arquivo: no run seguinte ele é lido (e o XML não fiscal segue no cache)
+    travados.clear()
+    auditar_pasta_pai(emp.parent, [emp], str(excel_path), config=cfg)
+    assert {r["Nota"] for r in capturados[-1]} == {"100", "101"}
+    db = AuditDB(cfg.db_path)
+    em_cache = dict(db.con.execute("SELECT caminho, resultado IS NULL FROM cache_parse").fetchall())
+    db.fechar()
+    assert em_cache[str(emp / "nao_fiscal.xml")] is True
+
+
+def test_excel_vazio_fecha_o_run_com_erro(tmp_path: Path):
+    from auditoria.audit import AuditConfig
+
+    emp = tmp_path / "pasta" / "EMPRESA_A"
+    emp.mkdir(parents=True)
+    _write_nfe_xml(emp / "nf_100.xml", "100")
+    excel_path = tmp_path / "base.xlsx"
+    _write_minimal_excel(excel_path, [])
+    cfg = AuditConfig(db_path=str(tmp_path / "auditoria.db"))
+
+    with pytest.raises(RuntimeError):
+        auditar_pasta_pai(emp.parent, [emp], str(excel_path), config=cfg)
+
+    # O banco foi fechado (reabre no mesmo processo) e o run não ficou EM ANDAMENTO
+    db = AuditDB(cfg.db_path)
+    assert db.con.execute("SELECT status, finalizado_em IS NOT NULL FROM runs").fetchall() == [("ERRO", True)]
+    assert db.con.execute("SELECT count(*) FROM ultimo_run_por_mes").fetchone()[0] == 0
+    db.fechar()
+
+
+@pytest.mark.parametrize("backend", ["pandas", "duckdb"])
+def test_empresa_do_xml_no_banco(tmp_path: Path, monkeypatch, backend):
+    import auditoria.audit as audit_mod
+    from auditoria.audit import AuditConfig
+
+    monkeypatch.setattr(audit_mod, "gerar_relatorio", lambda rel, saida=None, **kw: "OK")
+    monkeypatch.setattr(audit_mod, "gerar_relatorio_avisos", lambda *a, **kw: "")
+    emp = tmp_path / "pasta" / "EMPRESA_A"
+    emp.mkdir(parents=True)
+    _write_nfe_xml(emp / "nf_100.xml", "100")
+    excel_path = tmp_path / "base.xlsx"
+    _write_minimal_excel(excel_path, [("100", 87.00, 3.000, 10.00, 1.00, 2.00), ("200", 5.00, 0, 0, 0, 0)])
+    cfg = AuditConfig(db_path=str(tmp_path / "auditoria.db"), backend_conciliacao=backend)
+
+    auditar_pasta_pai(emp.parent, [emp], str(excel_path), config=cfg)
+
+    # O Excel não tem coluna Empresa: a nota casada fica com a empresa do XML
+    db = AuditDB(cfg.db_path)
+    assert db.historico_nota("100", empresa="EMPRESA_A")["Status"].tolist() == ["OK ✅"]
+    por_empresa = db.resumo_por_empresa()
+    assert por_empresa[["empresa", "status"]].values.tolist() == [["-", "SEM XML ❌"], ["EMPRESA_A", "OK ✅"]]
+    db.fechar()
+
+
+def test_xml_duplicado_soma_uma_vez(tmp_path: Path, monkeypatch):
+    import auditoria.audit as audit_mod
+    from auditoria.audit import AuditConfig
+
+    capturados = {}
+    monkeypatch.setattr(audit_mod, "gerar_relatorio", lambda rel, saida=None, **kw: capturados.setdefault("rel", rel) and "OK")
+    monkeypatch.setattr(audit_mod, "gerar_relatorio_avisos", lambda d, s, c, dup=None: capturados.setdefault("dup", dup) and "")
+
+    chave = "NFe35240112345678000199550010000001001000001001"
+    emp_a = tmp_path / "pasta" / "EMPRESA_A"
+    emp_b = tmp_path / "pasta" / "EMPRESA_B"
+    emp_a.mkdir(parents=True)
+    emp_b.mkdir(parents=True)
+    _write_nfe_xml(emp_a / "nf_100.xml", "100")
+    # mesma nota (mesmo Id) salva de novo em outra empresa e sem o envelope nfeProc
+    xml = (emp_a / "nf_100.xml").read_text(encoding="utf-8").replace("<infNFe>", f'<infNFe Id="{chave}">')
+    (emp_a / "nf_100.xml").write_text(xml, encoding="utf-8")
+    bare = xml.split("<NFe>", 1)[1].rsplit("</NFe>", 1)[0]
+    (emp_b / "nf_100_copia.xml").write_text(f"<NFe>{bare}</NFe>", encoding="utf-8")
+    # cópia byte a byte sem Id: cai no hash do conteúdo
+    _write_nfe_xml(emp_b / "nf_200.xml", "200", vNF="50.00")
+    (emp_b / "nf_200_bis.xml").write_bytes((emp_b / "nf_200.xml").read_bytes())
+
+    excel_path = tmp_path / "base.xlsx"
+    _write_minimal_excel(excel_path, [("100", 87.00, 3.000, 10.00, 1.00, 2.00)])
+    cfg = AuditConfig(db_path=str(tmp_path / "auditoria.db"))
+    auditar_pasta_pai(emp_a.parent, [emp_a, emp_b], str(excel_path), config=cfg)
+
+    por_nota = {r["Nota"]: r for r in capturados["rel"]}
+    assert "OK" in por_nota["100"]["Status"]
+    assert por_nota["100"]["Arquivo"] == "nf_100.xml"
+    assert "SEM EXCEL" in por_nota["200"]["Status"]
+    assert por_nota["200"]["Bruto XML"] == 50.0
+    assert sorted(d["Arquivo"] for d in capturados["dup"]) == ["nf_100_copia.xml", "nf_200_bis.xml"]
+    assert {d["Chave"] for d in capturados["dup"]} == {chave[3:], ""}
+
+
+def test_backend_duckdb_igual_ao_pandas(tmp_path: Path, monkeypatch):
+    import math
+
+    import auditoria.audit as audit_mod
+    from auditoria.audit import AuditConfig
+
+    capturados = []
+    monkeypatch.setattr(audit_mod, "gerar_relatorio", lambda rel, saida=None, **kw: capturados.append(rel) or "OK")
+    monkeypatch.setattr(audit_mod, "gerar_relatorio_avisos", lambda d, s, c, dup=None: capturados.append(s) or "")
+
+    emp_a = tmp_path / "pasta" / "EMPRESA_A"
+    emp_b = tmp_path / "pasta" / "EMPRESA_B"
+    emp_a.mkdir(parents=True)
+    emp_b.mkdir(parents=True)
+    _write_nfe_xml(emp_a / "nf_100.xml", "100")
+    _write_nfe_xml(emp_a / "nf_101.xml", "101", vNF="140.00", vol="9.000")
+    _write_nfe_xml(emp_b / "nf_101_parte2.xml", "101", vNF="10.00", vICMS="0", vPIS="0", vCOFINS="0", vol="1.000")
+    _write_nfe_xml(emp_b / "nf_200.xml", "200", vNF="50.00")
+    (emp_b / "nf_200_bis.xml").write_bytes((emp_b / "nf_200.xml").read_bytes())
+    _write_nfe_xml(emp_b / "nf_150.xml", "150", vNF="60.00")
+
+    excel_path = tmp_path / "base.xlsx"
+    _write_minimal_excel(excel_path, [
+        ("100", 87.00, 3.000, 10.00, 1.00, 2.00),
+        ("101", 100.00, 5.000, 0, 0, 0),
+        ("101", 27.00, 5.000, 0, 0, 0),
+        ("300", 10.00, 0, 0, 0, 0),
+        ("099", 5.00, 1.000, 0, 0, 0),
+    ])
+
+    for backend in ("pandas", "duckdb"):
+        cfg = AuditConfig(db_path=str(tmp_path / f"{backend}.db"), backend_conciliacao=backend)
+        auditar_pasta_pai(emp_a.parent, [emp_a, emp_b], str(excel_path), config=cfg)
+
+    rel_pd, sem_pd, rel_sql, sem_sql = capturados
+
+    def _normalizar(linhas):
+        return [
+            {k: (None if isinstance(v, float) and math.isnan(v) else round(v, 6) if isinstance(v, float) else v)
+             for k, v in r.items()}
+            for r in linhas
+        ]
+
+    assert _normalizar(rel_sql) == _normalizar(rel_pd)
+    assert _normalizar(sem_sql) == _normalizar(sem_pd)
+    assert [r["Nota"] for r in rel_sql] == ["100", "101", "300", "99", "150", "200"]
+    assert next(r for r in rel_sql if r["Nota"] == "101")["Arquivo"] == "nf_101.xml, nf_101_parte2.xml"
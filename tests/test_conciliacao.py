@@ -0,0 +1,71 @@
+import pandas as pd
+
+from auditoria.audit import AuditConfig
+from auditoria.conciliacao import conciliar, conciliar_sql
+from database import AuditDB
+
+
+def _xml(tipo="NF-e", vol=3.0, bruto=100.0, icms=10.0, pis=1.0, cofins=2.0, empresa="EMP"):
+    return {"Empresa": empresa, "Tipo": tipo, "Arquivos": ["a.xml"],
+            "Vol": vol, "Bruto": bruto, "ICMS": icms, "PIS": pis, "COFINS": cofins}
+
+
+def _dados():
+    df = pd.DataFrame({
+        "NF_Clean": ["1", "2", "3", "4", "5", "nan"],
+        "Mes": ["OUT"] * 6,
+        "Vol_Excel": [3.0, 9.0, 0.0, 1.0, 3.0, 0.0],
+        "Liq_Excel": [87.0, 10.0, 60.0, 5.0, 87.0, 0.0],
+        "ICMS_Excel": [0.0] * 6,
+        "PIS_Excel": [0.0, 0.0, 1.5, 0.0, 0.0, 0.0],
+        "COFINS_Excel": [0.0, 0.0, 7.0, 0.0, 0.0, 0.0],
+    })
+    xmls = {
+        "9": _xml(empresa="SOBRA"),
+        "1": _xml(),
+        "2": _xml(),
+        "3": _xml(tipo="CT-e", vol=0.0, bruto=80.0, icms=9.0, pis=0.0, cofins=0.0),
+        "5": _xml(bruto=200.0),
+    }
+    return df, xmls
+
+
+def test_conciliar_status_e_ordem():
+    df, xmls = _dados()
+    relatorio, sem_xml = conciliar(df, xmls, AuditConfig())
+    por_nota = {r["Nota"]: r for r in relatorio}
+
+    assert [r["Nota"] for r in relatorio] == ["1", "2", "3", "4", "5", "9"]
+    assert por_nota["1"]["Status"] == "OK ✅"
+    assert por_nota["2"]["Status"] == "ERRO VOL+VALOR ❌"
+    assert por_nota["5"]["Status"] == "ERRO VALOR ❌"
+    assert por_nota["4"]["Status"] == "SEM XML ❌"
+    assert por_nota["9"]["Status"] == "SEM EXCEL ❌"
+    # Sem coluna Empresa no Excel: vem do XML casado ("-" quando não há XML)
+    assert [por_nota[n]["Empresa"] for n in ("1", "4", "9")] == ["EMP", "-", "SOBRA"]
+    assert [r["Nota"] for r in sem_xml] == ["4"]
+
+    # CT-e sem PIS/COFINS no XML usa os do Excel: 80 - 9 - 1.5 - 7 = 62.5
+    cte = por_nota["3"]
+    assert cte["Obs"] == "CT-e: Usado impostos do Excel."
+    assert (cte["PIS"], cte["COFINS"]) == (1.5, 7.0)
+    assert cte["Liq XML (Calc)"] == 62.5
+    assert cte["Diff Vol"] == "-"
+    assert cte["Status"] == "OK ✅"
+
+
+def test_conciliar_sql_igual_ao_pandas(tmp_path):
+    df, xmls = _dados()
+    db = AuditDB(str(tmp_path / "a.db"))
+    db.inicializar()
+    db.iniciar_run()
+    db.salvar_excel(df)
+    db.salvar_xmls([
+        {"Nota": nota, "Tipo": d["Tipo"], "Empresa": d["Empresa"], "Arquivo": d["Arquivos"][0], "Ordem": i,
+         "Vol": d["Vol"], "Bruto": d["Bruto"], "ICMS": d["ICMS"], "PIS": d["PIS"], "COFINS": d["COFINS"]}
+        for i, (nota, d) in enumerate(xmls.items())
+    ])
+
+    cfg = AuditConfig()
+    assert conciliar_sql(db.con, db.run_id, cfg) == conciliar(df, xmls, cfg)
+    db.fechar()
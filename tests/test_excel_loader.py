@@ -20,3 +20,183 @@ def test_carregar_excel_minimo():
         base = carregar_excel(str(p))
         assert not base.empty
         assert base.iloc[0]["NF_Clean"] == "123"
+
+
+def test_carregar_excel_le_so_abas_do_mes(tmp_path, monkeypatch):
+    import auditoria.excel_loader as loader_mod
+
+    df = pd.DataFrame([
+        ["NOTA", "S/TRIBUTOS", "VOL"],
+        ["123", "87,00", "1"],
+    ])
+    p = tmp_path / "base.xlsx"
+    with pd.ExcelWriter(p, engine="openpyxl") as w:
+        for aba in ["HISTORICO_24_OUT", "OUT_25", "NOV_25", "RESUMO"]:
+            df.to_excel(w, sheet_name=aba, index=False, header=False)
+
+    lidas = []
+    read_excel = pd.read_excel
+
+    def read_excel_espiao(arquivo, sheet_name=None, **kw):
+        lidas.append(sheet_name)
+        return read_excel(arquivo, sheet_name=sheet_name, **kw)
+
+    monkeypatch.setattr(loader_mod.pd, "read_excel", read_excel_espiao)
+
+    assert loader_mod.listar_abas_alvo(str(p)) == ["OUT_25", "NOV_25"]
+    base = carregar_excel(str(p), mes_filtro="nov")
+    assert lidas == [["NOV_25"]]
+    assert base["Mes"].unique().tolist() == ["NOV_25"]
+
+    assert carregar_excel(str(p), mes_filtro="DEZ").empty
+
+
+def test_cabecalho_e_conteudo_vetorizados():
+    from auditoria.excel_loader import localizar_cabecalho, tem_conteudo
+
+    df = pd.DataFrame([
+        ["RELATÓRIO", None, None],
+        ["nota fiscal", "Valor", None],          # NOTA sem coluna de valor: não é cabeçalho
+        [None, "Nº Nota", "Líquido s/tributos"],
+        ["1", 2.5, None],
+    ], index=[10, 11, 12, 13])
+    assert localizar_cabecalho(df) == 12
+    assert localizar_cabecalho(df.iloc[:2]) == -1
+
+    col = pd.Series(["123", "  ", " nan ", None, 0, float("nan"), "x"], dtype=object)
+    assert tem_conteudo(col).tolist() == [True, False, False, False, True, False, True]
+
+
+def test_carregar_excel_streaming_igual_ao_pandas(tmp_path):
+    from auditoria.excel_loader import iterar_excel_streaming
+
+    df = pd.DataFrame([
+        ["RELATÓRIO", None, None, None],
+        ["NOTA", "S/TRIBUTOS", "VOL", "OBS"],
+        [True, "87,00", 1, "x"],
+        [None, "13,00", 2, None],   # célula mesclada: herda a nota de cima
+        [1, "10,00", 0, None],      # 1 == True: o pandas unifica no primeiro visto
+        ["NA", "5,00", 0, None],
+        ["456-1", "1.234,56", 3, None],
+        [None, 7, None, None],
+    ] + [[1000 + i, f"{i},50", i, None] for i in range(5)])
+    p = tmp_path / "base.xlsx"
+    with pd.ExcelWriter(p, engine="openpyxl") as w:
+        df.to_excel(w, sheet_name="OUT_25", index=False, header=False)
+        df.to_excel(w, sheet_name="NOV_25", index=False, header=False)
+
+    esperado = carregar_excel(str(p))
+    assert not esperado.empty
+    pd.testing.assert_frame_equal(carregar_excel(str(p), streaming=True), esperado)
+
+    blocos = list(iterar_excel_streaming(str(p), tamanho_bloco=2))
+    assert len(blocos) > 2
+    pd.testing.assert_frame_equal(pd.concat(blocos, ignore_index=True), esperado)
+
+
+def test_cache_de_abas_rele_so_a_aba_alterada(tmp_path, monkeypatch):
+    import auditoria.audit as audit_mod
+    from auditoria.audit import AuditConfig, carregar_excel_com_cache
+    from database import AuditDB
+
+    def _salvar(p, notas_nov):
+        with pd.ExcelWriter(p, engine="openpyxl") as w:
+            pd.DataFrame([["NOTA", "S/TRIBUTOS"], ["123", "87,00"]]).to_excel(
+                w, sheet_name="OUT_25", index=False, header=False)
+            pd.DataFrame([["NOTA", "S/TRIBUTOS"]] + [[n, "1,50"] for n in notas_nov]).to_excel(
+                w, sheet_name="NOV_25", index=False, header=False)
+            pd.DataFrame([["RESUMO"]]).to_excel(w, sheet_name="NOV_25_OBS", index=False, header=False)
+
+    lidas = []
+    carregar_abas = audit_mod.carregar_abas
+
+    def carregar_abas_espiao(caminho, abas, **kw):
+        lidas.append(list(abas))
+        return carregar_abas(caminho, abas, **kw)
+
+    monkeypatch.setattr(audit_mod, "carregar_abas", carregar_abas_espiao)
+
+    p = tmp_path / "base.xlsx"
+    db = AuditDB(str(tmp_path / "auditoria.db"))
+    db.inicializar()
+    try:
+        cfg = AuditConfig()
+        _salvar(p, ["456"])
+        primeira = carregar_excel_com_cache(db, str(p), cfg)
+        segunda = carregar_excel_com_cache(db, str(p), cfg)
+        pd.testing.assert_frame_equal(primeira, carregar_excel(str(p)))
+        pd.testing.assert_frame_equal(segunda, primeira)
+
+        _salvar(p, ["456", "789"])
+        terceira = carregar_excel_com_cache(db, str(p), cfg)
+        pd.testing.assert_frame_equal(terceira, carregar_excel(str(p)))
+        assert lidas == [["OUT_25", "NOV_25", "NOV_25_OBS"], [], ["NOV_25"]]
+
+        # cache_excel=False ignora o cache; podar mantém só as abas usadas mais recentemente
+        sem_cache = carregar_excel_com_cache(db, str(p), AuditConfig(cache_excel=False))
+        pd.testing.assert_frame_equal(sem_cache, terceira)
+        assert len(lidas) == 3
+        db.podar_cache_excel(1)
+        assert db.con.execute("SELECT aba FROM cache_excel").fetchall() == [("NOV_25",)]
+        assert db.con.execute("SELECT DISTINCT aba FROM cache_excel_linhas").fetchall() == [("NOV_25",)]
+    finally:
+        db.fechar()
+
+
+def test_layout_de_cabecalho_resolvido_uma_vez(tmp_path, monkeypatch, capsys):
+    import auditoria.excel_loader as loader_mod
+    from auditoria.audit import AuditConfig, carregar_excel_com_cache
+    from database import AuditDB
+
+    monkeypatch.setattr(loader_mod, "_LAYOUTS", {})
+    monkeypatch.setattr(loader_mod, "_LAYOUTS_NOVOS", {})
+    chamadas = []
+    mapear = loader_mod.mapear_colunas
+    monkeypatch.setattr(loader_mod, "mapear_colunas", lambda cols: chamadas.append(cols) or mapear(cols))
+
+    p = tmp_path / "base.xlsx"
+    with pd.ExcelWriter(p, engine="openpyxl") as w:
+        for aba in ["OUT_25", "NOV_25"]:
+            pd.DataFrame([["NOTA", "S/TRIBUTOS", "ICMS"], ["123", "87,00", "1,00"]]).to_excel(
+                w, sheet_name=aba, index=False, header=False)
+
+    db = AuditDB(str(tmp_path / "auditoria.db"))
+    db.inicializar()
+    try:
+        cfg = AuditConfig(cache_excel=False)
+        assert len(carregar_excel_com_cache(db, str(p), cfg)) == 2
+        assert len(chamadas) == 1
+        assert "(novo) -> nf='NOTA', liq='S/TRIBUTOS', vol=None, icms='ICMS'" in capsys.readouterr().out
+
+        # Outro processo: o layout vem do banco, sem refazer a detecção
+        monkeypatch.setattr(loader_mod, "_LAYOUTS", {})
+        assert len(carregar_excel_com_cache(db, str(p), cfg)) == 2
+        assert len(chamadas) == 1
+        assert "(conhecido)" in capsys.readouterr().out
+    finally:
+        db.fechar()
+
+
+def test_carregar_excel_paralelo_igual_ao_serial(tmp_path, monkeypatch):
+    import auditoria.excel_loader as loader_mod
+
+    p = tmp_path / "base.xlsx"
+    with pd.ExcelWriter(p, engine="openpyxl") as w:
+        for i, aba in enumerate(["OUT_25", "RESUMO", "NOV_25", "DEZ_25", "NOV_25_B"]):
+            linhas = [["NOTA", "S/TRIBUTOS", "VOL"]] + [[f"{i}{n:03d}", f"{n},10", n] for n in range(20)]
+            pd.DataFrame(linhas).to_excel(w, sheet_name=aba, index=False, header=False)
+
+    monkeypatch.setattr(loader_mod, "_LAYOUTS", {})
+    monkeypatch.setattr(loader_mod, "_LAYOUTS_NOVOS", {})
+
+    serial = carregar_excel(str(p))
+    paralelo = carregar_excel(str(p), workers=2)
+    pd.testing.assert_frame_equal(paralelo, serial)
+    pd.testing.assert_frame_equal(carregar_excel(str(p), streaming=True, workers=3), serial)
+    assert serial["Mes"].unique().tolist() == ["OUT_25", "NOV_25", "DEZ_25", "NOV_25_B"]
+
+    # O layout resolvido nos workers volta para o processo principal
+    loader_mod._LAYOUTS.clear()
+    loader_mod.layouts_novos()
+    carregar_excel(str(p), workers=2)
+    assert len(loader_mod.layouts_novos()) == 1
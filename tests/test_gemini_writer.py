@@ -0,0 +1,69 @@
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+import pandas as pd
+import pytest
+
+from auditoria import gemini_writer
+
+
+@pytest.fixture
+def servidor_gemini():
+    """Servidor HTTP local no lugar da API: responde sempre o mesmo texto e conta as chamadas."""
+    chamadas = []
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            chamadas.append(self.path)
+            self.rfile.read(int(self.headers["Content-Length"]))
+            resposta = {"candidates": [{"content": {"parts": [{"text": "1) Resumo Executivo\nTudo certo."}]}}]}
+            dados = json.dumps(resposta).encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(dados)))
+            self.end_headers()
+            self.wfile.write(dados)
+
+        def log_message(self, *args):
+            pass
+
+    srv = HTTPServer(("127.0.0.1", 0), Handler)
+    t = threading.Thread(target=srv.serve_forever, daemon=True)
+    t.start()
+    yield f"http://127.0.0.1:{srv.server_port}", chamadas
+    srv.shutdown()
+    srv.server_close()
+
+
+def _df(status="OK ✅"):
+    return pd.DataFrame({"Nota": ["1", "2"], "Status": [status, "ERRO VALOR ❌"], "Diff R$": [0.0, 12.5], "Obs": ["", "x"]})
+
+
+def test_cache_evita_segunda_chamada(tmp_path, servidor_gemini):
+    url, chamadas = servidor_gemini
+    kw = dict(api_key="teste", base_url=url, cache_dir=str(tmp_path))
+
+    primeiro = gemini_writer.gerar_texto_pdf_com_gemini(_df(), **kw)
+    segundo = gemini_writer.gerar_texto_pdf_com_gemini(_df(), **kw)
+
+    assert primeiro == segundo == ["1) Resumo Executivo", "Tudo certo."]
+    assert len(chamadas) == 1
+    assert "/v1/models/gemini-2.5-flash:generateContent" in chamadas[0]
+
+    # Payload diferente = chave diferente
+    gemini_writer.gerar_texto_pdf_com_gemini(_df("PENDENTE"), **kw)
+    assert len(chamadas) == 2
+
+
+def test_cache_expira_e_e_podado(tmp_path, servidor_gemini):
+    url, chamadas = servidor_gemini
+    kw = dict(api_key="teste", base_url=url, cache_dir=str(tmp_path))
+
+    gemini_writer.gerar_texto_pdf_com_gemini(_df(), **kw)
+    gemini_writer.gerar_texto_pdf_com_gemini(_df(), cache_ttl_s=-1, **kw)
+    assert len(chamadas) == 2
+
+    for st in ["A", "B", "C"]:
+        gemini_writer.gerar_texto_pdf_com_gemini(_df(st), cache_max_entradas=2, **kw)
+    assert len(list(tmp_path.glob("*.json"))) == 2
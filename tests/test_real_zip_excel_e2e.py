@@ -1,13 +1,12 @@
 from __future__ import annotations
 
 import json
-import zipfile
 from pathlib import Path
 from typing import Any, Dict, List, Optional
 
 import pytest
 
-from auditoria.audit import auditar_pasta_pai, AuditConfig
+from auditoria.audit import auditar_pasta_pai, AuditConfig, listar_empresas_zip
 
 
 CONFIG_FILE = Path(__file__).resolve().parents[1] / "test_config.json"
@@ -45,28 +44,16 @@ def paths(cfg: dict, mes_alvo: str) -> Dict[str, Path]:
 
 
 @pytest.fixture
-def pasta_pai_extraida(tmp_path: Path, paths: Dict[str, Path]) -> Path:
-    root = tmp_path / "pasta_pai"
-    root.mkdir(parents=True, exist_ok=True)
-
-    with zipfile.ZipFile(paths["zip"], "r") as z:
-        z.extractall(root)
-
-    return root
-
-
-@pytest.fixture
-def empresas(pasta_pai_extraida: Path) -> List[Path]:
-    dirs = [p for p in pasta_pai_extraida.iterdir() if p.is_dir()]
-    dirs.sort(key=lambda p: p.name.lower())
-    return dirs
+def empresas(paths: Dict[str, Path]) -> List[str]:
+    # XMLs são lidos direto do ZIP: as pastas de 1º nível são as empresas
+    return listar_empresas_zip(paths["zip"])
 
 
 @pytest.fixture
 def capturar_relatorio(monkeypatch: pytest.MonkeyPatch) -> Dict[str, Any]:
     captured: Dict[str, Any] = {"relatorio": None, "resumo": None}
 
-    def fake_gerar_relatorio(relatorio: List[Dict], saida: Optional[str] = None, resumo: Optional[List[Dict]] = None) -> str:
+    def fake_gerar_relatorio(relatorio: List[Dict], saida: Optional[str] = None, resumo: Optional[List[Dict]] = None, **kw) -> str:
         captured["relatorio"] = relatorio
         captured["resumo"] = resumo
         return "RELATORIO_OK"
@@ -83,8 +70,7 @@ def _find_items(relatorio: List[Dict[str, Any]], status: str) -> List[Dict[str,
 def test_e2e_real_zip_excel_por_mes(
     mes_alvo: str,
     paths: Dict[str, Path],
-    pasta_pai_extraida: Path,
-    empresas: List[Path],
+    empresas: List[str],
     capturar_relatorio: Dict[str, Any],
     monkeypatch: pytest.MonkeyPatch,
 ) -> None:
@@ -97,7 +83,7 @@ def test_e2e_real_zip_excel_por_mes(
     loader_mod.ANO_ALVO = "25"
 
     out = auditar_pasta_pai(
-        pasta_pai=pasta_pai_extraida,
+        pasta_pai=paths["zip"],
         empresas=empresas,
         excel_path=str(paths["excel"]),
         saida=None,
@@ -0,0 +1,128 @@
+import threading
+
+import duckdb
+import pandas as pd
+from openpyxl import load_workbook
+
+from auditoria import audit as audit_mod
+from auditoria import report
+
+
+def test_gerar_relatorio_estilos_compartilhados(tmp_path, monkeypatch):
+    monkeypatch.setattr(report, "HAS_REPORTLAB", False)
+    linhas = [
+        {"Nota": str(i), "Liq Excel": float(i), "Status": st}
+        for i, st in enumerate(["OK ✅", "ERRO VALOR ❌", "SEM XML ❌", "PENDENTE"] * 50)
+    ]
+    saida = report.gerar_relatorio(linhas, str(tmp_path / "saida.xlsx"))
+
+    wb = load_workbook(saida)
+    ws = wb["Resultado Auditoria"]
+    cab = [c.value for c in ws[1]]
+    assert cab[:4] == ["Arquivo", "Tipo", "Nota", "Empresa"] and cab[-2:] == ["Status", "Obs"]
+    assert ws.max_row == 201
+    assert ws["A1"].style == "Auditoria Cabeçalho"
+
+    col_liq = cab.index("Liq Excel") + 1
+    cel = ws.cell(row=3, column=col_liq)
+    assert cel.value == 1.0 and cel.number_format == "#,##0.00"
+
+    # Cores por Status: 3 regras na aba, não um estilo por célula
+    regras = [r for cf in ws.conditional_formatting for r in cf.rules]
+    assert len(regras) == 3
+    assert "SEARCH(\"OK\",$R2)" in regras[0].formula[0]
+    assert len(wb._cell_styles) <= 4
+
+
+def test_gerar_relatorio_avisos_cor_padrao(tmp_path):
+    df_dup = pd.DataFrame({"Mes": ["OUT", "OUT"], "NF_Clean": ["2", "1"], "Liq_Excel": [5.0, 7.0]})
+    sem_xml = [{"Nota": "9", "Mes": "OUT", "Liq Excel": 3.0, "Status": "SEM XML ❌", "Obs": "-"}]
+    caminho = report.gerar_relatorio_avisos(df_dup, sem_xml, str(tmp_path / "Auditoria_Resultado_x.xlsx"))
+
+    wb = load_workbook(caminho)
+    assert wb.sheetnames == ["Duplicadas no Excel", "Faltam XMLs"]
+    dup = wb["Duplicadas no Excel"]
+    assert [c.value for c in dup["B"]][1:] == ["1", "2"]
+    assert dup["A2"].fill.start_color.rgb.endswith("FFFFE0")
+    assert not list(dup.conditional_formatting)
+    assert len(list(wb["Faltam XMLs"].conditional_formatting)) == 1
+
+
+def test_falha_no_pdf_ou_avisos_nao_derruba_o_resultado(tmp_path, monkeypatch):
+    def _quebrado(*a, **kw):
+        raise RuntimeError("Gemini fora do ar / arquivo travado")
+
+    monkeypatch.setattr(report, "HAS_REPORTLAB", True)
+    monkeypatch.setattr(report, "_gerar_pdf_resumo", _quebrado)
+    monkeypatch.setattr(audit_mod, "gerar_relatorio_avisos", _quebrado)
+    linhas = [{"Nota": "1", "Status": "OK ✅"}]
+    sem_xml = [{"Nota": "9", "Mes": "OUT", "Status": "SEM XML ❌"}]
+    saida = str(tmp_path / "Auditoria_Resultado_x.xlsx")
+
+    resultado, avisos = audit_mod.gerar_arquivos(linhas, saida, pd.DataFrame(), sem_xml, [])
+
+    assert (resultado, avisos) == (saida, "")
+    assert load_workbook(resultado)["Resultado Auditoria"]["C2"].value == "1"
+
+
+def test_gerar_arquivos_avisos_usa_nome_do_resultado(tmp_path, monkeypatch):
+    monkeypatch.setattr(report, "HAS_REPORTLAB", False)
+    sem_xml = [{"Nota": "9", "Mes": "OUT", "Status": "SEM XML ❌"}]
+
+    resultado, avisos = audit_mod.gerar_arquivos(
+        [{"Nota": "1"}], str(tmp_path / "Auditoria_Resultado_x.xlsx"), pd.DataFrame(), sem_xml, []
+    )
+
+    assert avisos == str(tmp_path / "AVISOS" / "Auditoria_AVISOS_x.xlsx")
+    assert load_workbook(avisos).sheetnames == ["Faltam XMLs"]
+
+
+def test_gerar_relatorio_parquet_csv_e_xlsx_so_divergentes(tmp_path, monkeypatch):
+    monkeypatch.setattr(report, "HAS_REPORTLAB", False)
+    monkeypatch.setattr(report, "CSV_LINHAS_POR_BLOCO", 3)
+    linhas = [
+        {"Nota": str(i), "Liq Excel": float(i), "Diff Vol": "-" if i % 2 else 0.5,
+         "Status": "OK ✅" if i % 3 else "ERRO VALOR ❌"}
+        for i in range(10)
+    ]
+    saida = str(tmp_path / "saida.xlsx")
+
+    out = report.gerar_relatorio(linhas, saida, formatos=("xlsx", "parquet", "csv"), xlsx_so_divergentes=True)
+
+    assert out == saida
+    df_csv = pd.read_csv(tmp_path / "saida.csv", dtype={"Nota": str})
+    df_pq = duckdb.sql(f"SELECT * FROM '{tmp_path / 'saida.parquet'}'").df()
+    for df in (df_csv, df_pq):
+        assert list(df.columns) == list(report._df_relatorio(linhas).columns)
+        assert df["Nota"].tolist() == [str(i) for i in range(10)]
+        assert df["Diff Vol"].isna().sum() == 5
+    assert df_pq["Liq Excel"].dtype == "float64"
+
+    ws = load_workbook(out)["Resultado Auditoria"]
+    assert [r[2] for r in ws.iter_rows(min_row=2, values_only=True)] == ["0", "3", "6", "9"]
+
+
+def test_gerar_relatorio_sem_xlsx(tmp_path, monkeypatch):
+    monkeypatch.setattr(report, "HAS_REPORTLAB", False)
+    out = report.gerar_relatorio([{"Nota": "1"}], str(tmp_path / "saida.xlsx"), formatos=("parquet",))
+
+    assert out == str(tmp_path / "saida.parquet")
+    assert not (tmp_path / "saida.xlsx").exists()
+
+
+def test_gerar_arquivos_nao_espera_o_pdf(tmp_path, monkeypatch):
+    liberar, gerado = threading.Event(), threading.Event()
+
+    def _pdf_lento(caminho, df):
+        liberar.wait(10)  # ex.: Gemini demorando até o timeout
+        gerado.set()
+
+    monkeypatch.setattr(report, "HAS_REPORTLAB", True)
+    monkeypatch.setattr(report, "_gerar_pdf_resumo", _pdf_lento)
+
+    resultado, _ = audit_mod.gerar_arquivos([{"Nota": "1"}], str(tmp_path / "x.xlsx"), pd.DataFrame(), [], [])
+
+    assert load_workbook(resultado)["Resultado Auditoria"]["C2"].value == "1"
+    assert not gerado.is_set()
+    liberar.set()
+    assert gerado.wait(10)
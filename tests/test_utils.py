@@ -0,0 +1,37 @@
+import math
+
+import pandas as pd
+
+from auditoria.utils import limpar_numero_nf_bruto, limpar_numero_nf_series, to_float, to_float_series
+
+
+def test_to_float_series_igual_ao_to_float():
+    valores = [
+        "1.234,56", "1,234,56", "R$ 10,00", "87,00", " 1 2 , 3", "12.5", "1.000.000",
+        "", "-", "TOTAL", None, float("nan"), pd.NA, 5, 2.5, True, "87,00", 5,
+    ]
+    s = pd.Series(valores, dtype=object, index=range(10, 10 + len(valores)), name="LIQ")
+
+    out = to_float_series(s)
+
+    assert list(out.index) == list(s.index) and out.name == "LIQ"
+    assert out.tolist() == [to_float(v) for v in valores]
+    assert out.iloc[:3].tolist() == [1234.56, 1234.56, 10.0]
+
+
+def test_to_float_series_coluna_numerica_passa_direto():
+    s = pd.Series([1.5, math.nan, 3.0])
+    assert to_float_series(s).tolist() == [1.5, 0.0, 3.0]
+
+
+def test_limpar_numero_nf_series_igual_ao_escalar():
+    valores = ["000123", "NF 1.234-5", "77/2025", "  ", "SEM NUMERO", None, 4567, "-12", "0"]
+    s = pd.Series(valores, dtype=object)
+
+    out = limpar_numero_nf_series(s)
+    assert out.tolist() == [limpar_numero_nf_bruto(v) for v in valores]
+    assert out.tolist() == ["123", "1234", "77", "", "", "", "4567", "", "0"]
+
+    chaves = limpar_numero_nf_series(s, como_inteiro=True)
+    assert str(chaves.dtype) == "Int64"
+    assert chaves.iloc[0] == 123 and pd.isna(chaves.iloc[3])
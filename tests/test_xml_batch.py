@@ -0,0 +1,40 @@
+from pathlib import Path
+
+import auditoria.xml_batch as batch_mod
+from auditoria.xml_batch import parse_xmls_em_lotes
+from auditoria.xml_parser import parse_xml_file
+
+
+def _write_nfe(path: Path, nNF: str, vNF: str):
+    path.write_text(
+        f"""<?xml version="1.0"?>
+<nfeProc xmlns="http://www.portalfiscal.inf.br/nfe"><NFe><infNFe>
+  <ide><nNF>{nNF}</nNF></ide>
+  <det nItem="1"><prod><uCom>M3</uCom><qCom>1.5</qCom></prod></det>
+  <total><ICMSTot><vNF>{vNF}</vNF><vICMS>1.00</vICMS><vPIS>0.10</vPIS><vCOFINS>0.20</vCOFINS></ICMSTot></total>
+</infNFe></NFe></nfeProc>
+""",
+        encoding="utf-8",
+    )
+
+
+def test_parse_paralelo_igual_ao_serial(tmp_path: Path, monkeypatch):
+    caminhos = []
+    for i in range(25):
+        p = tmp_path / f"nf_{i:03d}.xml"
+        _write_nfe(p, str(1000 + i), f"{100 + i}.00")
+        caminhos.append(str(p))
+    # arquivo inválido no meio: vira None nas duas formas
+    ruim = tmp_path / "quebrado.xml"
+    ruim.write_text("<nfeProc>", encoding="utf-8")
+    caminhos.insert(7, str(ruim))
+
+    monkeypatch.setattr(batch_mod, "MIN_ARQUIVOS_PARALELO", 0)
+
+    serial = [i for lote in parse_xmls_em_lotes(caminhos, workers=1) for i in lote]
+    paralelo = [i for lote in parse_xmls_em_lotes(caminhos, workers=2, tamanho_lote=4) for i in lote]
+
+    assert paralelo == serial
+    assert serial[7] is None
+    assert serial[0] == parse_xml_file(caminhos[0])
+    assert [i["Nota"] for i in serial if i] == [str(1000 + i) for i in range(25)]
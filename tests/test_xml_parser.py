@@ -1,7 +1,7 @@
 import tempfile
 from pathlib import Path
 
-from auditoria.xml_parser import parse_xml_file
+from auditoria.xml_parser import parse_xml_file, parse_xml_streaming
 
 
 def test_parse_nfe_minimo():
@@ -29,3 +29,89 @@ def test_parse_nfe_minimo():
         assert info["Nota"] == "123"
         assert info["Bruto"] == 100.0
         assert info["Liq_Calc"] == 87.0
+
+
+def test_parse_nfe_soma_itens_m3():
+    itens = "".join(
+        f"<det nItem=\"{i}\"><prod><uCom>{u}</uCom><qCom>{q}</qCom></prod>"
+        f"<imposto><ICMS><ICMS00><vICMS>9.99</vICMS></ICMS00></ICMS></imposto></det>"
+        for i, (u, q) in enumerate([("M3", "1.5"), ("KG", "100"), ("NM³", "2,5")], start=1)
+    )
+    xml = f"""<?xml version="1.0"?>
+    <nfeProc xmlns="http://www.portalfiscal.inf.br/nfe"><NFe><infNFe Id="NFe1">
+      <ide><nNF>000456</nNF></ide>{itens}
+      <total><ICMSTot><vNF>200.00</vNF><vICMS>20.00</vICMS><vPIS>0</vPIS><vCOFINS>0</vCOFINS></ICMSTot></total>
+      <transp><vol><qVol>99</qVol></vol></transp>
+    </infNFe></NFe></nfeProc>
+    """
+    with tempfile.TemporaryDirectory() as d:
+        p = Path(d) / "nfe.xml"
+        p.write_text(xml, encoding="utf-8")
+        info = parse_xml_file(str(p))
+        assert info["Nota"] == "456"
+        assert info["Vol"] == 4.0  # só itens M3/NM3; qVol do transporte é ignorado
+        assert info["ICMS"] == 20.0
+        assert info["Liq_Calc"] == 180.0
+
+
+def test_parse_cte_minimo():
+    xml = """<?xml version="1.0"?>
+    <cteProc xmlns="http://www.portalfiscal.inf.br/cte"><CTe><infCte Id="CTe1">
+      <ide><nCT>77</nCT></ide>
+      <vPrest><vTPrest>1000.00</vTPrest></vPrest>
+      <imp><ICMS><ICMS00><vICMS>120.00</vICMS></ICMS00></ICMS></imp>
+      <infCTeNorm><infCarga>
+        <infQ><cUnid>01</cUnid><qCarga>0.0000</qCarga></infQ>
+        <infQ><cUnid>00</cUnid><qCarga>35.5</qCarga></infQ>
+      </infCarga></infCTeNorm>
+    </infCte></CTe></cteProc>
+    """
+    with tempfile.TemporaryDirectory() as d:
+        p = Path(d) / "cte.xml"
+        p.write_text(xml, encoding="utf-8")
+        info = parse_xml_file(str(p))
+        assert info["Tipo"] == "CT-e"
+        assert info["Nota"] == "77"
+        assert info["Vol"] == 35.5
+        assert info["ICMS"] == 120.0
+        assert info["Liq_Calc"] == 880.0
+
+
+def test_parse_streaming_igual_ao_arvore():
+    itens = "".join(
+        f"<det nItem=\"{i}\"><prod><uCom>M3</uCom><qCom>{i}.25</qCom></prod></det>" for i in range(1, 301)
+    )
+    xml = f"""<?xml version="1.0"?>
+    <nfeProc xmlns="http://www.portalfiscal.inf.br/nfe"><NFe><infNFe Id="NFe1">
+      <ide><nNF>9</nNF></ide>{itens}
+      <total><ICMSTot><vNF>5000.00</vNF><vICMS>500.00</vICMS><vPIS>10</vPIS><vCOFINS>40</vCOFINS></ICMSTot></total>
+      <transp><vol><qVol>1</qVol></vol></transp>
+      <infAdic><infCpl>{"OBS " * 5000}</infCpl></infAdic>
+    </infNFe></NFe><protNFe/></nfeProc>
+    """
+    with tempfile.TemporaryDirectory() as d:
+        p = Path(d) / "nfe.xml"
+        p.write_text(xml, encoding="utf-8")
+        arvore = parse_xml_file(str(p))
+        assert parse_xml_file(str(p), streaming=True) == arvore
+        with open(p, "rb") as f:
+            assert parse_xml_streaming(f) == arvore
+
+
+def test_parse_streaming_cte_com_impostos_depois_da_carga():
+    # vPIS/vCOFINS depois do imp/infCTeNorm: o streaming não pode parar na primeira carga
+    xml = """<?xml version="1.0"?>
+    <cteProc xmlns="http://www.portalfiscal.inf.br/cte"><CTe><infCte Id="CTe1">
+      <ide><nCT>78</nCT></ide>
+      <vPrest><vTPrest>1000.00</vTPrest></vPrest>
+      <imp><ICMS><ICMS00><vICMS>120.00</vICMS></ICMS00></ICMS></imp>
+      <infCTeNorm><infCarga><infQ><cUnid>00</cUnid><qCarga>35.5</qCarga></infQ></infCarga></infCTeNorm>
+      <infAdic><vPIS>16.50</vPIS><vCOFINS>76.00</vCOFINS></infAdic>
+    </infCte></CTe></cteProc>
+    """
+    with tempfile.TemporaryDirectory() as d:
+        p = Path(d) / "cte.xml"
+        p.write_text(xml, encoding="utf-8")
+        arvore = parse_xml_file(str(p))
+        assert (arvore["PIS"], arvore["COFINS"]) == (16.5, 76.0)
+        assert parse_xml_file(str(p), streaming=True) == arvore